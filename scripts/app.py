@@ -1,31 +1,30 @@
-# for event handling
-from waiting import wait
-
-# for background waiting function, use multiproccecing
-from multiprocessing import Process, Manager
-
-# for using a shared memory variables
-import ctypes
+# for event handling, the rabbitmq callbacks fire transitions on the run state and we block until they happen
+from run_state import RunState
 
 import logging
 from logging import handlers
 
-# for easy use of rabbitmq
-from rabbitmq_handler import RabbitmqHandler
-# for easy read/write on mongodb
-from mongodb_handler import MongodbHandler
+# the rabbitmq and mongodb handlers, connected on first use
+from service import Service
 
 from json import dumps, loads
+# for timing the run's stages
+from tracing import tracer
 
 import time
 
+import os
+
+import uuid
+
 
 logging_file = None
 logging_level = logging.DEBUG
-rmq_handler = RabbitmqHandler(logging_level)
-mdb_handler = MongodbHandler()
-manager = Manager()
-flags = manager.dict()
+service = Service('app', logging_level, logging_file)
+# the run's messages on a queue of its own (through the runs exchange) instead of the shared queues, for controllers
+# in the 'multi' mode which drive the runs of many apps at once
+run_scoped = os.getenv('RUN_SCOPED', '0') == '1'
+run_state = RunState(tests_list_ready=False, tests_list_id='', device_ids_ready=True, all_results_ready=False, pdf_ready=False, pdf_link='')
 
 # for logging
 logger = logging.getLogger('app')
@@ -51,20 +50,7 @@ def configure_logger_logging(logging_level):
     # add the handlers to logger
     logger.addHandler(console_handler)
 
-def can_i_start_running():
-    message = 'app: tests_list_ready flag - %s' % flags[1]['tests_list_ready']
-    logger.debug(message)
-    return (flags[1]['tests_list_ready'] and flags[1]['device_ids_ready'])
-
-def are_all_results_ready():
-    return flags[1]['all_results_ready']
-
-def is_pdf_ready():
-    message = 'app: pdf_ready flag - {0}'.format(flags[1]['pdf_ready'])
-    logger.debug(message)
-    return flags[1]['pdf_ready']
-
-def create_setup():
+def create_setup(run_id=None):
     message = 'app: creating setup...'
     logger.info(message)
     #time.sleep(1)
@@ -81,60 +67,95 @@ def create_setup():
 	    ]
     }
     '''
-    uid = mdb_handler.insert_document('Configuration', loads(json_document_setup_example))
+    setup = loads(json_document_setup_example)
+    with tracer.span('create_setup'):
+        uid = service.mdb_handler.insert_document('Configuration', setup)
     message = 'app: sending set up ready'
     logger.info(message)
-    rmq_handler.send('', 'setup_ready', str(uid))   
+    if run_id is not None and service.rmq_handler.codec is not None:
+        service.rmq_handler.send_data_to_run(run_id, 'setup_ready', setup)
+    elif run_id is not None:
+        service.rmq_handler.send_to_run(run_id, 'setup_ready', str(uid))
+    elif service.rmq_handler.codec is not None:
+        # the whole setup (with the _id it got when it was inserted), the controller doesn't have to read it back
+        service.rmq_handler.send_data('', 'setup_ready', setup)
+    else:
+        service.rmq_handler.send('', 'setup_ready', str(uid))   
+    return uid
 
 # creating an event handler for when getting a message when test list ready and got devices
 def before_running_event_handler():
 
     message = 'app: im waiting for test list and devices ready'
     logger.info(message)
-    tests_list_ready_listener = Process(target=rmq_handler.wait_for_message, args=('tests_list', flags,))
-    #device_ids__ready_listener = Process(target=rmq_handler.wait_for_message, args=('device_ids', flags,))
+    # add 'device_ids' once the devices are published
+    tests_list_ready_listener = service.listening_handler.listen(['tests_list'], run_state)
 
-    tests_list_ready_listener.start()
-    #device_ids__ready_listener.start()
-    wait(lambda: can_i_start_running(), waiting_for="test list and device list to be ready")
-    #time.sleep(3)
-    tests_list_ready_listener.terminate()
-    #device_ids__ready_listener.terminate()
+    run_state.wait_for('tests_list_ready', 'device_ids_ready')
+    tests_list_ready_listener.stop()
+    message = 'app: tests_list_ready flag - %s' % run_state.get('tests_list_ready')
+    logger.debug(message)
 
 def results_event_handler():
     message = 'app: im waiting for results ready'
     logger.info(message)
-    results_listener = Process(target=rmq_handler.wait_for_message, args=('results', flags,))
-    all_results_ready_listener = Process(target=rmq_handler.wait_for_message, args=('all_results_ready', flags,))
+    results_listener = service.listening_handler.listen(['results', 'all_results_ready'], run_state)
 
-    results_listener.start()
-    all_results_ready_listener.start()
-    wait(lambda: are_all_results_ready(), waiting_for="all results to be ready")
-    #time.sleep(3)
-    results_listener.terminate()
-    all_results_ready_listener.terminate()
+    run_state.wait_for('all_results_ready')
+    results_listener.stop()
 
 def getting_pdf_event_handler():
     message = 'app: im waiting for pdf ready'
     logger.info(message)
-    pdf_ready_listener = Process(target=rmq_handler.wait_for_message, args=('pdf_ready', flags,))
+    pdf_ready_listener = service.listening_handler.listen(['pdf_ready'], run_state)
 
-    pdf_ready_listener.start()
-    wait(lambda: is_pdf_ready(), waiting_for="pdf to be ready")
-    #time.sleep(3)
-    pdf_ready_listener.terminate()
+    run_state.wait_for('pdf_ready')
+    pdf_ready_listener.stop()
+    message = 'app: pdf_ready flag - {0}'.format(run_state.get('pdf_ready'))
+    logger.debug(message)
 
 
+# the run's counts from its summary document, the results themselves aren't read. the app of a run scoped flow
+# knows its run, the others know their setup only and its latest run is theirs
+def log_run_summary(setup_id, run_id=None):
+    if run_id is not None:
+        summary = service.mdb_handler.get_run_summary(run_id)
+    else:
+        summary = service.mdb_handler.find_run_summary(setup_id)
+    if summary is None:
+        message = 'app: no results for setup %s' % setup_id
+    else:
+        message = 'app: %d results, %d passed, %d failed' % (summary['total'], summary.get('Pass', 0), summary.get('Fail', 0))
+    logger.info(message)
+
 def app_flow():
     before_running_event_handler()
-    create_setup()
+    uid = create_setup()
     results_event_handler()
+    log_run_summary(uid)
     getting_pdf_event_handler()
     print('app: controller thanks for everything, you may need to think of another name though')
 
-if __name__ == '__main__':
-    flags[1] = {'tests_list_ready' : False, 'device_ids_ready' : True, 'all_results_ready' : False, 'pdf_ready' : False}
+# the run's queue is bound before the setup is sent, so none of the run's messages can come before it
+def run_scoped_flow():
+    run_id = str(uuid.uuid4())
+    run_listener = service.rmq_handler.listen_to_run(run_id, ['results', 'all_results_ready', 'pdf_ready'], run_state)
+    uid = create_setup(run_id)
+    message = 'app: im waiting for the results and the pdf of run %s' % run_id
+    logger.info(message)
+    run_state.wait_for('all_results_ready', 'pdf_ready')
+    run_listener.stop()
+    log_run_summary(uid, run_id)
+    message = 'app: run %s is done - %s' % (run_id, run_state.get('pdf_link'))
+    logger.info(message)
 
+if __name__ == '__main__':
     configure_logger_logging(logging_level)
-
-    app_flow()
+    # the app listens first, mongodb connects meanwhile
+    service.start('mdb_handler')
+
+    if run_scoped:
+        run_scoped_flow()
+    else:
+        app_flow()
+    service.stop()
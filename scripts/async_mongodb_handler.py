@@ -0,0 +1,165 @@
+# for asyncio use of mongodb, with pymongo's own async client (the successor of motor)
+from pymongo import AsyncMongoClient
+from bson.objectid import ObjectId
+
+import asyncio
+
+# for access of environment variables
+import os
+
+# for running the event loop in the background of a blocking flow
+import threading
+
+import time
+
+import weakref
+
+from collections import deque
+
+from mongodb_handler import (BufferedWriter, mongo_operation, mongo_uri, client_options, summary_increments,
+                             RUN_SUMMARIES_COLLECTION)
+
+# the handlers of the process, they forget their client and their loop in a forked child
+handlers = weakref.WeakSet()
+
+
+# a single async client per process, on an event loop of its own in a background thread. the coroutines run on that
+# loop whoever calls them: call() awaits them from any other loop (the async consumers'), run() blocks a thread on
+# them (the test executor's), and submit() hands out a future without waiting. the client is made on the first call
+# of the process, a forked child makes a client of its own and never touches the sockets of its parent's.
+class AsyncMongodbHandler:
+    def __init__(self):
+        self.db_name = os.getenv('DB_NAME')
+        self.reset()
+        handlers.add(self)
+
+    # in a forked child the loop's thread doesn't exist, the parent's client is dropped without being closed
+    def reset(self):
+        self.lock = threading.Lock()
+        self.loop = None
+        self.client = None
+        self.db = None
+
+    def start(self):
+        with self.lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='mongo-loop', daemon=True).start()
+                self.client = AsyncMongoClient(mongo_uri(), **client_options())
+                self.db = self.client[self.db_name]
+                self.loop = loop
+        return self.loop
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.start())
+
+    async def call(self, coroutine):
+        loop = self.start()
+        if asyncio.get_running_loop() is loop:
+            return await coroutine
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+    def run(self, coroutine):
+        return self.submit(coroutine).result()
+
+    async def insert_document(self, collection_name, document):
+        with mongo_operation('insert_one', collection_name):
+            return (await self.db[collection_name].insert_one(document)).inserted_id
+
+    async def insert_documents(self, collection_name, documents):
+        with mongo_operation('insert_many', collection_name):
+            return (await self.db[collection_name].insert_many(documents, ordered=True)).inserted_ids
+
+    # the ids are passed over rabbitmq as strings
+    async def get_document_by_id(self, collection_name, uid):
+        with mongo_operation('find_one', collection_name):
+            return await self.db[collection_name].find_one({'_id' : ObjectId(uid)})
+
+    async def get_documents_list(self, collection_name, field, value, projection=None, sort=None, limit=0):
+        with mongo_operation('find', collection_name):
+            cursor = self.db[collection_name].find({field : value}, projection, limit=limit)
+            if sort is not None:
+                cursor = cursor.sort(sort)
+            return await cursor.to_list()
+
+    async def aggregate(self, collection_name, pipeline):
+        with mongo_operation('aggregate', collection_name):
+            return await (await self.db[collection_name].aggregate(pipeline)).to_list()
+
+    # the runs of the batch are updated concurrently, see MongodbHandler.update_run_summary
+    async def update_run_summary(self, results):
+        async def update(run_id, setup_id, increment):
+            with mongo_operation('update_one', RUN_SUMMARIES_COLLECTION):
+                await self.db[RUN_SUMMARIES_COLLECTION].update_one({'_id' : run_id},
+                                                                   {'$inc' : increment,
+                                                                    '$set' : {'setup_id' : setup_id, 'updated_at' : time.time()}},
+                                                                   upsert=True)
+        await asyncio.gather(*[update(run_id, setup_id, increment)
+                               for (run_id, setup_id), increment in summary_increments(results).items()])
+
+    # like MongodbHandler.buffered_writer, the batches are inserted in the background, see AsyncBufferedWriter
+    def buffered_writer(self, collection_name, max_batch_size=100, max_delay=1.0, on_flush=None, max_in_flight=4):
+        return AsyncBufferedWriter(self, collection_name, max_batch_size, max_delay, on_flush, max_in_flight)
+
+
+def reset_after_fork():
+    for handler in list(handlers):
+        handler.reset()
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+
+# a BufferedWriter whose batches are inserted on the handler's loop while the adding thread goes on, up to
+# max_in_flight batches at once. on_flush is still called from the adding thread and in the order the batches were
+# added, for every inserted batch on the next add/flush_if_due call, so a non thread safe on_flush is fine.
+# flush() waits for every batch in flight, and an insert which failed raises from the call which reports it.
+class AsyncBufferedWriter(BufferedWriter):
+    def __init__(self, handler, collection_name, max_batch_size, max_delay, on_flush=None, max_in_flight=4):
+        super().__init__(None, max_batch_size, max_delay, on_flush)
+        self.handler = handler
+        self.collection_name = collection_name
+        self.max_in_flight = max_in_flight
+        # (future of the inserted ids, documents) of every batch which wasn't reported yet, the oldest first
+        self.in_flight = deque()
+
+    def add(self, document):
+        with self.lock:
+            if not self.buffer:
+                self.oldest_time = time.time()
+            self.buffer.append(document)
+            if len(self.buffer) >= self.max_batch_size or self.is_due():
+                self.send()
+            return self.report(wait=False)
+
+    def flush_if_due(self):
+        with self.lock:
+            if self.is_due():
+                self.send()
+            return self.report(wait=False)
+
+    def flush(self):
+        with self.lock:
+            self.send()
+            return self.report(wait=True)
+
+    # a full pipeline waits for its oldest batch first
+    def send(self):
+        if not self.buffer:
+            return
+        documents = self.buffer
+        self.buffer = []
+        while len(self.in_flight) >= self.max_in_flight:
+            self.in_flight[0][0].result()
+            self.report(wait=False)
+        self.in_flight.append((self.handler.submit(self.handler.insert_documents(self.collection_name, documents)), documents))
+
+    # the inserted batches from the oldest on, up to the first one which is still in flight unless waiting
+    def report(self, wait):
+        uids = []
+        while self.in_flight and (wait or self.in_flight[0][0].done()):
+            future, documents = self.in_flight.popleft()
+            batch_uids = future.result()
+            if self.on_flush is not None:
+                self.on_flush(batch_uids, documents)
+            uids.extend(batch_uids)
+        return uids
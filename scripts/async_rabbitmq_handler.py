@@ -0,0 +1,142 @@
+# for asyncio use of rabbitmq
+import aio_pika
+
+import asyncio
+
+# for access of environment variables
+import os
+
+import logging
+
+# for running the event loop in the background of a blocking flow
+import threading
+
+# the callbacks (and the routing key to callback mapping) are the same as the blocking handler's
+from rabbitmq_handler import MessageCallbacks, configure_logger_logging, RESULTS_EXCHANGE
+
+from tracing import tracer
+# for messages whose callback failed
+from retry_queues import RetryQueues, prefetch_count
+
+
+# consumes any number of queues as concurrent tasks over a single connection,
+# so there's no need for a forked process (and a forked copy of the connection) per queue
+class AsyncRabbitmqHandler(MessageCallbacks):
+    def __init__(self, logging_level, logging_file = None):
+        self.queue_names = os.getenv('QUEUE_NAMES').split(',')
+        self.rabbitmq_host = os.getenv('RMQ_HOST')
+        self.connection = None
+        self.channel = None
+        self.consumers = []
+        self.prefetch_count = prefetch_count()
+        self.retry_queues = {queue_name : RetryQueues(queue_name) for queue_name in self.queue_names}
+
+        logger = logging.getLogger('async-rmq')
+        configure_logger_logging(logger, logging_level, logging_file)
+        self.logger = logger
+
+    async def connect(self):
+        self.connection = await aio_pika.connect_robust(host=self.rabbitmq_host)
+        # used for publishing and declaring, every consumer gets a channel of its own
+        self.channel = await self.connection.channel()
+        # declaring the queues
+        for queue_name in self.queue_names:
+            queue = await self.channel.declare_queue(queue_name)
+            retry_queues = self.retry_queues[queue_name]
+            for name, ttl in retry_queues.retry_queues:
+                await self.channel.declare_queue(name, arguments=retry_queues.arguments(ttl))
+            await self.channel.declare_queue(retry_queues.dead_letter_queue)
+            if queue_name == 'results':
+                exchange = await self.channel.declare_exchange(RESULTS_EXCHANGE, aio_pika.ExchangeType.FANOUT)
+                await queue.bind(exchange)
+
+    async def send(self, msg_exchange, msg_routing_key, msg_body):
+        if isinstance(msg_body, str):
+            msg_body = msg_body.encode()
+        if msg_exchange:
+            exchange = await self.channel.get_exchange(msg_exchange)
+        else:
+            exchange = self.channel.default_exchange
+        headers = tracer.headers(msg_routing_key or msg_exchange) if tracer.enabled else None
+        await exchange.publish(aio_pika.Message(body=msg_body, headers=headers), routing_key=msg_routing_key)
+
+    # a single consumer task, calls the routing key's callback for every message until cancelled.
+    # a message is acked once its callback returned, a failed one once it was published to its retry queue
+    async def consume(self, routing_key, run_state):
+        callback = self.get_callback(routing_key, run_state)
+        retry_queues = self.retry_queues[routing_key]
+        channel = await self.connection.channel()
+        await channel.set_qos(prefetch_count=self.prefetch_count)
+        queue = await channel.declare_queue(routing_key)
+        try:
+            async with queue.iterator() as messages:
+                async for message in messages:
+                    try:
+                        # the incoming message carries both the method (delivery_tag, routing_key) and the properties
+                        callback(channel, message, message, message.body)
+                    except Exception as error:
+                        await self.retry(channel, retry_queues, message, error)
+                    await message.ack()
+        finally:
+            await channel.close()
+
+    async def retry(self, channel, retry_queues, message, error):
+        routing_key, headers = retry_queues.route(message.headers, error)
+        await channel.default_exchange.publish(aio_pika.Message(body=message.body,
+                                                                headers=headers,
+                                                                content_type=message.content_type,
+                                                                content_encoding=message.content_encoding,
+                                                                correlation_id=message.correlation_id,
+                                                                reply_to=message.reply_to),
+                                               routing_key=routing_key)
+        log_message = 'async_rmq_handler: a message of %s failed, sent to %s - %r' % (retry_queues.queue, routing_key, error)
+        self.logger.warning(log_message)
+
+    # consuming all the given routing keys concurrently, returns once all of the consumers were cancelled
+    async def consume_all(self, routing_keys, run_state):
+        self.consumers = [asyncio.ensure_future(self.consume(routing_key, run_state)) for routing_key in routing_keys]
+        await asyncio.gather(*self.consumers, return_exceptions=True)
+
+    async def close(self):
+        for consumer in self.consumers:
+            consumer.cancel()
+        await asyncio.gather(*self.consumers, return_exceptions=True)
+        self.consumers = []
+        if self.connection is not None:
+            await self.connection.close()
+
+    # the same interface as RabbitmqHandler.listen, for blocking flows which wait on the run state
+    def listen(self, routing_keys, run_state):
+        listener = AsyncListener(self, routing_keys, run_state)
+        listener.start()
+        return listener
+
+
+# runs the handler's event loop in a background thread of the current process
+class AsyncListener(threading.Thread):
+    def __init__(self, handler, routing_keys, run_state):
+        super().__init__(daemon=True)
+        self.handler = handler
+        self.routing_keys = routing_keys
+        self.run_state = run_state
+        self.loop = asyncio.new_event_loop()
+        self.connected = threading.Event()
+
+    async def serve(self):
+        try:
+            await self.handler.connect()
+        finally:
+            self.connected.set()
+        await self.handler.consume_all(self.routing_keys, self.run_state)
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.serve())
+
+    def stop(self):
+        self.connected.wait()
+        # the loop is already done if connecting failed
+        if self.is_alive():
+            asyncio.run_coroutine_threadsafe(self.handler.close(), self.loop).result()
+        self.join()
+        self.loop.close()
@@ -0,0 +1,81 @@
+# encode/decode time and bytes on the wire of a batch of results in every format, against sending the ids only.
+# with MONGO_HOST set, the ids are also fetched back with the single $in query the report generator runs,
+# which is the cost the inline results save (for example `docker run -p 27017:27017 mongo`).
+#
+# usage: [MONGO_HOST=localhost DB_NAME=benchmark] python benchmark-codec.py [results per batch] [repetitions]
+
+import os
+import sys
+import time
+import json
+
+from bson.objectid import ObjectId
+
+from message_codec import MessageCodec, msgpack
+
+COLLECTION = 'Benchmark Results'
+
+
+def make_results(num_of_results):
+    return [{'_id' : ObjectId(), 'name' : 'Check if the signal Peer_Offer includes data item Peer_Type', 'result' : 'Pass' if index % 7 else 'Fail',
+             'test' : 'suite-%d/test-%d.tdf' % (index % 20, index), 'suite' : 'suite-%d' % (index % 20),
+             'setup_id' : '6087a35bc1d1e3b5a8f4e2d1', 'timestamp' : time.time(), 'duration' : (index % 100) / 10.0}
+            for index in range(num_of_results)]
+
+def measure(codec, results, repetitions):
+    start = time.perf_counter()
+    for index in range(repetitions):
+        body, content_type, content_encoding = codec.encode(results)
+    encode = (time.perf_counter() - start) / repetitions
+    start = time.perf_counter()
+    for index in range(repetitions):
+        codec.decode(body, content_type, content_encoding)
+    decode = (time.perf_counter() - start) / repetitions
+    return len(body), encode, decode
+
+def measure_ids(results, repetitions):
+    start = time.perf_counter()
+    for index in range(repetitions):
+        body = json.dumps([str(result['_id']) for result in results]).encode()
+    encode = (time.perf_counter() - start) / repetitions
+    start = time.perf_counter()
+    for index in range(repetitions):
+        [ObjectId(uid) for uid in json.loads(body)]
+    decode = (time.perf_counter() - start) / repetitions
+    return len(body), encode, decode
+
+def measure_fetch(results, repetitions):
+    from mongodb_handler import MongodbHandler
+    mdb_handler = MongodbHandler(ensure_indexes=False)
+    mdb_handler.db[COLLECTION].drop()
+    mdb_handler.insert_documents(COLLECTION, [dict(result) for result in results])
+    uids = [result['_id'] for result in results]
+    start = time.perf_counter()
+    for index in range(repetitions):
+        mdb_handler.get_documents_list(COLLECTION, '_id', {'$in' : uids})
+    fetch = (time.perf_counter() - start) / repetitions
+    mdb_handler.db[COLLECTION].drop()
+    return fetch
+
+def main():
+    num_of_results = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    results = make_results(num_of_results)
+    print('a batch of %d results, %d repetitions' % (num_of_results, repetitions))
+    size, encode, decode = measure_ids(results, repetitions)
+    line = '%-14s %8d bytes | encode %8.1f us | decode %8.1f us' % ('ids (json)', size, encode * 1000000, decode * 1000000)
+    if os.getenv('MONGO_HOST'):
+        line += ' | + fetch %8.1f us' % (measure_fetch(results, repetitions) * 1000000)
+    print(line)
+    formats = ['json', 'bson'] + (['msgpack'] if msgpack is not None else [])
+    for format in formats:
+        for compress_threshold in [None, 0]:
+            codec = MessageCodec(format, compress_threshold)
+            size, encode, decode = measure(codec, results, repetitions)
+            name = format + (' + zlib' if compress_threshold is not None else '')
+            print('%-14s %8d bytes | encode %8.1f us | decode %8.1f us' % (name, size, encode * 1000000, decode * 1000000))
+    if msgpack is None:
+        print('(msgpack is not installed)')
+
+if __name__ == '__main__':
+    main()
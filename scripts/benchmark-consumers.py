@@ -0,0 +1,98 @@
+# load test of the consuming side against a local broker (for example `docker run -p 5672:5672 rabbitmq`),
+# compares the process per listener model with the asyncio handler's concurrent consumers on one connection.
+# every queue is filled up front, then the consumers are started and timed until all the queues are drained.
+#
+# usage: RMQ_HOST=localhost python benchmark-consumers.py [messages per queue]
+
+import os
+import sys
+import time
+import logging
+
+os.environ.setdefault('QUEUE_NAMES', 'tests_list,setup_ready,results,all_results_ready,pdf_ready')
+
+from multiprocessing import Process
+
+import pika
+
+from rabbitmq_handler import RabbitmqHandler
+from async_rabbitmq_handler import AsyncRabbitmqHandler
+from run_state import RunState
+
+QUEUES = ['tests_list', 'setup_ready', 'results', 'all_results_ready', 'pdf_ready']
+logging_level = logging.WARNING
+
+
+def resident_memory_kb(pid):
+    with open('/proc/%d/status' % pid) as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+def new_run_state():
+    return RunState(tests_list_ready=False, tests_list_id='', setup_ready=False, setup_id='',
+                    all_results_ready=False, pdf_ready=False, pdf_link='')
+
+def fill_queues(rmq_handler, messages_per_queue):
+    for queue_name in QUEUES:
+        rmq_handler.channel.queue_purge(queue_name)
+        for index in range(messages_per_queue):
+            rmq_handler.send('', queue_name, str(index))
+
+def queues_depth(channel):
+    return sum(channel.queue_declare(queue=queue_name, passive=True).method.message_count for queue_name in QUEUES)
+
+# polls the broker until every queue is empty, keeping the highest memory seen on the way. the depth is read on a
+# connection of its own, the handler's connection may be busy with the consumers
+def wait_until_drained(rmq_handler, pids):
+    connection = pika.BlockingConnection(rmq_handler.connection_parameters)
+    channel = connection.channel()
+    peak_memory_kb = 0
+    while True:
+        peak_memory_kb = max(peak_memory_kb, sum(resident_memory_kb(pid) for pid in pids))
+        if queues_depth(channel) == 0:
+            connection.close()
+            return peak_memory_kb
+        time.sleep(0.05)
+
+# a forked listener must not use the socket of the parent's connection, so it opens a connection of its own
+def listen_in_child(queue_name, run_state):
+    RabbitmqHandler(logging_level).wait_for_message(queue_name, run_state)
+
+def process_per_listener(rmq_handler, messages_per_queue):
+    fill_queues(rmq_handler, messages_per_queue)
+    run_state = new_run_state()
+    start = time.time()
+    # like the services used to do, every listener is a process of its own, with its own connection
+    listeners = [Process(target=listen_in_child, args=(queue_name, run_state,)) for queue_name in QUEUES]
+    for listener in listeners:
+        listener.start()
+    peak_memory_kb = wait_until_drained(rmq_handler, [os.getpid()] + [listener.pid for listener in listeners])
+    elapsed = time.time() - start
+    for listener in listeners:
+        listener.terminate()
+        listener.join()
+    return elapsed, peak_memory_kb
+
+def async_consumers(rmq_handler, messages_per_queue):
+    fill_queues(rmq_handler, messages_per_queue)
+    run_state = new_run_state()
+    start = time.time()
+    listener = AsyncRabbitmqHandler(logging_level).listen(QUEUES, run_state)
+    peak_memory_kb = wait_until_drained(rmq_handler, [os.getpid()])
+    elapsed = time.time() - start
+    listener.stop()
+    return elapsed, peak_memory_kb
+
+def main():
+    messages_per_queue = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rmq_handler = RabbitmqHandler(logging_level)
+    total = messages_per_queue * len(QUEUES)
+    print('%d queues, %d messages each' % (len(QUEUES), messages_per_queue))
+    for name, model in [('process per listener', process_per_listener), ('asyncio consumers', async_consumers)]:
+        elapsed, peak_memory_kb = model(rmq_handler, messages_per_queue)
+        print('%-22s %10.0f msg/s | peak rss %8.1f MB' % (name, total / elapsed, peak_memory_kb / 1024.0))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# per test setup (reading and compiling the test's .tdf file) of several runs of the same tests on a synthetic tree:
+# cold, with a new cache for every run (like a controller started for every run), and warm, with the cache of the
+# previous runs (like a controller of the 'multi' or 'worker' mode), also with a cache smaller than the run.
+# the tests are run by the test executor's threads, without the sleep of a test. no broker or database is needed.
+#
+# usage: python benchmark-definitions.py [number of tests] [runs] [steps per test]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from test_definitions import DefinitionCache
+from test_executor import TestExecutor
+
+WORKERS = 4
+
+
+def make_tree(root, num_of_tests, num_of_steps):
+    tests = []
+    for index in range(num_of_tests):
+        test = 'suite-%d/test-%d.tdf' % (index % 8, index)
+        os.makedirs(os.path.join(root, os.path.dirname(test)), exist_ok=True)
+        with open(os.path.join(root, test), 'w') as file:
+            file.write('# generated\nName: test %d\nDevice: radio\n' % index)
+            file.write(''.join('step %d: send Peer_Offer %d with Peer_Type %d within %d ms\n' % (step, step, index, step * 10)
+                               for step in range(num_of_steps)))
+        tests.append(test)
+    return tests
+
+# the seconds of setup of every test of the run
+def run(tests, definitions):
+    setups = []
+
+    def run_test(test):
+        start = time.perf_counter()
+        definitions.get(test)
+        setups.append(time.perf_counter() - start)
+
+    TestExecutor(run_test, lambda test, result: None, max_workers=WORKERS).run(tests)
+    return setups
+
+def measure(name, tests, num_of_runs, make_cache):
+    definitions = make_cache()
+    setups = []
+    for index in range(num_of_runs):
+        if index > 0 and name == 'cold':
+            definitions = make_cache()
+        setups.extend(run(tests, definitions))
+    setups.sort()
+    stats = definitions.stats()
+    print('%-24s per test setup %7.1f us (median %6.1f us, p99 %7.1f us), hit ratio %3.0f%%' % (
+        name, sum(setups) / len(setups) * 1e6, setups[len(setups) // 2] * 1e6, setups[int(len(setups) * 0.99)] * 1e6,
+        stats['hit_ratio'] * 100))
+    return sum(setups) / len(setups)
+
+def main():
+    num_of_tests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    num_of_runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    num_of_steps = int(sys.argv[3]) if len(sys.argv) > 3 else 60
+    root = tempfile.mkdtemp()
+    try:
+        tests = make_tree(root, num_of_tests, num_of_steps)
+        print('%d tests of %d steps, %d runs' % (num_of_tests, num_of_steps, num_of_runs))
+        cold = measure('cold', tests, num_of_runs, lambda: DefinitionCache(root, num_of_tests))
+        warm = measure('warm', tests, num_of_runs, lambda: DefinitionCache(root, num_of_tests))
+        # a run goes through the tests in order, an lru cache smaller than the run keeps missing
+        measure('warm, half sized cache', tests, num_of_runs, lambda: DefinitionCache(root, num_of_tests // 2))
+        print('warm setup is %.1fx faster than cold' % (cold / warm))
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# discovery of a synthetic tree of .tdf suites: the first discovery (every file parsed, sequentially and in parallel),
+# and the background check of a later startup (loading the index and parsing the few files which changed). a later
+# startup publishes the last list by its id (a single query, not measured here) before that check, so its time to
+# the test list doesn't depend on the size of the tree.
+#
+# usage: python benchmark-discovery.py [number of files] [suites]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from suite_discovery import SuiteDiscovery
+
+SIZES = [1000]
+
+
+def make_tree(root, num_of_files, num_of_suites):
+    for suite in range(num_of_suites):
+        os.makedirs(os.path.join(root, 'suite-%d' % suite, 'cases'))
+    for index in range(num_of_files):
+        suite = index % num_of_suites
+        # a few suites keep their tests one level deeper
+        directory = os.path.join(root, 'suite-%d' % suite, 'cases' if suite % 5 == 0 else '')
+        with open(os.path.join(directory, 'test-%d.tdf' % index), 'w') as file:
+            file.write('Name: test %d of suite %d\n' % (index, suite))
+            file.write(''.join('step %d: send message %d and expect its answer within %d ms\n' % (step, step, step * 10)
+                               for step in range(40)))
+
+def change_files(root, num_of_changes):
+    changed = 0
+    for directory, directories, files in os.walk(root):
+        for name in files:
+            if name.endswith('.tdf') and changed < num_of_changes:
+                with open(os.path.join(directory, name), 'a') as file:
+                    file.write('step 99: one more step\n')
+                changed += 1
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+def measure(num_of_files, num_of_suites):
+    root = tempfile.mkdtemp()
+    try:
+        make_tree(root, num_of_files, num_of_suites)
+        sequential, changes = timed(lambda: SuiteDiscovery(root, os.path.join(root, 'sequential.json'), workers=1).refresh())
+        parallel, changes = timed(lambda: SuiteDiscovery(root).refresh())
+        change_files(root, num_of_files // 100)
+        discovery = SuiteDiscovery(root)
+        loading, loaded = timed(discovery.load_index)
+        check, changes = timed(discovery.refresh)
+        num_of_tests = sum(len(suite['Tests']) for suite in discovery.test_suites()['TestSuites'])
+        print('%6d files: first discovery %6.0f ms (sequential %6.0f ms) | later startups: index loaded in %4.0f ms, '
+              'checked in %5.0f ms, %d changed' % (num_of_tests, parallel * 1000, sequential * 1000, loading * 1000,
+                                                   check * 1000, changes))
+    finally:
+        shutil.rmtree(root)
+
+def main():
+    num_of_files = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    num_of_suites = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    for size in SIZES + [num_of_files]:
+        measure(size, num_of_suites)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+# suite wall time against the concurrency level of the test executor,
+# the tests are simulated by sleeping for a random (seeded) duration so no broker or database is needed
+#
+# usage: python benchmark-executor.py [number of tests] [suites] [max per suite]
+
+import sys
+import time
+import random
+
+from test_executor import TestExecutor
+
+
+def make_suite(num_of_tests, num_of_suites):
+    generator = random.Random(7)
+    return [('suite-%d/test-%d.tdf' % (index % num_of_suites, index), generator.uniform(0.005, 0.05)) for index in range(num_of_tests)]
+
+def main():
+    num_of_tests = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    num_of_suites = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    max_per_suite = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    tests = make_suite(num_of_tests, num_of_suites)
+    serial_time = sum(duration for test, duration in tests)
+    print('%d tests in %d suites, %.2f seconds of test time' % (num_of_tests, num_of_suites, serial_time))
+    published = []
+    for concurrency in [1, 2, 4, 8, 16, 32, 64]:
+        del published[:]
+        executor = TestExecutor(lambda test: time.sleep(test[1]), lambda test, result: published.append(test),
+                                max_workers=concurrency, max_per_group=max_per_suite)
+        start = time.time()
+        executor.run(tests, group_of=lambda test: test[0].split('/')[0])
+        elapsed = time.time() - start
+        print('concurrency %3d: %7.2f seconds, speedup %5.1fx' % (concurrency, elapsed, serial_time / elapsed))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+# time from the last result to a finished report, finalizing a report which was built while the results came in
+# against rendering all of the results after the last one (the old critical path), for growing synthetic runs
+#
+# usage: python benchmark-incremental-report.py [largest number of results]
+
+import os
+import sys
+import time
+import tempfile
+
+from report_renderer import render_report, IncrementalReport
+
+
+def synthetic_results(num_of_results):
+    for index in range(num_of_results):
+        yield {'test' : 'suite-%d/test-%d.tdf' % (index % 20, index), 'suite' : 'suite-%d' % (index % 20),
+               'result' : 'Pass' if index % 7 else 'Fail', 'duration' : (index % 100) / 10.0}
+
+def main():
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    sizes = [size for size in [100, 1000, 10000, 100000, 1000000] if size <= largest]
+    path = os.path.join(tempfile.mkdtemp(), 'report.pdf')
+    for num_of_results in sizes:
+        # during the run, off the critical path
+        report = IncrementalReport(path, 'benchmark')
+        start = time.time()
+        for result in synthetic_results(num_of_results):
+            report.add(result)
+        during_run = time.time() - start
+        start = time.time()
+        report.finalize()
+        finalize = time.time() - start
+
+        start = time.time()
+        render_report(synthetic_results(num_of_results), path, 'benchmark')
+        full_render = time.time() - start
+        print('%8d results: incremental %7.3f s during the run + %7.4f s after the last result | full render after the last result %7.3f s' % (
+            num_of_results, during_run, finalize, full_render))
+    os.remove(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# the cost of the instrumentation on the hot path, without a broker or a mongod: a message handled through
+# MessageCallbacks.handle_message (counted and timed) against calling its callback directly, the single metric
+# updates, a timed mongo call around nothing, and the scrape of the registry the runs left behind
+#
+# usage: python benchmark-metrics.py [iterations]
+
+import sys
+import time
+import functools
+
+from rabbitmq_handler import MessageCallbacks, MESSAGES_CONSUMED, HANDLER_DURATION
+from mongodb_handler import mongo_operation
+from metrics import registry
+
+
+def noop_callback(ch, method, properties, body):
+    pass
+
+def per_call(function, iterations):
+    start = time.perf_counter()
+    for index in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations
+
+def timed_noop():
+    with mongo_operation('benchmark', 'Benchmark'):
+        pass
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    callbacks = MessageCallbacks()
+    plain = functools.partial(noop_callback, None, None, None, b'')
+    instrumented = functools.partial(callbacks.handle_message, 'benchmark', noop_callback,
+                                     MESSAGES_CONSUMED.labels('benchmark'), HANDLER_DURATION.labels('benchmark'),
+                                     None, None, None, b'')
+    baseline = per_call(plain, iterations)
+    measurements = [
+        ('counter inc', per_call(MESSAGES_CONSUMED.labels('benchmark').inc, iterations)),
+        ('histogram observe', per_call(functools.partial(HANDLER_DURATION.labels('benchmark').observe, 0.001), iterations)),
+        ('labels lookup + inc', per_call(lambda: MESSAGES_CONSUMED.labels('benchmark').inc(), iterations)),
+        ('timed mongo call', per_call(timed_noop, iterations)),
+        ('handled message', per_call(instrumented, iterations) - baseline),
+    ]
+    for name, seconds in measurements:
+        print('%-20s %7.3f us' % (name, seconds * 1000000))
+    start = time.perf_counter()
+    text = registry.render()
+    print('scrape of %d lines   %7.3f ms' % (text.count('\n'), (time.perf_counter() - start) * 1000))
+
+if __name__ == '__main__':
+    main()
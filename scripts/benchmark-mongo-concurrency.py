@@ -0,0 +1,84 @@
+# inserts and reads at 1 to 256 concurrent tasks on a local mongod (for example `docker run -p 27017:27017 mongo`):
+# the blocking client with a thread per task, against the async client with an asyncio task per task on the loop
+# of the process' AsyncMongodbHandler. both clients have the same pool, timeouts and write concern (MONGO_* variables),
+# every level does the same number of operations and every read is of a document which was inserted before.
+#
+# usage: MONGO_HOST=localhost DB_NAME=benchmark python benchmark-mongo-concurrency.py [operations per level]
+
+import os
+import sys
+import time
+import asyncio
+
+# for the tasks of the blocking client
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+from mongodb_handler import MongodbHandler, client_options
+from async_mongodb_handler import AsyncMongodbHandler
+
+COLLECTION = 'Benchmark Concurrency'
+LEVELS = [1, 4, 16, 64, 256]
+
+
+def make_result(index):
+    return {'setup_id' : 'benchmark', 'test' : 'suite-%d/test-%d.tdf' % (index % 20, index), 'suite' : 'suite-%d' % (index % 20),
+            'result' : 'Pass', 'timestamp' : time.time(), 'duration' : (index % 100) / 10.0}
+
+# every task does its share of the operations one after the other, returns the latency of every operation
+def blocking(mdb_handler, operation, arguments, concurrency):
+    def task(share):
+        latencies = []
+        for argument in share:
+            start = time.perf_counter()
+            operation(mdb_handler, argument)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return [latency for latencies in pool.map(task, [arguments[index::concurrency] for index in range(concurrency)])
+                for latency in latencies]
+
+def concurrent(async_mdb_handler, operation, arguments, concurrency):
+    async def task(share):
+        latencies = []
+        for argument in share:
+            start = time.perf_counter()
+            await operation(async_mdb_handler, argument)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    async def all_tasks():
+        return await asyncio.gather(*[task(arguments[index::concurrency]) for index in range(concurrency)])
+
+    return [latency for latencies in async_mdb_handler.run(all_tasks()) for latency in latencies]
+
+def measure(name, run, handler, operation, arguments, concurrency):
+    start = time.perf_counter()
+    latencies = sorted(run(handler, operation, arguments, concurrency))
+    elapsed = time.perf_counter() - start
+    return '%s %7.0f ops/s p99 %6.1f ms' % (name, len(latencies) / elapsed, latencies[int(len(latencies) * 0.99)] * 1000)
+
+def main():
+    num_of_operations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    mdb_handler = MongodbHandler(ensure_indexes=False)
+    async_mdb_handler = AsyncMongodbHandler()
+    mdb_handler.db[COLLECTION].drop()
+    print('%d operations per level, %s' % (num_of_operations, client_options()))
+    for concurrency in LEVELS:
+        results = [make_result(index) for index in range(num_of_operations)]
+        inserts = [measure('blocking', blocking, mdb_handler, lambda handler, result: handler.insert_document(COLLECTION, dict(result)),
+                           results, concurrency),
+                   measure('async', concurrent, async_mdb_handler,
+                           lambda handler, result: handler.insert_document(COLLECTION, dict(result)), results, concurrency)]
+        uids = [str(uid) for uid in mdb_handler.insert_documents(COLLECTION, [dict(result) for result in results])]
+        reads = [measure('blocking', blocking, mdb_handler, lambda handler, uid: handler.get_document_by_id(COLLECTION, uid),
+                         uids, concurrency),
+                 measure('async', concurrent, async_mdb_handler,
+                         lambda handler, uid: handler.get_document_by_id(COLLECTION, uid), uids, concurrency)]
+        print('%3d tasks | inserts: %s | reads: %s' % (concurrency, ', '.join(inserts), ', '.join(reads)))
+        mdb_handler.db[COLLECTION].drop()
+
+if __name__ == '__main__':
+    main()
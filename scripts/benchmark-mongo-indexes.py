@@ -0,0 +1,76 @@
+# query latency of the report's results query with and without the declared indexes, on a local mongod
+# (for example `docker run -p 27017:27017 mongo`). the collection is filled with synthetic results of many setups,
+# and every query is also explained so the numbers come with the plan and the documents it examined.
+#
+# usage: MONGO_HOST=localhost DB_NAME=benchmark python benchmark-mongo-indexes.py [number of results] [setups]
+
+import os
+import sys
+import time
+import random
+import statistics
+
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+from mongodb_handler import MongodbHandler, INDEXES
+
+COLLECTION = 'Benchmark Results'
+PROJECTION = {'_id' : 0, 'setup_id' : 1, 'test' : 1, 'suite' : 1, 'result' : 1, 'duration' : 1}
+SORT = [('suite', 1), ('test', 1)]
+
+
+def fill(mdb_handler, num_of_results, num_of_setups):
+    collection = mdb_handler.db[COLLECTION]
+    collection.drop()
+    batch = []
+    for index in range(num_of_results):
+        batch.append({'setup_id' : 'setup-%d' % (index % num_of_setups), 'test' : 'suite-%d/test-%d.tdf' % (index % 20, index),
+                      'suite' : 'suite-%d' % (index % 20), 'result' : 'Pass' if index % 7 else 'Fail',
+                      'timestamp' : time.time(), 'duration' : (index % 100) / 10.0})
+        if len(batch) == 10000:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+
+def winning_stages(plan):
+    stages = [plan['stage']]
+    while 'inputStage' in plan:
+        plan = plan['inputStage']
+        stages.append(plan['stage'])
+    return ' <- '.join(stages)
+
+def measure(mdb_handler, name, setup_ids, hint=None):
+    collection = mdb_handler.db[COLLECTION]
+    latencies = []
+    for setup_id in setup_ids:
+        start = time.time()
+        cursor = collection.find({'setup_id' : setup_id}, PROJECTION).sort(SORT)
+        if hint is not None:
+            cursor = cursor.hint(hint)
+        list(cursor)
+        latencies.append(time.time() - start)
+    cursor = collection.find({'setup_id' : setup_ids[0]}, PROJECTION).sort(SORT)
+    if hint is not None:
+        cursor = cursor.hint(hint)
+    explain = cursor.explain()
+    stats = explain['executionStats']
+    print('%-10s p50 %9.2f ms | max %9.2f ms | docs examined %8d | keys examined %8d | %s' % (
+        name, statistics.median(latencies) * 1000, max(latencies) * 1000, stats['totalDocsExamined'], stats['totalKeysExamined'],
+        winning_stages(explain['queryPlanner']['winningPlan'])))
+
+def main():
+    num_of_results = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    num_of_setups = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    mdb_handler = MongodbHandler(ensure_indexes=False)
+    print('filling %d results of %d setups...' % (num_of_results, num_of_setups))
+    fill(mdb_handler, num_of_results, num_of_setups)
+    setup_ids = ['setup-%d' % random.randrange(num_of_setups) for index in range(20)]
+    # a collection scan, like before the indexes were declared
+    measure(mdb_handler, 'no index', setup_ids, hint=[('$natural', 1)])
+    mdb_handler.ensure_indexes({COLLECTION : INDEXES['Test Results']})
+    measure(mdb_handler, 'indexed', setup_ids)
+    mdb_handler.db[COLLECTION].drop()
+
+if __name__ == '__main__':
+    main()
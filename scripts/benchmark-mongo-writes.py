@@ -0,0 +1,54 @@
+# inserting test results one by one against the buffered writer's batches, on a local mongod
+# (for example `docker run -p 27017:27017 mongo`), counting the round trips of every mode
+#
+# usage: MONGO_HOST=localhost DB_NAME=benchmark python benchmark-mongo-writes.py [number of results]
+
+import os
+import sys
+import time
+
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+from mongodb_handler import MongodbHandler
+
+COLLECTION = 'Benchmark Results'
+
+
+def make_result(index):
+    return {'name' : 'Check if the signal Peer_Offer includes data item Peer_Type', 'result' : 'Pass',
+            'test' : 'dlep/dlep-%d.tdf' % index, 'suite' : 'dlep', 'setup_id' : 'benchmark', 'timestamp' : time.time(), 'duration' : 0.0}
+
+def one_by_one(mdb_handler, num_of_results):
+    published = []
+    for index in range(num_of_results):
+        published.append([mdb_handler.insert_document(COLLECTION, make_result(index))])
+    return published
+
+def buffered(mdb_handler, num_of_results, batch_size):
+    published = []
+    writer = mdb_handler.buffered_writer(COLLECTION, batch_size, 1.0, lambda uids, documents: published.append(uids))
+    for index in range(num_of_results):
+        writer.add(make_result(index))
+    writer.flush()
+    return published
+
+def main():
+    num_of_results = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    mdb_handler = MongodbHandler()
+    modes = [('insert_one', lambda: one_by_one(mdb_handler, num_of_results))]
+    for batch_size in [10, 100, 1000]:
+        modes.append(('batches of %d' % batch_size, lambda batch_size=batch_size: buffered(mdb_handler, num_of_results, batch_size)))
+    print('%d results' % num_of_results)
+    for name, mode in modes:
+        mdb_handler.db[COLLECTION].drop()
+        start = time.time()
+        published = mode()
+        elapsed = time.time() - start
+        # every flush is one insert round trip and one results message
+        uids = [uid for batch in published for uid in batch]
+        assert len(uids) == num_of_results
+        print('%-16s %8.3f seconds | %8.0f results/s | %6d round trips' % (name, elapsed, num_of_results / elapsed, len(published)))
+    mdb_handler.db[COLLECTION].drop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# publish throughput against a local broker (for example `docker run -p 5672:5672 rabbitmq`)
+# without confirms, with a confirm per message and with windowed confirms.
+#
+# usage: RMQ_HOST=localhost python benchmark-publish.py [number of messages]
+
+import os
+import sys
+import time
+import logging
+
+os.environ.setdefault('QUEUE_NAMES', 'results')
+
+from rabbitmq_handler import RabbitmqHandler
+
+QUEUE = 'results'
+
+
+def publish_all(rmq_handler, num_of_messages, body):
+    rmq_handler.channel.queue_purge(QUEUE)
+    start = time.time()
+    for index in range(num_of_messages):
+        rmq_handler.send('', QUEUE, body)
+    rmq_handler.flush_publishes()
+    return time.time() - start
+
+def main():
+    num_of_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    body = '["%s"]' % ('0' * 24)
+    modes = [('plain', None), ('confirm', None)] + [('windowed', window) for window in [10, 100, 1000]]
+    print('%d messages of %d bytes' % (num_of_messages, len(body)))
+    for publish_mode, window in modes:
+        rmq_handler = RabbitmqHandler(logging.WARNING, publish_mode=publish_mode, publish_window=window)
+        # the per message confirms are much slower, a tenth of the messages is enough to measure them
+        count = num_of_messages // 10 if publish_mode == 'confirm' else num_of_messages
+        elapsed = publish_all(rmq_handler, count, body)
+        name = publish_mode if window is None else '%s (%d)' % (publish_mode, window)
+        print('%-16s %10.0f msg/s' % (name, count / elapsed))
+        if rmq_handler.publisher is not None:
+            rmq_handler.publisher.close()
+        rmq_handler.channel.queue_purge(QUEUE)
+        rmq_handler.connection.close()
+
+if __name__ == '__main__':
+    main()
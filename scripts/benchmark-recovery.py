@@ -0,0 +1,150 @@
+# recovery time of RabbitmqHandler after a broker restart, on a local broker (for example
+# `docker run -p 5672:5672 rabbitmq`). the handler talks to the broker through a tcp proxy which stands in for the
+# restart: it drops every connection and refuses new ones for the downtime. a publisher sends a message every few
+# milliseconds and a listener consumes them, the recovery time is from the broker being back to the first message
+# which went all the way through again, and it's compared with a target (RECOVERY_TARGET seconds).
+#
+# usage: RMQ_HOST=localhost python benchmark-recovery.py [publish mode] [seconds of downtime]
+
+import os
+import sys
+import time
+import socket
+import logging
+import threading
+
+from pika.exceptions import NackError
+
+QUEUE = 'benchmark_recovery'
+BROKER = (os.getenv('RMQ_HOST', 'localhost'), int(os.getenv('RMQ_PORT', '5672')))
+RECOVERY_TARGET = float(os.getenv('RECOVERY_TARGET', '5'))
+
+
+class BrokerProxy(threading.Thread):
+    def __init__(self, broker):
+        super().__init__(daemon=True)
+        self.broker = broker
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(64)
+        self.port = self.server.getsockname()[1]
+        self.available = threading.Event()
+        self.available.set()
+        self.sockets = []
+        self.lock = threading.Lock()
+
+    def run(self):
+        while True:
+            client, address = self.server.accept()
+            if not self.available.is_set():
+                client.close()
+                continue
+            try:
+                upstream = socket.create_connection(self.broker)
+            except OSError:
+                client.close()
+                continue
+            with self.lock:
+                self.sockets.extend([client, upstream])
+            threading.Thread(target=self.pipe, args=(client, upstream), daemon=True).start()
+            threading.Thread(target=self.pipe, args=(upstream, client), daemon=True).start()
+
+    def pipe(self, source, destination):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                destination.sendall(data)
+        except OSError:
+            pass
+        for sock in [source, destination]:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    # returns the time the broker is back
+    def restart(self, downtime):
+        self.available.clear()
+        with self.lock:
+            sockets, self.sockets = self.sockets, []
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        time.sleep(downtime)
+        self.available.set()
+        return time.time()
+
+
+def main():
+    publish_mode = sys.argv[1] if len(sys.argv) > 1 else 'plain'
+    downtime = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+    proxy = BrokerProxy(BROKER)
+    proxy.start()
+    os.environ.update({'RMQ_HOST' : '127.0.0.1', 'RMQ_PORT' : str(proxy.port), 'QUEUE_NAMES' : QUEUE})
+
+    from rabbitmq_handler import RabbitmqHandler, MessageListener
+
+    rmq_handler = RabbitmqHandler(logging.WARNING, publish_mode=publish_mode)
+    rmq_handler.channel.queue_purge(QUEUE)
+    # sequence number -> time it was received
+    received = {}
+    duplicates = [0]
+
+    def on_message(ch, method, properties, body):
+        sequence = int(body)
+        if sequence in received:
+            duplicates[0] += 1
+        received.setdefault(sequence, time.time())
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    listener = MessageListener(rmq_handler.connection_parameters, [(QUEUE, on_message)], rmq_handler.declare_queues, rmq_handler.logger)
+    listener.start()
+    # sequence number -> time it was sent
+    sent = {}
+    stop = threading.Event()
+
+    def publish():
+        sequence = 0
+        while not stop.is_set():
+            rmq_handler.send('', QUEUE, str(sequence))
+            sent[sequence] = time.time()
+            sequence += 1
+            time.sleep(0.005)
+
+    publisher = threading.Thread(target=publish, daemon=True)
+    publisher.start()
+    time.sleep(2)
+    print('%s publishes, %.1f seconds of downtime' % (publish_mode, downtime))
+    went_down = time.time()
+    came_back = proxy.restart(downtime)
+    deadline = came_back + max(RECOVERY_TARGET * 4, 30)
+    while time.time() < deadline and not any(at > came_back for at in list(received.values())):
+        time.sleep(0.01)
+    stop.set()
+    publisher.join()
+    try:
+        rmq_handler.flush_publishes(timeout=10)
+    except NackError as error:
+        # counted with the lost ones
+        print('%d messages were nacked for good' % len(error.messages))
+    time.sleep(1)
+    listener.stop()
+
+    recovered_at = min([at for at in received.values() if at > came_back], default=None)
+    if recovered_at is None:
+        print('no message went through within %.0f seconds of the broker coming back' % (deadline - came_back))
+        sys.exit(1)
+    recovery = recovered_at - came_back
+    lost = len(set(sent) - set(received))
+    print('recovered %.2f seconds after the broker came back (%.2f seconds after it went down)' % (recovery, recovered_at - went_down))
+    print('%d messages sent, %d lost, %d duplicates' % (len(sent), lost, duplicates[0]))
+    print('target %.1f seconds - %s' % (RECOVERY_TARGET, 'met' if recovery <= RECOVERY_TARGET else 'MISSED'))
+    sys.exit(0 if recovery <= RECOVERY_TARGET else 1)
+
+if __name__ == '__main__':
+    main()
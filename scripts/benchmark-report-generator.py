@@ -0,0 +1,59 @@
+# requests/sec and latency percentiles of the report generator as its worker pool grows, on a local broker
+# (for example `docker run -p 5672:5672 rabbitmq`). a report-generator.py replica is started for every worker count
+# (or several replicas, to see them share the pdfs queue) and loaded with concurrent requests over the rpc client.
+#
+# usage: RMQ_HOST=localhost python benchmark-report-generator.py [requests] [replicas]
+
+import os
+import sys
+import time
+import logging
+import subprocess
+
+import pika
+
+os.environ.setdefault('QUEUE_NAMES', 'pdfs')
+
+from rabbitmq_handler import RpcClient
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'report-generator.py')
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def load(rpc_client, num_of_requests):
+    latencies = []
+    start = time.time()
+    futures = []
+    for index in range(num_of_requests):
+        sent_at = time.time()
+        future = rpc_client.call('', timeout=120)
+        future.add_done_callback(lambda future, sent_at=sent_at: latencies.append(time.time() - sent_at))
+        futures.append(future)
+    for future in futures:
+        future.result()
+    return time.time() - start, latencies
+
+def main():
+    num_of_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    num_of_replicas = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    connection_parameters = pika.ConnectionParameters(os.getenv('RMQ_HOST'))
+    rpc_client = RpcClient(connection_parameters, 'pdfs', logging.getLogger('rmq'))
+    rpc_client.start()
+    for workers in [1, 2, 4, 8]:
+        environment = dict(os.environ, REPORT_WORKERS=str(workers))
+        replicas = [subprocess.Popen([sys.executable, SCRIPT], env=environment, stdout=subprocess.DEVNULL) for index in range(num_of_replicas)]
+        # warming up, the first answer means the replicas are consuming
+        rpc_client.call('', timeout=60).result()
+        elapsed, latencies = load(rpc_client, num_of_requests)
+        print('%d replica(s) x %d worker(s): %8.1f requests/s | p50 %7.1f ms | p99 %7.1f ms' % (
+            num_of_replicas, workers, num_of_requests / elapsed, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000))
+        for replica in replicas:
+            replica.terminate()
+            replica.wait()
+    rpc_client.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# time and peak memory of rendering synthetic result sets, streaming them into the report page by page
+# against loading all of them first (like list(cursor) or a DataFrame would). the results are generated
+# on the fly so the streaming numbers show the renderer only, like iterating a mongo cursor in batches.
+#
+# usage: python benchmark-report-renderer.py [largest number of results]
+
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+from report_renderer import render_report
+
+
+def synthetic_results(num_of_results):
+    for index in range(num_of_results):
+        yield {'test' : 'suite-%d/test-%d.tdf' % (index % 20, index), 'suite' : 'suite-%d' % (index % 20),
+               'result' : 'Pass' if index % 7 else 'Fail', 'duration' : (index % 100) / 10.0}
+
+def streaming(num_of_results, path):
+    return render_report(synthetic_results(num_of_results), path, 'benchmark')
+
+def loaded_up_front(num_of_results, path):
+    results = list(synthetic_results(num_of_results))
+    return render_report(results, path, 'benchmark')
+
+def measure(render, num_of_results, path):
+    tracemalloc.start()
+    start = time.time()
+    render(num_of_results, path)
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+def main():
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    sizes = [size for size in [1000, 10000, 100000, 1000000] if size <= largest]
+    path = os.path.join(tempfile.mkdtemp(), 'report.pdf')
+    for num_of_results in sizes:
+        for name, render in [('streaming', streaming), ('loaded up front', loaded_up_front)]:
+            elapsed, peak = measure(render, num_of_results, path)
+            print('%8d results %-16s %7.2f seconds | peak %8.2f MB | %8.2f MB on disk' % (
+                num_of_results, name, elapsed, peak / 1024.0 / 1024.0, os.path.getsize(path) / 1024.0 / 1024.0))
+    os.remove(path)
+
+if __name__ == '__main__':
+    main()
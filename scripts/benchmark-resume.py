@@ -0,0 +1,132 @@
+# a kill-and-resume cycle of a run of the real controller on a local broker and mongod (for example
+# `docker run -p 5672:5672 rabbitmq` and `docker run -p 27017:27017 mongo`): a standalone controller is started in
+# a child process and given a setup of the benchmark's tests, it's killed with SIGKILL once half of the results are
+# recorded and started again, and the restarted controller resumes the run through controller_flow's phases
+# (resume_run, the tests without a result, all_results_ready and the report request). the parent answers the pdf
+# request like the report generator would. every test must end up with exactly one result, all of them of the same
+# run, and the run's checkpoint must be done.
+#
+# usage: RMQ_HOST=localhost MONGO_HOST=localhost python benchmark-resume.py [number of tests] [seconds per test]
+
+import os
+import sys
+import time
+import signal
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+
+os.environ.setdefault('DB_NAME', 'benchmark')
+os.environ.setdefault('QUEUE_NAMES', 'setup_ready,results,pdfs')
+
+import pika
+
+from bson.objectid import ObjectId
+
+from mongodb_handler import MongodbHandler, RUN_SUMMARIES_COLLECTION
+from rmq_connection import connection_parameters
+from checkpoints import CHECKPOINTS_COLLECTION, RESULTS_COLLECTION, MULTI, DONE
+
+CONTROLLER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'controller.py')
+# the controller can't tell how long it was killed for, it has to finish in that many seconds after its restart
+RESUME_TIMEOUT = 120
+
+
+# answers the pdf requests of the controller, like the report generator would
+def respond_to_pdf_requests(parameters, stop):
+    connection = pika.BlockingConnection(parameters)
+    channel = connection.channel()
+    channel.queue_declare(queue='pdfs')
+
+    def on_request(ch, method, props, body):
+        ch.basic_publish(exchange='', routing_key=props.reply_to,
+                         properties=pika.BasicProperties(correlation_id=props.correlation_id),
+                         body='/reports/report-resume.pdf')
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    channel.basic_consume(queue='pdfs', on_message_callback=on_request)
+    while not stop.is_set():
+        connection.process_data_events(time_limit=0.1)
+    connection.close()
+
+# a standalone controller which resumes the unfinished run, its test takes half of TIME_DELAY. nothing consumes the
+# results meanwhile, so their backlog doesn't hold the tests back
+def start_controller(test_duration, log):
+    environment = dict(os.environ)
+    environment.pop('SUITES_DIR', None)
+    environment.update({'CONTROLLER_MODE' : 'standalone', 'RESUME_RUNS' : '1', 'TIME_DELAY' : str(test_duration * 2),
+                        'MAX_RESULTS_BACKLOG' : '1000000000', 'RESULTS_BATCH_SIZE' : '10', 'RESULTS_FLUSH_INTERVAL' : '0.5'})
+    return subprocess.Popen([sys.executable, CONTROLLER], env=environment, stdout=log, stderr=subprocess.STDOUT)
+
+def main():
+    num_of_tests = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    test_duration = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    mdb_handler = MongodbHandler()
+    results = mdb_handler.db[RESULTS_COLLECTION]
+    checkpoints = mdb_handler.db[CHECKPOINTS_COLLECTION]
+    # the controller would resume any standalone run which was left unfinished, instead of the benchmark's
+    checkpoints.delete_many({'phase' : {'$ne' : DONE}, 'mode' : {'$ne' : MULTI}})
+    tests = ['suite-%d/test-%d.tdf' % (index % 8, index) for index in range(num_of_tests)]
+    setup_id = str(mdb_handler.insert_document('Configuration', {'ConfigType' : 'TestConfig', 'SelectedDevice' : 'radio',
+                                                                 'SuitesToRun' : tests}))
+
+    parameters = connection_parameters(os.getenv('RMQ_HOST'))
+    connection = pika.BlockingConnection(parameters)
+    channel = connection.channel()
+    channel.queue_declare(queue='setup_ready')
+    channel.queue_purge(queue='setup_ready')
+    stop = threading.Event()
+    responder = threading.Thread(target=respond_to_pdf_requests, args=(parameters, stop), daemon=True)
+    responder.start()
+    log = open(os.path.join(tempfile.mkdtemp(), 'controller.log'), 'w')
+
+    start = time.time()
+    process = start_controller(test_duration, log)
+    channel.basic_publish(exchange='', routing_key='setup_ready', body=setup_id)
+    connection.close()
+    while results.count_documents({'setup_id' : setup_id}) < num_of_tests // 2:
+        if process.poll() is not None:
+            print('the controller exited before it was killed, see %s' % log.name)
+            sys.exit(1)
+        time.sleep(0.01)
+    process.send_signal(signal.SIGKILL)
+    process.wait()
+    first_run = time.time() - start
+    recorded_at_kill = results.count_documents({'setup_id' : setup_id})
+
+    start = time.time()
+    process = start_controller(test_duration, log)
+    try:
+        finished = process.wait(RESUME_TIMEOUT) == 0
+    except subprocess.TimeoutExpired:
+        process.kill()
+        finished = False
+    resumed_run = time.time() - start
+    stop.set()
+    responder.join()
+
+    per_test = Counter(result['test'] for result in results.find({'setup_id' : setup_id}, {'test' : 1}))
+    run_ids = results.distinct('run_id', {'setup_id' : setup_id})
+    phases = [checkpoint.get('phase') for checkpoint in checkpoints.find({'setup_id' : setup_id})]
+    print('%d tests, killed after %.2f seconds with %d results recorded, resumed in %.2f seconds' % (
+        num_of_tests, first_run, recorded_at_kill, resumed_run))
+    print('%d tests without a result, %d tests with more than one, results of %d runs, checkpoints %s' % (
+        num_of_tests - len(per_test), sum(1 for count in per_test.values() if count > 1), len(run_ids), phases))
+    ok = (finished and len(per_test) == num_of_tests and max(per_test.values()) == 1 and len(run_ids) == 1
+          and phases == [DONE])
+    print('resume - %s' % ('no completed work repeated' if ok else 'FAILED, see %s' % log.name))
+
+    # only the benchmark's own run, the database may have real ones. nothing consumed the results messages of the
+    # run, on the local broker they're the only ones on the queue
+    results.delete_many({'setup_id' : setup_id})
+    checkpoints.delete_many({'setup_id' : setup_id})
+    mdb_handler.db[RUN_SUMMARIES_COLLECTION].delete_many({'setup_id' : setup_id})
+    mdb_handler.db['Configuration'].delete_one({'_id' : ObjectId(setup_id)})
+    connection = pika.BlockingConnection(parameters)
+    connection.channel().queue_purge(queue='results')
+    connection.close()
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# concurrent report requests over the multiplexed rpc client against the old single corr_id busy loop,
+# on a local broker (for example `docker run -p 5672:5672 rabbitmq`). a stand-in report generator answers every
+# request after a fixed render time, so the numbers show the client side only: wall time and cpu time spent waiting.
+#
+# usage: RMQ_HOST=localhost python benchmark-rpc.py [concurrent requests] [render seconds]
+
+import os
+import sys
+import time
+import uuid
+import logging
+import functools
+import threading
+
+import pika
+
+os.environ.setdefault('QUEUE_NAMES', 'pdfs')
+
+from rabbitmq_handler import RpcClient
+
+QUEUE = 'benchmark_pdfs'
+
+
+# answers every request after render_time seconds without blocking the other requests
+def stand_in_report_generator(connection_parameters, render_time, started):
+    connection = pika.BlockingConnection(connection_parameters)
+    channel = connection.channel()
+    channel.queue_declare(queue=QUEUE)
+    channel.queue_purge(QUEUE)
+
+    def reply(props):
+        channel.basic_publish(exchange='', routing_key=props.reply_to,
+                              properties=pika.BasicProperties(correlation_id=props.correlation_id),
+                              body='I am link to pdf, cant you see?')
+
+    def on_request(ch, method, props, body):
+        connection.call_later(render_time, functools.partial(reply, props))
+
+    channel.basic_consume(queue=QUEUE, on_message_callback=on_request, auto_ack=True)
+    started.set()
+    channel.start_consuming()
+
+# the way request_pdf used to wait, one request at a time spinning on process_data_events
+def single_corr_id_requests(connection_parameters, num_of_requests):
+    connection = pika.BlockingConnection(connection_parameters)
+    channel = connection.channel()
+    callback_queue = channel.queue_declare(queue='', exclusive=True).method.queue
+    state = {'corr_id' : None, 'response' : None}
+
+    def on_response(ch, method, props, body):
+        if state['corr_id'] == props.correlation_id:
+            state['response'] = body
+
+    channel.basic_consume(queue=callback_queue, on_message_callback=on_response, auto_ack=True)
+    for index in range(num_of_requests):
+        state['response'] = None
+        state['corr_id'] = str(uuid.uuid4())
+        channel.basic_publish(exchange='', routing_key=QUEUE,
+                              properties=pika.BasicProperties(reply_to=callback_queue, correlation_id=state['corr_id']),
+                              body='')
+        while state['response'] is None:
+            connection.process_data_events()
+    connection.close()
+
+def multiplexed_requests(connection_parameters, num_of_requests):
+    rpc_client = RpcClient(connection_parameters, QUEUE, logging.getLogger('rmq'))
+    rpc_client.start()
+    futures = [rpc_client.call('', timeout=60) for index in range(num_of_requests)]
+    for future in futures:
+        future.result()
+    rpc_client.close()
+
+def measure(name, requests, connection_parameters, num_of_requests):
+    start = time.time()
+    start_cpu = time.process_time()
+    requests(connection_parameters, num_of_requests)
+    elapsed = time.time() - start
+    cpu = time.process_time() - start_cpu
+    print('%-18s %3d requests: %7.3f seconds wall | %7.3f seconds cpu (%3.0f%% of a core)' % (
+        name, num_of_requests, elapsed, cpu, 100.0 * cpu / elapsed))
+
+def main():
+    num_of_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    render_time = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    connection_parameters = pika.ConnectionParameters(os.getenv('RMQ_HOST'))
+    started = threading.Event()
+    threading.Thread(target=stand_in_report_generator, args=(connection_parameters, render_time, started), daemon=True).start()
+    started.wait()
+    print('render time %.2f seconds' % render_time)
+    # the old loop runs the requests one by one, a single request is enough to see its cpu usage
+    measure('single corr_id', single_corr_id_requests, connection_parameters, 1)
+    measure('multiplexed', multiplexed_requests, connection_parameters, 1)
+    measure('single corr_id', single_corr_id_requests, connection_parameters, num_of_requests)
+    measure('multiplexed', multiplexed_requests, connection_parameters, num_of_requests)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# measures the time from a message arriving (the callback firing) until the waiting flow resumes,
+# once with the old Manager dict + waiting.wait polling and once with the event driven run state
+#
+# usage: python benchmark-run-state.py [iterations] [busy listeners]
+
+import sys
+import time
+import random
+import statistics
+import threading
+
+# the old model
+from multiprocessing import Process, Manager
+from waiting import wait, TimeoutExpired
+
+from run_state import RunState
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def report(name, samples):
+    if not samples:
+        print('%-12s no samples' % name)
+        return
+    samples = [sample * 1000 for sample in samples]
+    print('%-12s mean %8.3f ms | p50 %8.3f ms | p99 %8.3f ms | max %8.3f ms' % (
+        name, statistics.mean(samples), percentile(samples, 0.5), percentile(samples, 0.99), max(samples)))
+
+# stands in for the callback of a listener process - copies the whole dict in and out like the handler did
+def fire_manager_flag(flags, delay):
+    time.sleep(delay)
+    temp_list = flags[1]
+    temp_list['setup_ready'] = True
+    temp_list['arrived_at'] = time.time()
+    flags[1] = temp_list
+
+# other listeners updating the dict at the same time, like the results listeners of a busy run,
+# their copy of the dict may be taken before the flag was set and then overwrite it
+def busy_manager_listener(flags, stop_at):
+    while time.time() < stop_at:
+        temp_list = flags[1]
+        temp_list['results'] = temp_list.get('results', 0) + 1
+        flags[1] = temp_list
+
+def manager_latency(iterations, busy_listeners):
+    manager = Manager()
+    flags = manager.dict()
+    samples = []
+    lost_updates = 0
+    for _ in range(iterations):
+        flags[1] = {'setup_ready' : False, 'arrived_at' : None}
+        delay = random.uniform(0.01, 0.05)
+        busy = [Process(target=busy_manager_listener, args=(flags, time.time() + delay * 2)) for _ in range(busy_listeners)]
+        for listener in busy:
+            listener.start()
+        listener = Process(target=fire_manager_flag, args=(flags, delay))
+        listener.start()
+        try:
+            wait(lambda: flags[1]['setup_ready'], timeout_seconds=5, waiting_for="setup to be ready")
+            resumed_at = time.time()
+            samples.append(resumed_at - flags[1]['arrived_at'])
+        except TimeoutExpired:
+            lost_updates += 1
+        listener.join()
+        for busy_listener in busy:
+            busy_listener.join()
+    manager.shutdown()
+    if lost_updates:
+        print('manager: %d of %d flag updates were overwritten and never seen' % (lost_updates, iterations))
+    return samples
+
+def fire_run_state(run_state, delay):
+    time.sleep(delay)
+    run_state.update(setup_ready=True, arrived_at=time.time())
+
+def busy_run_state_listener(run_state, stop_at):
+    results = 0
+    while time.time() < stop_at:
+        results += 1
+        run_state.set('results', results)
+
+def run_state_latency(iterations, busy_listeners):
+    samples = []
+    for _ in range(iterations):
+        run_state = RunState(setup_ready=False, arrived_at=None, results=0)
+        delay = random.uniform(0.01, 0.05)
+        busy = [threading.Thread(target=busy_run_state_listener, args=(run_state, time.time() + delay * 2)) for _ in range(busy_listeners)]
+        for listener in busy:
+            listener.start()
+        listener = threading.Thread(target=fire_run_state, args=(run_state, delay))
+        listener.start()
+        run_state.wait_for('setup_ready')
+        resumed_at = time.time()
+        samples.append(resumed_at - run_state.get('arrived_at'))
+        listener.join()
+        for busy_listener in busy:
+            busy_listener.join()
+    return samples
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    busy_listeners = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    print('iterations: %d, busy listeners: %d' % (iterations, busy_listeners))
+    report('manager', manager_latency(iterations, busy_listeners))
+    report('run state', run_state_latency(iterations, busy_listeners))
+
+if __name__ == '__main__':
+    main()
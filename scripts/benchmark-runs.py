@@ -0,0 +1,108 @@
+# runs completed per minute by a single controller in the 'multi' mode with 1, 10 and 50 apps starting runs at
+# the same time, on a local broker and mongod (for example `docker run -p 5672:5672 rabbitmq` and
+# `docker run -p 27017:27017 mongo`). every app starts a run after the other on a run scoped queue of its own, the
+# report generator is replaced by a responder which answers every pdf request right away with a link of the request's
+# setup. an app which gets the link of another app's setup fails the benchmark.
+#
+# usage: RMQ_HOST=localhost MONGO_HOST=localhost python benchmark-runs.py [seconds per level] [tests per setup]
+
+import os
+import sys
+import time
+import uuid
+import logging
+import threading
+
+os.environ.update({'CONTROLLER_MODE' : 'multi', 'TIME_DELAY' : '0'})
+os.environ.setdefault('QUEUE_NAMES', 'setup_ready,pdfs')
+os.environ.setdefault('DB_NAME', 'benchmark')
+os.environ.setdefault('MESSAGE_CODEC', 'msgpack')
+os.environ.setdefault('RESULTS_FLUSH_INTERVAL', '0.1')
+
+import pika
+
+from json import loads
+
+import controller
+from run_state import RunState
+
+LEVELS = [1, 10, 50]
+
+
+# answers the pdf requests of the controller, like the report generator would
+def respond_to_pdf_requests(connection_parameters, stop):
+    connection = pika.BlockingConnection(connection_parameters)
+    channel = connection.channel()
+    channel.queue_declare(queue='pdfs')
+
+    def on_request(ch, method, props, body):
+        ch.basic_publish(exchange='', routing_key=props.reply_to,
+                         properties=pika.BasicProperties(correlation_id=props.correlation_id),
+                         body='/reports/report-%s.pdf' % loads(body)['setup_id'])
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    channel.basic_consume(queue='pdfs', on_message_callback=on_request)
+    while not stop.is_set():
+        connection.process_data_events(time_limit=0.1)
+    connection.close()
+
+# starts runs one after the other until stop, returns through completed the time of every run
+def app(tests, stop, completed, crossed):
+    rmq_handler = controller.service.rmq_handler
+    mdb_handler = controller.service.mdb_handler
+    while not stop.is_set():
+        run_id = str(uuid.uuid4())
+        run_state = RunState(all_results_ready=False, pdf_ready=False, pdf_link='')
+        listener = rmq_handler.listen_to_run(run_id, ['all_results_ready', 'pdf_ready'], run_state)
+        start = time.time()
+        setup = {'ConfigType' : 'TestConfig', 'SelectedDevice' : 'radio', 'SuitesToRun' : list(tests)}
+        mdb_handler.insert_document('Configuration', setup)
+        rmq_handler.send_data_to_run(run_id, 'setup_ready', setup)
+        run_state.wait_for('all_results_ready', 'pdf_ready')
+        completed.append(time.time() - start)
+        listener.stop()
+        if str(setup['_id']) not in run_state.get('pdf_link'):
+            crossed.append(run_id)
+
+def measure(concurrency, seconds, tests):
+    registry, listener = controller.start_multi_runs(max_active_runs=concurrency)
+    stop = threading.Event()
+    completed = []
+    crossed = []
+    apps = [threading.Thread(target=app, args=(tests, stop, completed, crossed), daemon=True) for index in range(concurrency)]
+    for thread in apps:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    completed_in_time = len(completed)
+    for thread in apps:
+        thread.join()
+    registry.wait_idle()
+    listener.stop()
+    registry.close()
+    return completed_in_time, sorted(completed), crossed
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 30
+    num_of_tests = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    controller.configure_logger_logging(logging.WARNING)
+    logging.getLogger('rmq').setLevel(logging.WARNING)
+    tests = ['suite-%d/test-%d.tdf' % (index % 4, index) for index in range(num_of_tests)]
+    stop = threading.Event()
+    responder = threading.Thread(target=respond_to_pdf_requests,
+                                 args=(controller.service.rmq_handler.connection_parameters, stop), daemon=True)
+    responder.start()
+    ok = True
+    for concurrency in LEVELS:
+        completed, times, crossed = measure(concurrency, seconds, tests)
+        median = times[len(times) // 2] if times else float('nan')
+        print('%3d concurrent setups: %7.1f runs per minute, a run takes %.2f seconds (median)%s' % (
+            concurrency, completed * 60 / seconds, median, ', %d links of other runs' % len(crossed) if crossed else ''))
+        ok = ok and not crossed
+    stop.set()
+    responder.join()
+    controller.service.stop()
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# makespan of a run on several devices with the tests started longest first, against the setup's order. the test
+# durations are heavy tailed (seeded), the planner sees them through noisy history (every estimate is off by up to
+# HISTORY_ERROR) and both orders are simulated with the real durations. the orders are then run by the test executor
+# on a device pool with the durations scaled down to milliseconds. no broker or database is needed.
+#
+# usage: python benchmark-scheduler.py [number of tests] [devices] [tests per device]
+
+import sys
+import time
+import random
+
+from scheduler import build_plan, estimate_durations, simulate, DevicePool
+from test_executor import TestExecutor
+
+HISTORY_ERROR = 0.3
+# seconds of the simulated run per second of the executed one
+SCALE = 1000.0
+
+
+def make_run(num_of_tests, generator):
+    tests = ['suite-%d/test-%d.tdf' % (index % 12, index) for index in range(num_of_tests)]
+    # most tests take seconds, a few take many minutes
+    durations = {test : generator.lognormvariate(3, 1.2) for test in tests}
+    # a test which never ran before is estimated from its suite
+    history = {test : duration * generator.uniform(1 - HISTORY_ERROR, 1 + HISTORY_ERROR)
+               for test, duration in durations.items() if generator.random() < 0.9}
+    return tests, durations, estimate_durations(tests, history)
+
+def execute(order, durations, limits):
+    devices = DevicePool(limits)
+
+    def run_test(test):
+        with devices.take():
+            time.sleep(durations[test] / SCALE)
+
+    executor = TestExecutor(run_test, lambda test, result: None, max_workers=sum(limits.values()))
+    start = time.time()
+    executor.run(order)
+    return (time.time() - start) * SCALE
+
+def main():
+    num_of_tests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    num_of_devices = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    per_device = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    generator = random.Random(11)
+    tests, durations, estimates = make_run(num_of_tests, generator)
+    limits = {'radio-%d' % index : per_device for index in range(num_of_devices)}
+    slots = num_of_devices * per_device
+    total = sum(durations.values())
+    # no order can end before the longest test, or before the tests fill every slot evenly
+    lower_bound = max(total / slots, max(durations.values()))
+    plan = build_plan(tests, estimates, limits)
+    print('%d tests on %d devices x %d, %.0f seconds of test time, at best %.0f seconds (planned %.0f)' % (
+        num_of_tests, num_of_devices, per_device, total, lower_bound, plan.makespan))
+    print('%-16s %8.0f seconds' % ('in sequence', total))
+    for name, order in [('setup order', tests), ('longest first', plan.order)]:
+        makespan = simulate(order, durations, limits)
+        executed = execute(order, durations, limits)
+        print('%-16s %8.0f seconds, %4.2fx of the best, devices busy %3.0f%% | executed %8.0f seconds' % (
+            name, makespan, makespan / lower_bound, total / (makespan * slots) * 100, executed))
+
+if __name__ == '__main__':
+    main()
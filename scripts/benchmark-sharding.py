@@ -0,0 +1,67 @@
+# suite throughput of a sharded run with 1/2/4 local worker processes, on a local broker
+# (for example `docker run -p 5672:5672 rabbitmq`). the workers run the real ShardWorker, only the tests are
+# simulated by sleeping, and the run is over when the aggregator saw every shard done.
+#
+# usage: RMQ_HOST=localhost python benchmark-sharding.py [number of tests] [shard size] [seconds per test]
+
+import os
+import sys
+import time
+import logging
+import threading
+import uuid
+
+os.environ.setdefault('QUEUE_NAMES', 'results')
+
+from multiprocessing import Process
+
+from bson.objectid import ObjectId
+
+from rabbitmq_handler import RabbitmqHandler
+from sharding import split_into_shards, publish_shards, declare_shard_queues, ShardWorker, ShardAggregator, SHARDS_QUEUE
+
+
+def simulated_shard(test_duration, shard):
+    for test in shard['tests']:
+        time.sleep(test_duration)
+    return len(shard['tests'])
+
+def worker_main(connection_parameters, test_duration):
+    ShardWorker(connection_parameters, lambda shard, headers: simulated_shard(test_duration, shard)).start_consuming()
+
+def run(rmq_handler, setup, num_of_workers, shard_size, test_duration):
+    done = threading.Event()
+    run_id = str(uuid.uuid4())
+    aggregator = ShardAggregator(rmq_handler.connection_parameters, lambda run_id, num_of_results: done.set())
+    aggregator.expect(run_id)
+    aggregator.start()
+    workers = [Process(target=worker_main, args=(rmq_handler.connection_parameters, test_duration)) for index in range(num_of_workers)]
+    for worker in workers:
+        worker.start()
+    start = time.time()
+    publish_shards(rmq_handler, split_into_shards(setup, run_id, shard_size))
+    done.wait()
+    elapsed = time.time() - start
+    for worker in workers:
+        worker.terminate()
+        worker.join()
+    aggregator.stop()
+    return elapsed
+
+def main():
+    num_of_tests = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    shard_size = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    test_duration = float(sys.argv[3]) if len(sys.argv) > 3 else 0.02
+    rmq_handler = RabbitmqHandler(logging.WARNING)
+    declare_shard_queues(rmq_handler.channel)
+    rmq_handler.channel.queue_purge(SHARDS_QUEUE)
+    print('%d tests of %.3f seconds in shards of %d' % (num_of_tests, test_duration, shard_size))
+    baseline = None
+    for num_of_workers in [1, 2, 4]:
+        setup = {'_id' : ObjectId(), 'SuitesToRun' : ['suite-%d/test-%d.tdf' % (index % 8, index) for index in range(num_of_tests)]}
+        elapsed = run(rmq_handler, setup, num_of_workers, shard_size, test_duration)
+        baseline = baseline or elapsed
+        print('%d worker(s): %7.2f seconds | %8.1f tests/s | speedup %4.2fx' % (num_of_workers, elapsed, num_of_tests / elapsed, baseline / elapsed))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# soak test of the consumers against a local broker (for example `docker run -p 5672:5672 rabbitmq`): a publisher
+# floods a queue while its consumer fails a share of the messages on purpose and never handles the poison ones.
+# the failed messages go through the retry queues, the poison ones end up in the dead letter queue. every message
+# must either be handled or be dead-lettered (nothing lost), and the consumer's memory must stay bounded by the
+# prefetch instead of growing with the backlog (SOAK_MEMORY_LIMIT_MB over the memory before the flood).
+#
+# usage: RMQ_HOST=localhost python benchmark-soak.py [messages] [failure rate] [poison rate]
+
+import os
+import sys
+import time
+import json
+import random
+import logging
+import threading
+
+os.environ['QUEUE_NAMES'] = 'soak'
+os.environ.setdefault('RMQ_PREFETCH_COUNT', '10')
+os.environ.setdefault('RMQ_MAX_RETRIES', '3')
+os.environ.setdefault('RMQ_RETRY_DELAY', '0.05')
+
+from rabbitmq_handler import RabbitmqHandler
+
+QUEUE = 'soak'
+MEMORY_LIMIT_MB = float(os.getenv('SOAK_MEMORY_LIMIT_MB', '64'))
+# seconds of work per handled message, and the padding of every message
+WORK = 0.0002
+PADDING = 'x' * 1024
+
+
+def resident_memory_kb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+# the soak queue's callback, which fails on purpose
+class SoakHandler(RabbitmqHandler):
+    routing_key_callbacks = dict(RabbitmqHandler.routing_key_callbacks, soak='handle_soak_message')
+
+    def __init__(self, logging_level, failure_rate):
+        super().__init__(logging_level)
+        self.failure_rate = failure_rate
+        self.handled = set()
+        self.failures = 0
+
+    def handle_soak_message(self, ch, method, properties, body, run_state):
+        message = json.loads(body)
+        if message['poison'] or random.random() < self.failure_rate:
+            self.failures += 1
+            raise RuntimeError('injected failure of message %d' % message['id'])
+        time.sleep(WORK)
+        self.handled.add(message['id'])
+
+
+def purge(rmq_handler):
+    retry_queues = rmq_handler.retry_queues[QUEUE]
+    for queue_name in [QUEUE, retry_queues.dead_letter_queue] + [name for name, ttl in retry_queues.retry_queues]:
+        rmq_handler.connection_manager.run(lambda channel: channel.queue_purge(queue_name))
+
+# takes the dead-lettered messages off their queue, returns their ids
+def drain_dead_letters(rmq_handler):
+    dead_letter_queue = rmq_handler.retry_queues[QUEUE].dead_letter_queue
+    ids = set()
+    while True:
+        method, properties, body = rmq_handler.connection_manager.run(
+            lambda channel: channel.basic_get(dead_letter_queue, auto_ack=True))
+        if method is None:
+            return ids
+        ids.add(json.loads(body)['id'])
+
+def main():
+    num_of_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    failure_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    poison_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.01
+    rmq_handler = SoakHandler(logging.ERROR, failure_rate)
+    purge(rmq_handler)
+    poison = set(index for index in range(num_of_messages) if random.random() < poison_rate)
+
+    baseline_kb = resident_memory_kb()
+    listener = rmq_handler.listen([QUEUE], None)
+
+    def publish():
+        for index in range(num_of_messages):
+            rmq_handler.send('', QUEUE, json.dumps({'id' : index, 'poison' : index in poison, 'padding' : PADDING}))
+
+    start = time.time()
+    publisher = threading.Thread(target=publish, daemon=True)
+    publisher.start()
+    dead = set()
+    peak_kb = baseline_kb
+    peak_depth = 0
+    deadline = start + max(600, num_of_messages * WORK * 10)
+    while time.time() < deadline and len(rmq_handler.handled | dead) < num_of_messages:
+        time.sleep(0.2)
+        peak_kb = max(peak_kb, resident_memory_kb())
+        peak_depth = max(peak_depth, rmq_handler.get_queue_depth(QUEUE))
+        dead |= drain_dead_letters(rmq_handler)
+    elapsed = time.time() - start
+    publisher.join()
+    listener.stop()
+
+    lost = num_of_messages - len(rmq_handler.handled | dead)
+    growth_mb = (peak_kb - baseline_kb) / 1024
+    print('%d messages (%d poison) in %.1f seconds, %d injected failures' % (
+        num_of_messages, len(poison), elapsed, rmq_handler.failures))
+    print('%d handled, %d dead-lettered (%d of them poison), %d lost' % (
+        len(rmq_handler.handled), len(dead), len(dead & poison), lost))
+    print('up to %d messages waited in the broker, the consumer grew by %.1f MB (limit %.0f MB, prefetch %d)' % (
+        peak_depth, growth_mb, MEMORY_LIMIT_MB, rmq_handler.prefetch_count))
+    ok = lost == 0 and poison <= dead and growth_mb <= MEMORY_LIMIT_MB
+    print('soak - %s' % ('no messages lost, memory bounded' if ok else 'FAILED'))
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# cold start of the app and the controller, every measurement in a fresh interpreter: the import of the service,
+# and (with a local broker and mongod, for example `docker run -p 5672:5672 rabbitmq` and `docker run -p 27017:27017 mongo`)
+# the time from the start of the interpreter to the first consumer of the app, and to both connections of the
+# controller being open, against opening them one after the other like the services did at import time.
+# the cold start of the services is compared with a target (COLD_START_TARGET seconds).
+#
+# usage: [RMQ_HOST=localhost MONGO_HOST=localhost] python benchmark-startup.py [repetitions]
+
+import os
+import sys
+import subprocess
+import statistics
+
+COLD_START_TARGET = float(os.getenv('COLD_START_TARGET', '1'))
+
+# every snippet prints the seconds it measured, from the start of the interpreter
+PRELUDE = '''
+import time
+import logging
+start = time.perf_counter()
+'''
+
+IMPORT_APP = PRELUDE + '''
+import app
+print(time.perf_counter() - start)
+'''
+
+IMPORT_CONTROLLER = PRELUDE + '''
+import controller
+print(time.perf_counter() - start)
+'''
+
+APP_FIRST_CONSUME = PRELUDE + '''
+import app
+app.service.start('mdb_handler')
+listener = app.service.listening_handler.listen(['tests_list'], app.run_state)
+print(time.perf_counter() - start)
+listener.stop()
+'''
+
+CONTROLLER_CONNECTED = PRELUDE + '''
+import controller
+for thread in controller.service.start('rmq_handler', 'mdb_handler'):
+    thread.join()
+print(time.perf_counter() - start)
+'''
+
+# the way the services started before, everything at import time and one after the other
+EAGER = PRELUDE + '''
+from rabbitmq_handler import RabbitmqHandler
+from mongodb_handler import MongodbHandler
+rmq_handler = RabbitmqHandler(logging.INFO)
+mdb_handler = MongodbHandler()
+print(time.perf_counter() - start)
+'''
+
+
+def measure(code, repetitions):
+    environment = dict(os.environ)
+    environment.setdefault('QUEUE_NAMES', 'tests_list,setup_ready,results,all_results_ready,pdfs,pdf_ready')
+    environment.setdefault('TIME_DELAY', '0')
+    times = []
+    for index in range(repetitions):
+        output = subprocess.run([sys.executable, '-c', code], env=environment, capture_output=True, text=True)
+        if output.returncode != 0:
+            return None, output.stderr.strip().splitlines()[-1]
+        times.append(float(output.stdout.split()[0]))
+    return statistics.median(times), None
+
+def report(name, code, repetitions, target=None):
+    seconds, error = measure(code, repetitions)
+    if seconds is None:
+        print('%-34s failed - %s' % (name, error))
+        return True
+    line = '%-34s %8.1f ms' % (name, seconds * 1000)
+    if target is not None:
+        line += ' | target %.0f ms - %s' % (target * 1000, 'met' if seconds <= target else 'MISSED')
+    print(line)
+    return target is None or seconds <= target
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    report('import app', IMPORT_APP, repetitions)
+    report('import controller', IMPORT_CONTROLLER, repetitions)
+    ok = True
+    if os.getenv('RMQ_HOST') and os.getenv('MONGO_HOST'):
+        ok = report('app: first consumer', APP_FIRST_CONSUME, repetitions, COLD_START_TARGET) and ok
+        ok = report('controller: both connections', CONTROLLER_CONNECTED, repetitions, COLD_START_TARGET) and ok
+        report('eager: import + connect in turn', EAGER, repetitions)
+    else:
+        print('(set RMQ_HOST and MONGO_HOST to measure the connections)')
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# latency of a run's summary (pass/fail counts per suite) at 100k results per run, on a local mongod (for example
+# `docker run -p 27017:27017 mongo`): scanning the run's results and counting them in python, the aggregation
+# pipeline which counts them inside mongo, and the run's materialized summary document. the results are inserted in
+# the controller's batches with the summary updated after every batch, which is timed too, and the three summaries
+# are checked to be the same.
+#
+# usage: MONGO_HOST=localhost DB_NAME=benchmark python benchmark-summaries.py [results per run] [runs]
+
+import os
+import sys
+import time
+import statistics
+
+os.environ.setdefault('DB_NAME', 'benchmark')
+
+from mongodb_handler import MongodbHandler, RESULTS_COLLECTION, RUN_SUMMARIES_COLLECTION
+from report_renderer import ResultsSummary
+
+BATCH_SIZE = 100
+REPEATS = 10
+
+
+def fill(mdb_handler, run_id, num_of_results):
+    batch = []
+    inserting = updating = 0.0
+    for index in range(num_of_results):
+        batch.append({'run_id' : run_id, 'setup_id' : 'benchmark', 'test' : 'suite-%d/test-%d.tdf' % (index % 20, index),
+                      'suite' : 'suite-%d' % (index % 20), 'result' : 'Pass' if index % 7 else 'Fail',
+                      'name' : 'test %d' % index, 'timestamp' : time.time(), 'duration' : (index % 100) / 10.0})
+        if len(batch) == BATCH_SIZE or index == num_of_results - 1:
+            start = time.perf_counter()
+            mdb_handler.insert_documents(RESULTS_COLLECTION, batch)
+            inserting += time.perf_counter() - start
+            start = time.perf_counter()
+            mdb_handler.update_run_summary(batch)
+            updating += time.perf_counter() - start
+            batch = []
+    return inserting, updating
+
+# like a report counting every result of the run
+def scan(mdb_handler, run_id):
+    summary = ResultsSummary()
+    for result in mdb_handler.get_documents(RESULTS_COLLECTION, 'run_id', run_id):
+        summary.add(result)
+    return {'total' : summary.total, 'Fail' : sum(counts['Fail'] for counts in summary.suites.values())}
+
+def aggregated(mdb_handler, run_id):
+    summary = mdb_handler.summarize_results(run_id)
+    return {'total' : summary['total'], 'Fail' : summary.get('Fail', 0)}
+
+def materialized(mdb_handler, run_id):
+    summary = mdb_handler.get_run_summary(run_id)
+    return {'total' : summary['total'], 'Fail' : summary.get('Fail', 0)}
+
+def measure(name, summarize, mdb_handler, run_ids):
+    latencies = []
+    for index in range(REPEATS):
+        for run_id in run_ids:
+            start = time.perf_counter()
+            counts = summarize(mdb_handler, run_id)
+            latencies.append(time.perf_counter() - start)
+    print('%-13s p50 %9.2f ms | max %9.2f ms' % (name, statistics.median(latencies) * 1000, max(latencies) * 1000))
+    return counts
+
+# only the benchmark's own runs, the database may have real ones
+def remove_runs(mdb_handler, run_ids):
+    mdb_handler.db[RESULTS_COLLECTION].delete_many({'run_id' : {'$in' : run_ids}})
+    mdb_handler.db[RUN_SUMMARIES_COLLECTION].delete_many({'_id' : {'$in' : run_ids}})
+
+def main():
+    num_of_results = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    num_of_runs = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    mdb_handler = MongodbHandler()
+    run_ids = ['benchmark-run-%d' % index for index in range(num_of_runs)]
+    remove_runs(mdb_handler, run_ids)
+    inserting = updating = 0.0
+    for run_id in run_ids:
+        run_inserting, run_updating = fill(mdb_handler, run_id, num_of_results)
+        inserting += run_inserting
+        updating += run_updating
+    print('%d runs of %d results: inserted in %.1f s, summaries updated in %.1f s (%.0f%% more per batch)' % (
+        num_of_runs, num_of_results, inserting, updating, updating / inserting * 100))
+    counts = [measure(name, summarize, mdb_handler, run_ids)
+              for name, summarize in [('scan', scan), ('aggregation', aggregated), ('materialized', materialized)]]
+    ok = all(count == counts[0] for count in counts)
+    print('the summaries %s' % ('match' if ok else 'differ - %s' % counts))
+    remove_runs(mdb_handler, run_ids)
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# for resuming a run after the controller died, instead of running it again from the start
+import os
+import time
+
+# for the default owner of the runs of a controller
+import socket
+
+from pymongo import ReturnDocument
+
+from mongodb_handler import mongo_operation
+
+CHECKPOINTS_COLLECTION = 'Run Checkpoints'
+RESULTS_COLLECTION = 'Test Results'
+
+# the phases of a run after its setup is ready, in order
+RUNNING_TESTS = 'running_tests'
+REPORT_REQUESTED = 'report_requested'
+DONE = 'done'
+# a run which failed after every resume it was given, it's left where it stopped and no controller picks it up again
+ABANDONED = 'abandoned'
+
+# the runs of a standalone controller are resumed by whichever standalone controller starts next, the runs of a
+# 'multi' mode controller belong to their app and are resumed by the controller which started them, its owner
+STANDALONE = 'standalone'
+MULTI = 'multi'
+# the same after a restart, set it where the host name changes between restarts
+controller_id = os.getenv('CONTROLLER_ID') or socket.gethostname()
+
+
+# the progress of a run in a document of its own, keyed by the run's id (a setup may be run any number of times):
+# the run's setup, the phase, the tests whose results were recorded and the pending report request. every change is
+# a single upsert, so checkpointing costs a round trip per phase and per batch of results.
+class RunCheckpoint:
+    def __init__(self, collection, run_id, setup_id, document=None):
+        self.collection = collection
+        self.run_id = str(run_id)
+        self.setup_id = str(setup_id)
+        self.document = document or {'_id' : self.run_id, 'setup_id' : self.setup_id, 'completed' : []}
+
+    @property
+    def phase(self):
+        return self.document.get('phase')
+
+    def update(self, operation):
+        operation.setdefault('$set', {})['updated_at'] = time.time()
+        with mongo_operation('update_one', self.collection.name):
+            self.collection.update_one({'_id' : self.run_id}, operation, upsert=True)
+
+    # fields are saved with the phase, like the report request or the number of results
+    def set_phase(self, phase, **fields):
+        fields['phase'] = phase
+        self.document.update(fields)
+        self.update({'$set' : fields})
+
+    def complete(self, tests):
+        if tests:
+            self.update({'$addToSet' : {'completed' : {'$each' : list(tests)}}})
+
+    # every time the run is resumed, see abandon_failed_runs
+    def count_attempt(self):
+        self.document['attempts'] = self.document.get('attempts', 0) + 1
+        self.update({'$inc' : {'attempts' : 1}})
+
+
+# the checkpoint of a run which was started before is returned as it is, so a setup_ready message which is delivered
+# again doesn't take its run back to the first phase. fields are saved with a new checkpoint, like the run's test list
+def start_run(mdb_handler, run_id, setup_id, mode=STANDALONE, **fields):
+    collection = mdb_handler.db[CHECKPOINTS_COLLECTION]
+    with mongo_operation('find_one_and_update', CHECKPOINTS_COLLECTION):
+        document = collection.find_one_and_update(
+            {'_id' : str(run_id)},
+            {'$setOnInsert' : dict(fields, setup_id=str(setup_id), phase=RUNNING_TESTS, completed=[], mode=mode,
+                                   owner=controller_id, attempts=0),
+             '$set' : {'updated_at' : time.time()}},
+            upsert=True, return_document=ReturnDocument.AFTER)
+    return load_checkpoint(collection, document)
+
+# the checkpoints of older controllers are keyed by the setup id, and have no setup_id of their own
+def load_checkpoint(collection, document):
+    return RunCheckpoint(collection, document['_id'], document.get('setup_id', document['_id']), document)
+
+# the latest standalone run which didn't get to its end, None if there's none. the checkpoints of older
+# controllers have no mode, they're all standalone
+def find_unfinished_run(mdb_handler):
+    collection = mdb_handler.db[CHECKPOINTS_COLLECTION]
+    with mongo_operation('find_one', CHECKPOINTS_COLLECTION):
+        document = collection.find_one({'phase' : {'$nin' : [DONE, ABANDONED]}, 'mode' : {'$ne' : MULTI}}, sort=[('updated_at', -1)])
+    if document is None:
+        return None
+    return load_checkpoint(collection, document)
+
+# the 'multi' mode runs of the owner which didn't get to their end, the oldest first
+def find_unfinished_runs(mdb_handler, owner=controller_id):
+    collection = mdb_handler.db[CHECKPOINTS_COLLECTION]
+    with mongo_operation('find', CHECKPOINTS_COLLECTION):
+        documents = list(collection.find({'mode' : MULTI, 'owner' : owner, 'phase' : {'$nin' : [DONE, ABANDONED]}},
+                                         sort=[('updated_at', 1)]))
+    return [load_checkpoint(collection, document) for document in documents]
+
+# the unfinished runs which were resumed max_attempts times already, and failed every time (the report request timed
+# out, say) are abandoned, so they don't hold back the runs after them. returns the checkpoints of the abandoned runs
+def abandon_failed_runs(mdb_handler, max_attempts):
+    collection = mdb_handler.db[CHECKPOINTS_COLLECTION]
+    query = {'phase' : {'$nin' : [DONE, ABANDONED]}, 'attempts' : {'$gte' : max_attempts}}
+    with mongo_operation('find', CHECKPOINTS_COLLECTION):
+        documents = list(collection.find(query))
+    if documents:
+        with mongo_operation('update_many', CHECKPOINTS_COLLECTION):
+            collection.update_many({'_id' : {'$in' : [document['_id'] for document in documents]}},
+                                   {'$set' : {'phase' : ABANDONED, 'updated_at' : time.time()}})
+    return [load_checkpoint(collection, document) for document in documents]
+
+# the tests of the run which already have a result. the results are the source of truth, the checkpoint's
+# completed tests may miss the last batch (inserted right before the controller died)
+def recorded_tests(mdb_handler, run_id, tests):
+    with mongo_operation('find', RESULTS_COLLECTION):
+        cursor = mdb_handler.db[RESULTS_COLLECTION].find({'run_id' : str(run_id), 'test' : {'$in' : list(tests)}},
+                                                         {'_id' : 0, 'test' : 1})
+        return set(result['test'] for result in cursor)
@@ -5,24 +5,37 @@
 import logging
 from logging import handlers
 
-# for easy use of rabbitmq
-from rabbitmq_handler import RabbitmqHandler
-# for easy read/write on mongodb
-from mongodb_handler import MongodbHandler
+# the rabbitmq and mongodb handlers, connected on first use. the modules which load pika or pymongo (the handlers,
+# sharding, scheduler, suite_discovery, checkpoints) are imported by the flows which use them, so importing the
+# controller doesn't load them
+from service import Service
+# for driving many runs at once
+from runs import Run, RunRegistry, RUNS_EXCHANGE, RUN_SETUP_READY, run_of, run_routing_key, run_properties, declare_run_setup_ready
 
 from json import dumps, loads
-# for event handling
-from waiting import wait
+# for timing the run's stages
+from tracing import tracer
+# for the metrics of the tests
+from metrics import registry
+# for event handling, the rabbitmq callbacks fire transitions on the run state and we block until they happen
+from run_state import RunState
 
-# for more convenient storing dictionaries
-from pandas import DataFrame
-
-# for background waiting function, use multiproccessing
-from multiprocessing import Process, Manager
+# for running the tests concurrently
+from test_executor import TestExecutor
+# for the compiled .tdf files of the tests, kept between the runs
+from test_definitions import DefinitionCache
 
 # for delay use
 import time
 
+# for checking the suites tree in the background
+import threading
+
+import functools
+
+# for the ids of the runs
+import uuid
+
 # for environment variables
 import os
 
@@ -32,11 +45,46 @@ import os
 
 logging_file = None
 logging_level = logging.INFO
-rmq_handler = RabbitmqHandler(logging_level)
-mdb_handler = MongodbHandler()
-manager = Manager()
-flags = manager.dict()
-time_delay = int(os.getenv('TIME_DELAY'))
+service = Service('ctrl', logging_level, logging_file)
+run_state = RunState(setup_ready=False, setup_id='', run_id='', setup=None, results_count=0, all_shards_done=False, pdfs_ready=False, pdf_link='')
+time_delay = float(os.getenv('TIME_DELAY'))
+# how many tests run at once, in total and per suite. with 'device' the tests are planned between the setup's devices
+# by their past durations instead, and every device runs up to MAX_TESTS_PER_DEVICE (or its DeviceLimits) at once
+max_parallel_tests = int(os.getenv('MAX_PARALLEL_TESTS', '4'))
+max_tests_per_group = int(os.getenv('MAX_TESTS_PER_GROUP', '2'))
+tests_group_by = os.getenv('TESTS_GROUP_BY', 'suite')
+# no new tests are started while more results than that wait in the results queue
+max_results_backlog = int(os.getenv('MAX_RESULTS_BACKLOG', '1000'))
+# results are inserted (and published) in batches of up to that many results, or after that many seconds
+results_batch_size = int(os.getenv('RESULTS_BATCH_SIZE', '100'))
+results_flush_interval = float(os.getenv('RESULTS_FLUSH_INTERVAL', '1'))
+# with 'async' the batches are inserted by the async client while the next tests are dispatched
+results_writes = os.getenv('RESULTS_WRITES', 'blocking')
+# the tree of the .tdf suites (dlep/, snmp/...) and the index of its parsed files, the test list is an example without it
+suites_dir = os.getenv('SUITES_DIR')
+suites_index = os.getenv('SUITES_INDEX')
+# up to that many compiled tests are kept, a controller of the 'multi' or 'worker' mode reuses them in its next runs
+test_definition_cache_size = int(os.getenv('TEST_DEFINITION_CACHE_SIZE', '1024'))
+test_definitions = DefinitionCache(suites_dir, test_definition_cache_size) if suites_dir is not None else None
+if test_definitions is not None:
+    test_definitions.export_metrics()
+# seconds to wait for the report generator
+pdf_timeout = float(os.getenv('PDF_TIMEOUT', '300'))
+# 'standalone' runs the whole run, a 'coordinator' splits the run's tests into shards of up to shard_size tests
+# and collects the results of the 'worker' controllers which run them
+controller_mode = os.getenv('CONTROLLER_MODE', 'standalone')
+# 'multi' drives the runs of any number of run scoped apps, up to max_active_runs at once
+max_active_runs = int(os.getenv('MAX_ACTIVE_RUNS', '10'))
+shard_size = int(os.getenv('SHARD_SIZE', '50'))
+# seconds a worker waits for the broker to confirm a shard's results, the shard fails (and is run again) after that
+shard_confirm_timeout = float(os.getenv('SHARD_CONFIRM_TIMEOUT', '60'))
+# a controller which died mid run picks the run up where it stopped when it's started again, up to that many times
+resume_runs = os.getenv('RESUME_RUNS', '1') == '1'
+max_resume_attempts = int(os.getenv('MAX_RESUME_ATTEMPTS', '3'))
+# the checkpoint of the current run, once its setup is known
+run_checkpoint = None
+
+TEST_DURATION = registry.histogram('ctrl_test_duration_seconds', 'Time of a test, by suite', ['suite'])
 
 # for logging
 logger = logging.getLogger('ctrl')
@@ -62,10 +110,39 @@ def configure_logger_logging(logging_level):
     # add the handlers to logger
     logger.addHandler(console_handler)
 
-# first function to be called
+# returns the id of the test list. the list of the last discovery is published right away, whatever the size of the
+# tree, and the tree is checked for changes in the background (only the changed files are parsed again).
+# the first discovery parses every file before the list is published
+def discover_test_suites():
+    from suite_discovery import SuiteDiscovery, find_test_suites
+    discovery = SuiteDiscovery(suites_dir, suites_index)
+    uid = find_test_suites(service.mdb_handler, suites_dir)
+    if uid is None:
+        discovery.load_index()
+        discovery.refresh()
+        return service.mdb_handler.insert_document('Configuration', discovery.test_suites())
+    threading.Thread(target=refresh_test_suites, args=(discovery,), daemon=True).start()
+    return uid
+
+# the changed list is inserted as the latest AvailableTestSuites, for the next run
+def refresh_test_suites(discovery):
+    discovery.load_index()
+    num_of_changes = discovery.refresh()
+    if num_of_changes:
+        service.mdb_handler.insert_document('Configuration', discovery.test_suites())
+    message = 'ctrl: suites tree checked, %d tests changed' % num_of_changes
+    logger.info(message)
+
+# first function to be called, returns the id of the test list
 def make_test_list():
     message = 'ctrl: test list in proggress...'
     logger.info(message)
+    if suites_dir is not None:
+        uid = discover_test_suites()
+        message = 'ctrl: test list ready'
+        logger.info(message)
+        service.rmq_handler.send('', 'tests_list', str(uid))
+        return str(uid)
     time.sleep(time_delay)
     json_document_test_suits_example = '''{
 	"ConfigType": "AvailableTestSuites",
@@ -86,87 +163,371 @@ def make_test_list():
 		    }
 	    ]
     }'''
-    uid = mdb_handler.insert_document('Configuration', loads(json_document_test_suits_example))  
+    uid = service.mdb_handler.insert_document('Configuration', loads(json_document_test_suits_example))  
     message = 'ctrl: test list ready'
     logger.info(message)
-    rmq_handler.send('', 'tests_list', str(uid))
-
-def is_setup_ready():
-    message = 'ctrl: setup_ready flag - {0}'.format(flags[1]['setup_ready'])
-    logger.debug(message)
-    return flags[1]['setup_ready']
-
-def is_pdfs_ready():
-    message = 'ctrl: pdfs flag - {0}'.format(flags[1]['pdfs_ready'])
-    logger.debug(message)
-    return flags[1]['pdfs_ready']
+    service.rmq_handler.send('', 'tests_list', str(uid))
+    return str(uid)
 
 # creating an event handler - waiting for a message of setup ready
 def setup_ready_event_handler():
     message = 'ctrl: im waiting for setup ready'
     logger.info(message)
-    setup_ready_lisenter = Process(target=rmq_handler.wait_for_message, args=('setup_ready',flags,))
+    # a setup per run, the setups of the runs to come stay in the queue
+    setup_ready_lisenter = service.rmq_handler.listen_once('setup_ready', 'setup_ready', run_state)
 
-    setup_ready_lisenter.start()
-    wait(lambda: is_setup_ready(), waiting_for="setup to be ready")
-    setup_ready_lisenter.terminate()
+    run_state.wait_for('setup_ready')
+    setup_ready_lisenter.stop()
+    message = 'ctrl: setup_ready flag - {0}'.format(run_state.get('setup_ready'))
+    logger.debug(message)
 
 def pdfs_ready_event_handler():
+    from checkpoints import REPORT_REQUESTED
     message = 'ctrl: im waiting for pdfs ready'
     logger.info(message)
-    pdfs_ready_lisenter = Process(target=rmq_handler.request_pdf, args=(flags,))
-
-    pdfs_ready_lisenter.start()
-    wait(lambda: is_pdfs_ready(), waiting_for="pdfs to be ready")
-    pdfs_ready_lisenter.terminate()
+    # the rpc call returns only after the report generator answered, the number of results
+    # tells the report generator when it has seen all of them
+    request = dumps({'run_id' : run_state.get('run_id'), 'setup_id' : run_state.get('setup_id'), 'results' : run_state.get('results_count')})
+    run_checkpoint.set_phase(REPORT_REQUESTED, request=request, results_count=run_state.get('results_count'))
+    start = time.time()
+    service.rmq_handler.request_pdf(run_state, body=request, timeout=pdf_timeout)
+    # the round trip, the report generator records how long the request waited and how long it was handled
+    tracer.record('pdfs_round_trip', start, time.time() - start)
+    run_state.wait_for('pdfs_ready')
     message = 'ctrl: got callback from report-generator'
     logger.info(message)
-    return flags[1]['pdf_link']
+    return run_state.get('pdf_link')
+
+# the setup comes with the setup_ready message when the app has a codec
+def get_setup():
+    return run_state.get('setup') or service.mdb_handler.get_configuration(run_state.get('setup_id'), 'TestConfig')
+
+# the group a test is limited by, the suite is the test's directory (dlep/dlep-8175.tdf belongs to dlep)
+def get_test_group(test, setup):
+    return test.split('/')[0]
+
+# the tests from the longest to the shortest, by their past durations
+def plan_tests(setup, tests):
+    from scheduler import load_durations, estimate_durations, setup_devices, device_limits, build_plan
+    devices = setup_devices(setup)
+    estimates = estimate_durations(tests, load_durations(service.mdb_handler, tests))
+    plan = build_plan(tests, estimates, device_limits(setup, devices))
+    message = 'ctrl: planned %d tests on %d devices, expected to take %.1f seconds' % (len(tests), len(devices), plan.makespan)
+    logger.info(message)
+    return plan
 
-def run_test():
+# runs in one of the executor's threads, the result is inserted later on as part of a batch. the result belongs to
+# the run, the same setup may be run again later on
+def run_test(test, setup, run_id, device=None):
+    start = time.time()
+    # parsed the first time the test runs only
+    definition = test_definitions.get(test) if test_definitions is not None else None
+    time.sleep(time_delay / 2)
     json_document_result_example = '''{
 	    "name": "Check if the signal Peer_Offer includes data item Peer_Type",
 	    "result": "Pass/Fail"
     }
     '''
-    uid = mdb_handler.insert_document('Test Results', loads(json_document_result_example))
-    return uid
+    result = loads(json_document_result_example)
+    result.update({'test' : test, 'suite' : test.split('/')[0], 'setup_id' : str(setup['_id']), 'run_id' : run_id,
+                   'timestamp' : start, 'duration' : time.time() - start})
+    if definition is not None:
+        result.update({'name' : definition.name, 'steps' : len(definition.steps)})
+    if device is not None:
+        result['device'] = device
+    TEST_DURATION.labels(result['suite']).observe(result['duration'])
+    return result
+
+def run_test_on_device(test, setup, run_id, devices):
+    with devices.take() as device:
+        return run_test(test, setup, run_id, device)
 
-def run_tests(num_of_tests):
-    message = 'ctrl: im running the tests one by one'
+# a single results message for every batch of inserted results, with the results themselves when there's a codec
+# and with their ids (for the consumers to fetch) otherwise. the results of a run of 'multi' mode reach its own app only
+def publish_results(test_uids, results, run=None):
+    from rabbitmq_handler import RESULTS_EXCHANGE
+    message = 'ctrl: got %d results - %s' % (len(test_uids), test_uids)
     logger.info(message)
-    for index in range(num_of_tests):
-        test_uid = run_test()
-        message = 'ctrl: got result - %s' % test_uid
+    if run is not None:
+        exchange, routing_key, properties = RUNS_EXCHANGE, run_routing_key('results', run.run_id), run_properties(run.run_id)
+    else:
+        exchange, routing_key, properties = RESULTS_EXCHANGE, 'results', None
+    if service.rmq_handler.codec is not None:
+        service.rmq_handler.send_data(exchange, routing_key, results, properties)
+    else:
+        service.rmq_handler.send(exchange, routing_key, dumps([str(test_uid) for test_uid in test_uids]), properties)
+
+# the run's summary is updated before the results are published, so it's complete by the time all_results_ready is
+def record_results(test_uids, results, run=None):
+    service.mdb_handler.update_run_summary(results)
+    publish_results(test_uids, results, run)
+    checkpoint = run.checkpoint if run is not None else run_checkpoint
+    if checkpoint is not None:
+        checkpoint.complete([result['test'] for result in results])
+
+# runs the given tests of the setup (all of them by default) as part of the run, returns the number of results.
+# tests which already have a result in the run (from before a restart, or of a shard which was redelivered) aren't run again
+def run_tests(setup, run_id, tests=None, run=None):
+    from checkpoints import recorded_tests
+    from scheduler import DevicePool
+    if tests is None:
+        tests = setup['SuitesToRun']
+    recorded = recorded_tests(service.mdb_handler, run_id, tests)
+    if recorded:
+        tests = [test for test in tests if test not in recorded]
+        message = 'ctrl: %d tests already have results' % len(recorded)
         logger.info(message)
-        rmq_handler.send('', 'results', str(test_uid))
-        time.sleep(time_delay / 2)
-    message = 'ctrl: done running tests'
+    if tests_group_by == 'device':
+        plan = plan_tests(setup, tests)
+        devices = DevicePool(plan.limits)
+        # a single group in the plan's order, the devices limit how many tests run at once
+        tests, group_of = plan.order, lambda test: None
+        run_one = lambda test: run_test_on_device(test, setup, run_id, devices)
+        max_workers, max_per_group = plan.workers(), None
+    else:
+        group_of = lambda test: get_test_group(test, setup)
+        run_one = lambda test: run_test(test, setup, run_id)
+        max_workers, max_per_group = max_parallel_tests, max_tests_per_group
+    message = 'ctrl: im running %d tests, up to %d at a time' % (len(tests), max_workers)
+    logger.info(message)
+    mdb_handler = service.async_mdb_handler if results_writes == 'async' else service.mdb_handler
+    results_writer = mdb_handler.buffered_writer('Test Results', results_batch_size, results_flush_interval,
+                                                 functools.partial(record_results, run=run))
+    executor = TestExecutor(run_one, lambda test, result: results_writer.add(result),
+                            max_workers=max_workers,
+                            max_per_group=max_per_group,
+                            # the results of a run of 'multi' mode go to the run's own queue, which belongs to its app
+                            get_backlog=(lambda: service.rmq_handler.get_queue_depth('results')) if run is None else None,
+                            max_backlog=max_results_backlog,
+                            flush=results_writer.flush_if_due,
+                            idle_interval=results_flush_interval)
+    results, errors = executor.run(tests, group_of=group_of)
+    results_writer.flush()
+    message = 'ctrl: done running tests, %d results, %d errors' % (len(results), len(errors))
+    logger.info(message)
+    return len(results) + len(recorded)
+
+# the shard's tests are run like a run of their own, the setup usually comes from the cache. the shard is done
+# (and acked) only once the broker confirmed every results message of it, they may still be in the publisher's window.
+# a shard whose results messages weren't confirmed in time, or were nacked for good, fails and goes back to the queue.
+# its tests aren't run again, the report of a run which misses results messages is rendered from the database
+def run_shard(shard, headers=None):
+    from pika.exceptions import NackError
+    with tracer.span('test_shards', headers):
+        setup = service.mdb_handler.get_configuration(shard['setup_id'], 'TestConfig')
+        # the shards of older coordinators have no run id, their run is the setup's
+        num_of_results = run_tests(setup, shard.get('run_id', shard['setup_id']), shard['tests'])
+    try:
+        is_confirmed = service.rmq_handler.flush_publishes(shard_confirm_timeout)
+    except NackError as error:
+        raise RuntimeError('%d results messages of the shard were nacked for good' % len(error.messages))
+    if not is_confirmed:
+        raise RuntimeError('the results of the shard were not confirmed within %.0f seconds' % shard_confirm_timeout)
+    return num_of_results
+
+def on_all_shards_done(run_id, num_of_results):
+    run_state.update(all_shards_done=True, results_count=num_of_results)
+
+# the tests are run by the worker controllers, all results are ready once every shard reported in
+def run_sharded_tests(setup):
+    from sharding import split_into_shards, publish_shards, ShardAggregator
+    shards = split_into_shards(setup, run_state.get('run_id'), shard_size)
+    # no shards would ever report in
+    if not shards:
+        run_state.update(all_shards_done=True, results_count=0)
+        return
+    aggregator = ShardAggregator(service.rmq_handler.connection_parameters, on_all_shards_done)
+    aggregator.expect(run_state.get('run_id'))
+    aggregator.start()
+    message = 'ctrl: split %d tests into %d shards' % (len(setup['SuitesToRun']), len(shards))
+    logger.info(message)
+    publish_shards(service.rmq_handler, shards)
+    run_state.wait_for('all_shards_done')
+    aggregator.stop()
+    message = 'ctrl: all shards are done, %d results' % run_state.get('results_count')
     logger.info(message)
 
 def all_results_ready():
+    from checkpoints import DONE
     message = 'ctrl: sending all results ready'
     logger.info(message)
-    rmq_handler.send('', 'all_results_ready', '')
+    service.rmq_handler.send('', 'all_results_ready', '')
     link = pdfs_ready_event_handler()
     logger.info(link)
     time.sleep(time_delay)
     message = 'ctrl: sending pdf ready'
     logger.info(message)
-    rmq_handler.send('', 'pdf_ready', link)
-    
-def controller_flow():
-    make_test_list()
+    service.rmq_handler.send('', 'pdf_ready', link)
+    run_checkpoint.set_phase(DONE, pdf_link=link)
+
+# counts the resume of an unfinished run (a run which fails every resume is abandoned at last), and makes its
+# summary whole again: the last batch before the restart may have been inserted without being added to the summary
+def pick_up_run(checkpoint):
+    checkpoint.count_attempt()
+    service.mdb_handler.rebuild_run_summary(checkpoint.run_id, checkpoint.setup_id)
+
+# picks up the phase the unfinished run was in, the tests are run again only if they don't have results yet
+def resume_run(checkpoint):
+    global run_checkpoint
+    run_checkpoint = checkpoint
+    message = 'ctrl: resuming run %s of setup %s from the %s phase (%d tests were done)' % (
+        checkpoint.run_id, checkpoint.setup_id, checkpoint.phase, len(checkpoint.document.get('completed', [])))
+    logger.info(message)
+    pick_up_run(checkpoint)
+    # the test list of the run goes out again, the checkpoints of older controllers have none and get a new one
+    tests_list_id = checkpoint.document.get('tests_list_id')
+    if tests_list_id is not None:
+        service.rmq_handler.send('', 'tests_list', tests_list_id)
+    else:
+        make_test_list()
+    run_state.update(setup_ready=True, setup_id=checkpoint.setup_id, run_id=checkpoint.run_id,
+                     results_count=checkpoint.document.get('results_count', 0))
+    return checkpoint.phase
+
+def drop_failed_runs():
+    from checkpoints import abandon_failed_runs
+    for checkpoint in abandon_failed_runs(service.mdb_handler, max_resume_attempts):
+        message = 'ctrl: abandoning run %s of setup %s in the %s phase, it failed after %d resumes' % (
+            checkpoint.run_id, checkpoint.setup_id, checkpoint.phase, checkpoint.document.get('attempts', 0))
+        logger.warning(message)
+
+def start_new_run():
+    from checkpoints import start_run, RUNNING_TESTS
+    global run_checkpoint
+    tests_list_id = make_test_list()
     setup_ready_event_handler()
+    # every run of the setup is a run of its own, with results and a checkpoint of its own
+    run_state.set('run_id', str(uuid.uuid4()))
+    run_checkpoint = start_run(service.mdb_handler, run_state.get('run_id'), run_state.get('setup_id'),
+                               tests_list_id=tests_list_id)
     time.sleep(time_delay)
-    run_tests(3)
-    time.sleep(time_delay)
+    return RUNNING_TESTS
+
+def controller_flow():
+    from checkpoints import find_unfinished_run, RUNNING_TESTS
+    # the run's trace starts here, the other services adopt it from the messages
+    tracer.new_trace()
+    unfinished = None
+    if resume_runs:
+        drop_failed_runs()
+        unfinished = find_unfinished_run(service.mdb_handler)
+    phase = resume_run(unfinished) if unfinished is not None else start_new_run()
+    if phase == RUNNING_TESTS:
+        with tracer.span('run_tests'):
+            if controller_mode == 'coordinator':
+                run_sharded_tests(get_setup())
+            else:
+                run_state.set('results_count', run_tests(get_setup(), run_state.get('run_id')))
+        time.sleep(time_delay)
     all_results_ready()
 
+# a worker runs shards of whichever runs the coordinators publish, until it's stopped
+def worker_flow():
+    from sharding import ShardWorker
+    message = 'ctrl: im waiting for shards to run'
+    logger.info(message)
+    # a shard at a time, the handler's connection is used by the shard's thread only
+    ShardWorker(service.rmq_handler.connection_parameters, run_shard).start_consuming()
+
+# runs in a thread of the registry, the run's messages go to the run's own app. a run which was resumed picks up
+# the phase of its checkpoint, like the run of a standalone controller
+def drive_run(run):
+    from checkpoints import RUNNING_TESTS, REPORT_REQUESTED, DONE
+    with tracer.span('run', run.headers):
+        if run.checkpoint.phase == RUNNING_TESTS:
+            setup = run.setup or service.mdb_handler.get_configuration(run.setup_id, 'TestConfig')
+            run.results_count = run_tests(setup, run.run_id, run=run)
+            service.rmq_handler.send_to_run(run.run_id, 'all_results_ready', '')
+            request = dumps({'run_id' : run.run_id, 'setup_id' : run.setup_id, 'results' : run.results_count})
+            run.checkpoint.set_phase(REPORT_REQUESTED, request=request, results_count=run.results_count)
+        else:
+            request = run.checkpoint.document['request']
+            run.results_count = run.checkpoint.document.get('results_count', 0)
+        # the rpc requests of the runs are in flight together, every response is matched to its own run
+        run.pdf_link = service.rmq_handler.request_pdf_async(request, pdf_timeout).result().decode()
+        service.rmq_handler.send_to_run(run.run_id, 'pdf_ready', run.pdf_link)
+        run.checkpoint.set_phase(DONE, pdf_link=run.pdf_link)
+    message = 'ctrl: run %s of setup %s is done in %.1f seconds, %d results' % (
+        run.run_id, run.setup_id, time.time() - run.started_at, run.results_count)
+    logger.info(message)
+
+# a setup_ready message of a run scoped app, the run is started in the background. its checkpoint is saved before
+# the message is acked, so a controller which dies meanwhile resumes the run after its restart
+def on_run_setup_ready(registry, ch, method, properties, body):
+    from checkpoints import start_run, MULTI, DONE
+    run_id = run_of(properties)
+    if run_id is None:
+        raise ValueError('a setup without a run id, its app would never hear of its run')
+    setup = service.rmq_handler.get_payload(properties, body)
+    setup_id = str(setup['_id']) if setup is not None else body.decode()
+    run = Run(run_id, setup_id, setup, properties.headers)
+    run.checkpoint = start_run(service.mdb_handler, run_id, setup_id, MULTI)
+    if run.checkpoint.phase == DONE:
+        message = 'ctrl: run %s is done, ignoring its setup' % run_id
+        logger.warning(message)
+        return
+    if not registry.start(run):
+        message = 'ctrl: run %s was started before, ignoring its setup' % run_id
+        logger.warning(message)
+        return
+    message = 'ctrl: started run %s of setup %s, %d runs are active' % (run_id, setup_id, registry.active())
+    logger.info(message)
+
+# the unfinished runs of this controller from before its restart, their setup_ready messages were acked already
+def resume_multi_runs(registry):
+    from checkpoints import find_unfinished_runs
+    drop_failed_runs()
+    for checkpoint in find_unfinished_runs(service.mdb_handler):
+        pick_up_run(checkpoint)
+        run = Run(checkpoint.run_id, checkpoint.setup_id)
+        run.checkpoint = checkpoint
+        registry.start(run)
+        message = 'ctrl: resuming run %s of setup %s from the %s phase' % (checkpoint.run_id, checkpoint.setup_id, checkpoint.phase)
+        logger.info(message)
+
+# the queues of the handler, and the queue of the setups of the run scoped apps with its retry queues
+def declare_run_setups(retry_queues, channel):
+    service.rmq_handler.declare_queues(channel)
+    declare_run_setup_ready(channel)
+    retry_queues.declare(channel)
+
+# the registry of the runs and the listener which starts them, for stopping them (or counting the runs) later
+def start_multi_runs(max_active_runs=max_active_runs):
+    from rabbitmq_handler import MessageListener
+    from retry_queues import RetryQueues
+    rmq_handler = service.rmq_handler
+    registry = RunRegistry(drive_run, max_active_runs, logger)
+    # before listening, a setup_ready message of a resumed run which comes again is then ignored by the registry
+    if resume_runs:
+        resume_multi_runs(registry)
+    retry_queues = RetryQueues(RUN_SETUP_READY)
+    callback = functools.partial(rmq_handler.ack_message, retry_queues, functools.partial(on_run_setup_ready, registry))
+    listener = MessageListener(rmq_handler.connection_parameters, [(RUN_SETUP_READY, callback)],
+                               functools.partial(declare_run_setups, retry_queues), logger, rmq_handler.prefetch_count)
+    listener.start()
+    return registry, listener
+
+# drives the runs of the run scoped apps concurrently, until it's stopped
+def multi_run_flow():
+    registry, listener = start_multi_runs()
+    message = 'ctrl: im waiting for setups, up to %d runs at once' % max_active_runs
+    logger.info(message)
+    listener.join()
+
 def main():
-    flags[1] = {'setup_ready' : False, 'pdfs_ready' : False, 'pdf_link' : ''}
     configure_logger_logging(logging_level)
-    controller_flow()
+    # rabbitmq and mongodb connect at the same time, the flow waits for whichever it needs first
+    service.start('rmq_handler', 'mdb_handler')
+    if controller_mode == 'worker':
+        worker_flow()
+    elif controller_mode == 'multi':
+        multi_run_flow()
+    else:
+        controller_flow()
+    service.stop()
+    if service.mdb_handler.configuration_cache is not None:
+        message = 'ctrl: configuration cache - %s' % service.mdb_handler.configuration_cache.stats()
+        logger.info(message)
 
 
 if __name__ == '__main__':
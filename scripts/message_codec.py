@@ -0,0 +1,80 @@
+# for sending data (and not only ids) in the messages, the format is told by the message's content type
+# and the compression by its content encoding, so consumers decode whatever they get without configuration
+import json
+
+import zlib
+
+import logging
+
+# ships with pymongo
+import bson
+from bson.objectid import ObjectId
+
+# optional, the codec falls back to bson without it
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+BSON = 'application/bson'
+ZLIB = 'zlib'
+
+FORMATS = {'json' : JSON, 'msgpack' : MSGPACK, 'bson' : BSON}
+
+
+# ids and other values json and msgpack don't know are sent as strings
+def to_plain(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError('%s is not serializable' % type(value).__name__)
+
+def dumps(data, content_type):
+    if content_type == JSON:
+        return json.dumps(data, default=to_plain, separators=(',', ':')).encode()
+    if content_type == MSGPACK:
+        return msgpack.packb(data, default=to_plain, use_bin_type=True)
+    if content_type == BSON:
+        # a bson document must be a dict
+        return bson.encode({'data' : data})
+    raise ValueError('unknown content type %s' % content_type)
+
+def loads(body, content_type):
+    if content_type == JSON:
+        return json.loads(body)
+    if content_type == MSGPACK:
+        return msgpack.unpackb(body, raw=False)
+    if content_type == BSON:
+        return bson.decode(body)['data']
+    raise ValueError('unknown content type %s' % content_type)
+
+def is_encoded(content_type):
+    return content_type in FORMATS.values()
+
+def decode(body, content_type, content_encoding=None):
+    if content_encoding == ZLIB:
+        body = zlib.decompress(body)
+    return loads(body, content_type)
+
+
+# encodes in a single format, bodies of at least compress_threshold bytes are compressed with zlib (never when it's None)
+class MessageCodec:
+    def __init__(self, format='msgpack', compress_threshold=None):
+        if format == 'msgpack' and msgpack is None:
+            message = 'codec: msgpack is not installed, using bson'
+            logging.getLogger('rmq').warning(message)
+            format = 'bson'
+        self.format = format
+        self.content_type = FORMATS[format]
+        self.compress_threshold = compress_threshold
+
+    # returns (body, content type, content encoding)
+    def encode(self, data):
+        body = dumps(data, self.content_type)
+        if self.compress_threshold is not None and len(body) >= self.compress_threshold:
+            return zlib.compress(body, 1), self.content_type, ZLIB
+        return body, self.content_type, None
+
+    def decode(self, body, content_type, content_encoding=None):
+        return decode(body, content_type, content_encoding)
@@ -0,0 +1,263 @@
+# counters, gauges and histograms of the process, served in the prometheus text format
+import time
+
+import threading
+
+import functools
+
+# for finding the bucket of an observation
+import bisect
+
+from contextlib import contextmanager
+
+# from a millisecond to a minute, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs)
+
+
+# a metric is a family of children, one for every combination of label values. the children are created
+# once and kept, so the hot path is a dict lookup and a short locked update.
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            for suffix, extra, value in child.samples():
+                yield self.name + suffix, format_labels(self.labelnames, values, extra), value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.type)]
+        lines.extend('%s%s %s' % (name, labels, format_value(value)) for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [('', None, self.value)]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def new_child(self):
+        return CounterChild()
+
+    # for a counter without labels
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+# either set by the code, or read from function when the metrics are scraped (like the size of a cache)
+class GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        return [('', None, self.function() if self.function is not None else self.value)]
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def new_child(self):
+        return GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+
+# the observations are counted in their own bucket only, the buckets are made cumulative when they're scraped
+class HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            samples.append(('_bucket', ('le', format_value(bound)), cumulative))
+        samples.append(('_sum', None, total))
+        samples.append(('_count', None, cumulative))
+        return samples
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+# the metrics of the process by name, asking for a metric which exists returns it
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def get_or_create(self, cls, name, documentation, labelnames=(), **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError('metric %s already exists as a %s of %s' % (name, metric.type, metric.labelnames))
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+# the registry of the process, the handlers and the services share it
+registry = Registry()
+
+
+# the hit and miss counts (and any other counts) of a cache, with its size from size(). export() makes a gauge
+# of every stat, they're read when the metrics are scraped
+class CacheStats:
+    def __init__(self, prefix, cache_name, size, counts=()):
+        self.prefix = prefix
+        self.cache_name = cache_name
+        self.size = size
+        self.counts = dict.fromkeys(('hits', 'misses') + tuple(counts), 0)
+        self.lock = threading.Lock()
+
+    def inc(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+        lookups = stats['hits'] + stats['misses']
+        stats.update(size=self.size(), hit_ratio=float(stats['hits']) / lookups if lookups else 0.0)
+        return stats
+
+    def export(self):
+        for name in self.stats():
+            gauge = registry.gauge('%s_%s' % (self.prefix, name), 'The %s of the %s' % (name.replace('_', ' '), self.cache_name))
+            gauge.set_function(functools.partial(lambda name: self.stats()[name], name))
+
+
+# serves GET /metrics on port from a daemon thread. http.server is imported here, it takes longer
+# to import than all of the rest of the module and most processes don't serve their metrics
+def start_metrics_server(port, host='0.0.0.0'):
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # the scrapes would flood the service's output
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -9,15 +9,50 @@ import os
 import logging
 import uuid
 
+# for waiting on rpc responses without spinning
+from concurrent.futures import Future
+
 import sys
 
 import time
 
-import ctypes
-
 import functools
 
-from multiprocessing import Value,Queue
+import copy
+
+# for consuming in the background of the same process
+import threading
+
+from collections import deque, OrderedDict
+
+from tracing import tracer
+from metrics import registry
+# for sending data inline instead of an id to fetch it by
+from message_codec import MessageCodec, is_encoded, decode
+# for connections which come back after the broker went away
+from rmq_connection import ConnectionManager, ChannelPool, connection_parameters, backoff_delays, RECOVERABLE_ERRORS, RECONNECTS, RECOVERY_TIME
+# for messages whose callback failed
+from retry_queues import RetryQueues, prefetch_count
+# for messages scoped to a single run
+from runs import (RUNS_EXCHANGE, SETUP_READY, run_of, run_routing_key, event_of, run_properties, declare_runs_exchange,
+                  unbind_shared_setup_ready, declare_run_queue)
+
+# the results are fanned out to the 'results' queue and to every report generator's own queue
+RESULTS_EXCHANGE = 'results'
+
+MESSAGES_CONSUMED = registry.counter('rmq_messages_consumed_total', 'Messages handled, by queue', ['queue'])
+HANDLER_DURATION = registry.histogram('rmq_handler_duration_seconds', 'Time in the callback of a message, by queue', ['queue'])
+MESSAGES_PUBLISHED = registry.counter('rmq_messages_published_total', 'Messages sent, by routing key', ['routing_key'])
+PUBLISH_NACKS = registry.counter('rmq_publish_nacks_total', 'Publishes which the broker nacked')
+RPC_DURATION = registry.histogram('rmq_rpc_duration_seconds', 'Round trip of an rpc request, by queue', ['queue'])
+RPC_TIMEOUTS = registry.counter('rmq_rpc_timeouts_total', 'Rpc requests without a response in time, by queue', ['queue'])
+QUEUE_DEPTH = registry.gauge('rmq_queue_depth', 'Messages ready in a queue when it was last checked', ['queue'])
+
+# a copy of properties with the trace headers added, the properties of a message may be shared by many sends
+def traced_properties(routing_key, properties=None):
+    properties = copy.copy(properties) if properties is not None else pika.BasicProperties()
+    properties.headers = tracer.headers(routing_key, properties.headers)
+    return properties
 
 def configure_logger_logging(logger, logging_level, logging_file):
         logger.setLevel(logging_level)
@@ -41,160 +76,559 @@ def configure_logger_logging(logger, logging_level, logging_file):
         logger.addHandler(console_handler)
         
 
-class RabbitmqHandler:
-    def __init__(self, logging_level, logging_file = None):
-        self.queue_names = os.getenv('QUEUE_NAMES').split(',')
-
-        self.rabbitmq_host = os.getenv('RMQ_HOST')
-        self.connection = pika.BlockingConnection(
-            pika.ConnectionParameters(self.rabbitmq_host))
-        self.channel = self.connection.channel()
-        
-        # declaring the queues
-        for queue_name in self.queue_names:
-            self.channel.queue_declare(queue=queue_name)
-            if queue_name == 'pdfs':
-                # creating a single callback queue for the pdfs queue, in order to create the rpc behaviour
-                result = self.channel.queue_declare(queue='', exclusive=True)
-                self.callback_queue_pdfs = result.method.queue
-                self.channel.basic_consume(queue=self.callback_queue_pdfs, on_message_callback=self.on_response_pdf, auto_ack=True)
-
-
-        # testing logging
-        logger = logging.getLogger('rmq')
-        configure_logger_logging(logger, logging_level, logging_file)
-        self.logger = logger
-
-    
-    def on_response_pdf(self, ch, method, props, body):
-        if self.corr_id == props.correlation_id:
-            self.response = body
-
-    # send rpc message in order to collect a 'pdf ready' notification from the report generator
-    def request_pdf(self, flags):
-        self.response = None
-        self.corr_id = str(uuid.uuid4())
-        self.channel.basic_publish(
-            exchange='',
-            routing_key='pdfs',
-            properties=pika.BasicProperties(
-                reply_to=self.callback_queue_pdfs,
-                correlation_id=self.corr_id),
-            body='')
-        while self.response is None:
-            self.connection.process_data_events()
-            
-            
-        temp_list = flags[1]
-        temp_list['pdfs_ready'] = True
-        flags[1] = temp_list
-
-        temp_list = flags[1]
-        temp_list['pdf_link'] = self.response
-        flags[1] = temp_list
-
-    def send(self, msg_exchange, msg_routing_key, msg_body):
-        self.channel.basic_publish(
-            exchange=msg_exchange,
-            routing_key=msg_routing_key,
-            body=msg_body)
-
-    def make_tests_list_ready(self, ch, method, properties, body, flags):
+# the callbacks of the consumed routing keys, shared by the blocking and the asyncio handlers
+class MessageCallbacks:
+    # which callback handles the messages of each routing key, every callback fires a transition on the given run state
+    routing_key_callbacks = {
+        'tests_list' : 'make_tests_list_ready',
+        'setup_ready' : 'make_setup_ready',
+        'device_ids' : 'make_device_ids_ready',
+        'results' : 'print_result',
+        'all_results_ready' : 'make_all_results_ready',
+        'pdf_ready' : 'make_pdf_ready',
+    }
+
+    def get_callback(self, routing_key, run_state):
+        callback = functools.partial(getattr(self, self.routing_key_callbacks[routing_key]), run_state=run_state)
+        return functools.partial(self.handle_message, routing_key, callback,
+                                 MESSAGES_CONSUMED.labels(routing_key), HANDLER_DURATION.labels(routing_key))
+
+    # counts and times the handling of every consumed message, and records its span while tracing
+    def handle_message(self, routing_key, callback, consumed, duration, ch, method, properties, body):
+        start = time.perf_counter()
+        if tracer.enabled:
+            with tracer.span(routing_key, properties.headers):
+                callback(ch, method, properties, body)
+        else:
+            callback(ch, method, properties, body)
+        duration.observe(time.perf_counter() - start)
+        consumed.inc()
+
+    def make_tests_list_ready(self, ch, method, properties, body, run_state):
         message = 'rmq_handler: test list ready - %s' % body
         self.logger.info(message)
         sys.stdout.flush()
-        #time.sleep(1)
         # changing the specific flag's state
-        temp_list = flags[1]
-        temp_list['tests_list_ready'] = True
-        flags[1] = temp_list
-
-        message = 'tests_list_ready flag - %s' % flags[1]['tests_list_ready']
-        self.logger.debug(message)
-        self.tests_list_ready = Value(ctypes.c_bool,True)
+        run_state.update(tests_list_ready=True, tests_list_id=body.decode())
 
-    def make_device_ids_ready(self, ch, method, properties, body, flags):
+    def make_device_ids_ready(self, ch, method, properties, body, run_state):
         message = 'rmq_handler: device ids ready - %s' %body
         self.logger.info(message)
         sys.stdout.flush()
-        #time.sleep(1)
         # changing the specific flag's state
-        temp_list = flags[1]
-        temp_list['device_ids'] = True
-        flags[1] = temp_list
-
-        self.device_ids_ready = Value(ctypes.c_bool,True)
-
-    def make_setup_ready(self, ch, method, properties, body, flags):
-        message = 'rmq_handler: setup ready - %s' %body
+        run_state.update(device_ids_ready=True)
+
+    # the setup of a run scoped app belongs to a 'multi' mode controller, it fails (and is dead lettered after its
+    # retries) instead of being run on the shared queues where its app would never hear of it
+    def make_setup_ready(self, ch, method, properties, body, run_state):
+        if run_of(properties) is not None:
+            raise ValueError('the setup of run %s came on the shared setup_ready queue' % run_of(properties))
+        setup = self.get_payload(properties, body)
+        if setup is None:
+            message = 'rmq_handler: setup ready - %s' %body
+            self.logger.info(message)
+            sys.stdout.flush()
+            # changing the specific flag's state
+            run_state.update(setup_ready=True, setup_id=body.decode(), setup=None)
+            return
+        message = 'rmq_handler: setup ready - %s (inline)' % setup['_id']
         self.logger.info(message)
         sys.stdout.flush()
-        #time.sleep(1)
-        # changing the specific flag's state
-        temp_list = flags[1]
-        temp_list['setup_ready'] = True
-        flags[1] = temp_list
-
-        self.setup_ready = Value(ctypes.c_bool,True)
+        # the setup came with the message, there's no need to read it back
+        run_state.update(setup_ready=True, setup_id=setup['_id'], setup=setup)
 
-    def print_result(self, ch, method, properties, body):
+    def print_result(self, ch, method, properties, body, run_state):
+        results = self.get_payload(properties, body)
+        if results is not None:
+            body = ', '.join('%s: %s' % (result['test'], result['result']) for result in results)
         message = 'rmq_handler: got result - %s' %body
         self.logger.info(message)
         sys.stdout.flush()
 
-    def make_all_results_ready(self, ch, method, properties, body, flags):
+    # the data of a message which was sent with send_data, None for a plain message (an id or a notification)
+    def get_payload(self, properties, body):
+        if not is_encoded(properties.content_type):
+            return None
+        return decode(body, properties.content_type, properties.content_encoding)
+
+    def make_all_results_ready(self, ch, method, properties, body, run_state):
         message = 'rmq_handler: all results ready - %s' %body
         self.logger.info(message)
         sys.stdout.flush()
-        #time.sleep(1)
         # changing the specific flag's state
-        temp_list = flags[1]
-        temp_list['all_results_ready'] = True
-        flags[1] = temp_list
+        run_state.update(all_results_ready=True)
 
-        self.all_results_ready = Value(ctypes.c_bool,True)
-
-    def make_pdf_ready(self, ch, method, properties, body, flags):
+    def make_pdf_ready(self, ch, method, properties, body, run_state):
         message = 'rmq_handler: pdf ready - %s' %body
         self.logger.info(message)
         sys.stdout.flush()
-        #time.sleep(1)
         # changing the specific flag's state
-        temp_list = flags[1]
-        temp_list['pdf_ready'] = True
-        flags[1] = temp_list
-
-        self.pdf_ready = Value(ctypes.c_bool,True)
-
-    def wait_for_message(self, routing_key, flags,):
-        if routing_key == 'tests_list':
-            self.channel.basic_consume(queue=routing_key,
-                            auto_ack=True,
-                            on_message_callback=lambda ch, method, properties, body: self.make_tests_list_ready(ch, method, properties, body, flags))
-
-        if routing_key == 'setup_ready':
-            self.channel.basic_consume(queue=routing_key,
-                            auto_ack=True,
-                            on_message_callback=lambda ch, method, properties, body: self.make_setup_ready(ch, method, properties, body, flags))
-
-        if routing_key == 'device_ids':
-            self.channel.basic_consume(queue=routing_key,
-                            auto_ack=True,
-                            on_message_callback=lambda ch, method, properties, body: self.make_device_ids_ready(ch, method, properties, body, flags))
-
-        if routing_key == 'results':
-            self.channel.basic_consume(queue=routing_key,
-                            auto_ack=True,
-                            on_message_callback=lambda ch, method, properties, body: self.print_result(ch, method, properties, body))
-
-        if routing_key == 'all_results_ready':
-            self.channel.basic_consume(queue=routing_key,
-                            auto_ack=True,
-                            on_message_callback=lambda ch, method, properties, body: self.make_all_results_ready(ch, method, properties, body, flags))
-
-        if routing_key == 'pdf_ready':
-            self.channel.basic_consume(queue=routing_key,
-                            auto_ack=True,
-                            on_message_callback=lambda ch, method, properties, body: self.make_pdf_ready(ch, method, properties, body, flags,))
-       
-        self.channel.start_consuming()
\ No newline at end of file
+        run_state.update(pdf_ready=True, pdf_link=body.decode())
+
+
+class RabbitmqHandler(MessageCallbacks):
+    # publish_mode is one of 'plain' (no confirms), 'confirm' (every publish waits for its confirm)
+    # and 'windowed' (confirms are tracked in the background with up to publish_window messages in flight)
+    def __init__(self, logging_level, logging_file = None, publish_mode = None, publish_window = None):
+        self.queue_names = os.getenv('QUEUE_NAMES').split(',')
+        self.publish_mode = publish_mode or os.getenv('PUBLISH_MODE', 'plain')
+        self.publish_window = publish_window or int(os.getenv('PUBLISH_WINDOW', '100'))
+        self.publish_retries = int(os.getenv('PUBLISH_RETRIES', '5'))
+        # data is sent inline with send_data only with a codec ('json', 'msgpack' or 'bson'), bodies of at least
+        # COMPRESS_THRESHOLD bytes are compressed
+        self.codec = None
+        if os.getenv('MESSAGE_CODEC', 'none') != 'none':
+            compress_threshold = os.getenv('COMPRESS_THRESHOLD')
+            self.codec = MessageCodec(os.getenv('MESSAGE_CODEC'), int(compress_threshold) if compress_threshold else None)
+
+        # testing logging
+        logger = logging.getLogger('rmq')
+        configure_logger_logging(logger, logging_level, logging_file)
+        self.logger = logger
+
+        # consumed messages are acked once their callback returned, a failed message is retried later
+        self.prefetch_count = prefetch_count()
+        self.retry_queues = {queue_name : RetryQueues(queue_name) for queue_name in self.queue_names}
+
+        self.rabbitmq_host = os.getenv('RMQ_HOST')
+        self.connection_parameters = connection_parameters(self.rabbitmq_host)
+        # the queues are declared again whenever the connection comes back, a restarted broker doesn't have them
+        self.connection_manager = ConnectionManager(self.connection_parameters, self.declare_queues, self.logger)
+        # every publishing thread takes a connection of its own
+        self.publishers = ChannelPool(self.connection_parameters, int(os.getenv('RMQ_CHANNEL_POOL_SIZE', '4')),
+                                      self.prepare_publisher_channel, self.logger)
+
+        self.publisher = None
+        if self.publish_mode == 'windowed':
+            self.publisher = ConfirmedPublisher(self.connection_parameters, self.publish_window, self.publish_retries, self.logger)
+            self.publisher.start()
+
+        self.pdfs_rpc = None
+        if 'pdfs' in self.queue_names:
+            # a single callback queue for the pdfs queue, in order to create the rpc behaviour
+            self.pdfs_rpc = RpcClient(self.connection_parameters, 'pdfs', self.logger)
+            self.pdfs_rpc.start()
+
+    @property
+    def connection(self):
+        return self.connection_manager.connection
+
+    @property
+    def channel(self):
+        return self.connection_manager.channel
+
+    # declaring the queues
+    def declare_queues(self, channel):
+        for queue_name in self.queue_names:
+            channel.queue_declare(queue=queue_name)
+            self.retry_queues[queue_name].declare(channel)
+            if queue_name == 'results':
+                channel.exchange_declare(exchange=RESULTS_EXCHANGE, exchange_type='fanout')
+                channel.queue_bind(queue=queue_name, exchange=RESULTS_EXCHANGE)
+        declare_runs_exchange(channel)
+        if SETUP_READY in self.queue_names:
+            unbind_shared_setup_ready(channel)
+
+    def prepare_publisher_channel(self, channel):
+        if self.publish_mode == 'confirm':
+            channel.confirm_delivery()
+
+    # send rpc message in order to collect a 'pdf ready' notification from the report generator,
+    # returns a future of the response so many reports can be requested at once
+    def request_pdf_async(self, body='', timeout=None):
+        # the request must not overtake messages which are still waiting for their confirm, and isn't sent at all
+        # (NackError) if some of them were dropped, the report would be missing them
+        self.flush_publishes()
+        return self.pdfs_rpc.call(body, timeout)
+
+    def request_pdf(self, run_state, body='', timeout=None):
+        response = self.request_pdf_async(body, timeout).result()
+        run_state.update(pdfs_ready=True, pdf_link=response.decode())
+
+    def send(self, msg_exchange, msg_routing_key, msg_body, msg_properties=None):
+        if tracer.enabled:
+            msg_properties = traced_properties(msg_routing_key or msg_exchange, msg_properties)
+        MESSAGES_PUBLISHED.labels(msg_routing_key or msg_exchange).inc()
+        if self.publisher is not None:
+            self.publisher.publish(msg_exchange, msg_routing_key, msg_body, msg_properties)
+            return
+        for attempt in range(self.publish_retries + 1):
+            try:
+                self.publishers.run(lambda channel: channel.basic_publish(
+                    exchange=msg_exchange,
+                    routing_key=msg_routing_key,
+                    body=msg_body,
+                    properties=msg_properties))
+                return
+            except pika.exceptions.NackError:
+                # only raised in the 'confirm' mode
+                PUBLISH_NACKS.inc()
+                message = 'rmq_handler: message to %s was nacked (attempt %d)' % (msg_routing_key, attempt + 1)
+                self.logger.warning(message)
+        raise pika.exceptions.NackError([msg_body])
+
+    # blocks until every message sent so far was confirmed, returns False if timeout passed before that. raises
+    # NackError if the broker nacked messages for good meanwhile, like send does in the 'confirm' mode
+    def flush_publishes(self, timeout=None):
+        if self.publisher is None:
+            return True
+        return self.publisher.flush(timeout)
+
+    # sends data (a configuration, a batch of results) in the message itself, consumers tell it by its content type
+    def send_data(self, msg_exchange, msg_routing_key, data, msg_properties=None):
+        body, content_type, content_encoding = self.codec.encode(data)
+        msg_properties = copy.copy(msg_properties) if msg_properties is not None else pika.BasicProperties()
+        msg_properties.content_type = content_type
+        msg_properties.content_encoding = content_encoding
+        self.send(msg_exchange, msg_routing_key, body, msg_properties)
+
+    # an event of a single run, only the run's own app gets it
+    def send_to_run(self, run_id, event, msg_body, msg_properties=None):
+        self.send(RUNS_EXCHANGE, run_routing_key(event, run_id), msg_body, run_properties(run_id, msg_properties))
+
+    def send_data_to_run(self, run_id, event, data):
+        self.send_data(RUNS_EXCHANGE, run_routing_key(event, run_id), data, run_properties(run_id))
+
+    # number of messages waiting in the queue, for holding back producers when the consumers fall behind
+    def get_queue_depth(self, queue_name):
+        depth = self.publishers.run(lambda channel: channel.queue_declare(queue=queue_name, passive=True)).method.message_count
+        QUEUE_DEPTH.labels(queue_name).set(depth)
+        return depth
+
+    # the routing key's callback, which acks the message once it returned or hands it to the retry queues if it raised
+    def get_acking_callback(self, routing_key, run_state):
+        return functools.partial(self.ack_message, self.retry_queues[routing_key], self.get_callback(routing_key, run_state))
+
+    def ack_message(self, retry_queues, callback, ch, method, properties, body):
+        try:
+            callback(ch, method, properties, body)
+        except Exception as error:
+            routing_key = retry_queues.reject(ch, method, properties, body, error)
+            message = 'rmq_handler: a message of %s failed, sent to %s - %r' % (retry_queues.queue, routing_key, error)
+            self.logger.warning(message)
+            return
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    # blocking consume of a single routing key on the handler's own connection
+    def wait_for_message(self, routing_key, run_state):
+        self.channel.basic_qos(prefetch_count=self.prefetch_count)
+        self.channel.basic_consume(queue=routing_key,
+                        on_message_callback=self.get_acking_callback(routing_key, run_state))
+        self.channel.start_consuming()
+
+    # consuming the given routing keys in a background thread of the current process,
+    # returns the listener so the caller can stop it once the run state reached the wanted flags
+    def listen(self, routing_keys, run_state):
+        consumers = [(routing_key, self.get_acking_callback(routing_key, run_state)) for routing_key in routing_keys]
+        listener = MessageListener(self.connection_parameters, consumers, self.declare_queues, self.logger, self.prefetch_count)
+        listener.start()
+        return listener
+
+    # like listen, for a single message of the routing key: the consumer takes one message at a time and is cancelled
+    # once flag is set, the following messages wait in the queue for the next listener (the setup of the next run)
+    def listen_once(self, routing_key, flag, run_state):
+        callback = self.get_acking_callback(routing_key, run_state)
+
+        def once(ch, method, properties, body):
+            callback(ch, method, properties, body)
+            if run_state.get(flag):
+                ch.basic_cancel(method.consumer_tag)
+
+        listener = MessageListener(self.connection_parameters, [(routing_key, once)], self.declare_queues, self.logger, 1)
+        listener.start()
+        return listener
+
+    # like listen, for the given events of a single run on a queue of the run's own. the queue is exclusive,
+    # so a message whose callback failed goes to the event's dead letter queue right away
+    def listen_to_run(self, run_id, events, run_state):
+        queue = 'run.%s' % run_id
+        dead_letters = [RetryQueues(event, max_retries=0) for event in events]
+        callbacks = {retry_queues.queue : functools.partial(self.ack_message, retry_queues, self.get_callback(retry_queues.queue, run_state))
+                     for retry_queues in dead_letters}
+        listener = MessageListener(self.connection_parameters, [(queue, functools.partial(self.dispatch_run_message, callbacks))],
+                                   functools.partial(self.declare_run, queue, run_id, dead_letters), self.logger, self.prefetch_count)
+        listener.start()
+        return listener
+
+    def declare_run(self, queue, run_id, dead_letters, channel):
+        declare_runs_exchange(channel)
+        declare_run_queue(channel, queue, run_id, [retry_queues.queue for retry_queues in dead_letters])
+        for retry_queues in dead_letters:
+            retry_queues.declare(channel)
+
+    def dispatch_run_message(self, callbacks, ch, method, properties, body):
+        callbacks[event_of(method.routing_key)](ch, method, properties, body)
+
+
+# a consuming thread with a connection of its own, since pika connections can't be shared between threads.
+# declare(channel) declares the consumed queues, it's called again with the consumers after a reconnect.
+# the callbacks ack their messages, the messages which weren't acked when the connection was lost are delivered again
+class MessageListener(threading.Thread):
+    def __init__(self, connection_parameters, consumers, declare=None, logger=None, prefetch_count=None):
+        super().__init__(daemon=True)
+        self.consumers = consumers
+        self.declare = declare
+        self.prefetch_count = prefetch_count
+        self.connection_manager = ConnectionManager(connection_parameters, self.on_channel, logger)
+
+    def on_channel(self, channel):
+        if self.declare is not None:
+            self.declare(channel)
+        if self.prefetch_count is not None:
+            channel.basic_qos(prefetch_count=self.prefetch_count)
+        for routing_key, callback in self.consumers:
+            channel.basic_consume(queue=routing_key,
+                            on_message_callback=callback)
+
+    def run(self):
+        self.connection_manager.consume()
+
+    def stop(self):
+        self.connection_manager.stop_consuming()
+        self.join()
+        self.connection_manager.close()
+
+
+# an rpc client which can have any number of requests in flight, the responses come back on a single exclusive
+# callback queue and are matched by correlation id to the future returned from call(). the connection is served by a
+# background thread which sleeps in select until something arrives, so waiting for responses costs no cpu.
+class RpcClient(threading.Thread):
+    def __init__(self, connection_parameters, routing_key, logger):
+        super().__init__(daemon=True)
+        self.routing_key = routing_key
+        self.logger = logger
+        # correlation id -> (future of the response, the time it was requested, the request's body, its timeout timer)
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.callback_queue = None
+        self.connection_manager = ConnectionManager(connection_parameters, self.on_channel, logger)
+
+    # the exclusive callback queue goes away with the connection, so the requests which are still waiting
+    # for their response are sent again with the new callback queue
+    def on_channel(self, channel):
+        result = channel.queue_declare(queue='', exclusive=True)
+        self.callback_queue = result.method.queue
+        # a lost response shows as a timeout of its future, so the responses need no acks
+        channel.basic_consume(queue=self.callback_queue, on_message_callback=self.on_response, auto_ack=True)
+        with self.lock:
+            waiting = [(corr_id, body) for corr_id, (future, started_at, body, timer) in self.futures.items()]
+        for corr_id, body in waiting:
+            self.publish_request(corr_id, body)
+
+    def run(self):
+        self.connection_manager.consume()
+
+    def on_response(self, ch, method, props, body):
+        with self.lock:
+            future, started_at, request, timer = self.futures.pop(props.correlation_id, (None, None, None, None))
+        if future is None:
+            message = 'rmq_handler: dropping a late response to %s' % props.correlation_id
+            self.logger.debug(message)
+            return
+        if timer is not None:
+            timer.cancel()
+        RPC_DURATION.labels(self.routing_key).observe(time.perf_counter() - started_at)
+        future.set_result(body)
+
+    # can be called from any thread, the future raises TimeoutError if there was no response within timeout seconds.
+    # the timeout runs on a timer of its own, so it expires even while the connection is down and the request waits
+    # to be sent
+    def call(self, body='', timeout=None):
+        corr_id = str(uuid.uuid4())
+        future = Future()
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, self.expire, args=(corr_id, timeout))
+            timer.daemon = True
+        with self.lock:
+            self.futures[corr_id] = (future, time.perf_counter(), body, timer)
+        if timer is not None:
+            timer.start()
+        # while the connection is down, the request is sent once it's back
+        self.connection_manager.add_callback_threadsafe(functools.partial(self.publish_request, corr_id, body))
+        return future
+
+    # runs in the connection's thread
+    def publish_request(self, corr_id, body):
+        with self.lock:
+            future = self.futures.get(corr_id, (None,))[0]
+        if future is None:
+            # answered or expired already
+            return
+        self.connection_manager.channel.basic_publish(
+            exchange='',
+            routing_key=self.routing_key,
+            properties=pika.BasicProperties(
+                reply_to=self.callback_queue,
+                correlation_id=corr_id,
+                headers=tracer.headers(self.routing_key) if tracer.enabled else None),
+            body=body)
+
+    # runs in the timer's thread
+    def expire(self, corr_id, timeout):
+        with self.lock:
+            future = self.futures.pop(corr_id, (None,))[0]
+        if future is not None:
+            RPC_TIMEOUTS.labels(self.routing_key).inc()
+            future.set_exception(TimeoutError('no response from %s within %s seconds' % (self.routing_key, timeout)))
+
+    def close(self):
+        self.connection_manager.stop_consuming()
+        self.join()
+        self.connection_manager.close()
+
+
+# publishes with publisher confirms over a connection of its own, driven by an ioloop in a background thread.
+# up to window messages wait for their confirm at once (publish() blocks when as many more are waiting to be sent),
+# the confirms are matched to the delivery tags as they come, and nacked messages are published again up to max_retries times.
+# when the connection is lost, the unconfirmed messages go back to the front of the pending ones and are published
+# again once a new connection is open (at least once, a message may arrive twice).
+class ConfirmedPublisher(threading.Thread):
+    def __init__(self, connection_parameters, window, max_retries, logger):
+        super().__init__(daemon=True)
+        self.connection_parameters = connection_parameters
+        self.window = window
+        self.max_retries = max_retries
+        self.logger = logger
+        # messages waiting to be published, (exchange, routing key, body, properties, attempt)
+        self.pending = deque()
+        # delivery tag -> message, in the order they were published
+        self.unconfirmed = OrderedDict()
+        self.delivery_tag = 0
+        # messages which were nacked max_retries times, until a flush reports them
+        self.failed = []
+        self.condition = threading.Condition()
+        self.ready = threading.Event()
+        self.connection = None
+        self.channel = None
+        self.closing = False
+        self.lost_at = None
+
+    def start(self):
+        super().start()
+        self.ready.wait()
+
+    # a connection (and an ioloop) after the other, until close()
+    def run(self):
+        delays = backoff_delays()
+        while not self.closing:
+            self.connection = pika.SelectConnection(self.connection_parameters,
+                                                    on_open_callback=self.on_connection_open,
+                                                    on_open_error_callback=self.on_connection_closed,
+                                                    on_close_callback=self.on_connection_closed)
+            self.connection.ioloop.start()
+            if self.channel is not None:
+                # it was open for a while, the next outage starts with a short delay again
+                delays = backoff_delays()
+                self.channel = None
+            if not self.closing:
+                time.sleep(next(delays))
+
+    def on_connection_open(self, connection):
+        connection.channel(on_open_callback=self.on_channel_open)
+
+    def on_connection_closed(self, connection, reason):
+        with self.condition:
+            if self.unconfirmed:
+                # they may or may not have arrived, sending them again is the only way to know they did
+                self.pending.extendleft(reversed(list(self.unconfirmed.values())))
+                self.unconfirmed.clear()
+        if self.closing:
+            message = 'rmq_handler: publisher connection closed - %s' % reason
+            self.logger.info(message)
+        else:
+            self.lost_at = self.lost_at or time.time()
+            message = 'rmq_handler: publisher connection lost - %s, %d messages wait for it' % (reason, len(self.pending))
+            self.logger.warning(message)
+        self.ready.set()
+        connection.ioloop.stop()
+
+    # a channel closed by the broker takes the connection with it, so both are opened again
+    def on_channel_closed(self, channel, reason):
+        if not self.connection.is_closing and not self.connection.is_closed:
+            self.connection.close()
+
+    def on_channel_open(self, channel):
+        self.channel = channel
+        self.channel.add_on_close_callback(self.on_channel_closed)
+        self.channel.confirm_delivery(self.on_delivery_confirmation)
+        # delivery tags count from 1 on every channel
+        self.delivery_tag = 0
+        if self.lost_at is not None:
+            RECONNECTS.inc()
+            RECOVERY_TIME.observe(time.time() - self.lost_at)
+            message = 'rmq_handler: publisher reconnected after %.2f seconds' % (time.time() - self.lost_at)
+            self.logger.info(message)
+            self.lost_at = None
+        self.ready.set()
+        self.publish_pending()
+
+    # runs in the ioloop thread only
+    def publish_pending(self):
+        if self.channel is None or not self.channel.is_open:
+            return
+        with self.condition:
+            while self.pending and len(self.unconfirmed) < self.window:
+                exchange, routing_key, body, properties, attempt = self.pending.popleft()
+                self.channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+                self.delivery_tag += 1
+                self.unconfirmed[self.delivery_tag] = (exchange, routing_key, body, properties, attempt)
+            self.condition.notify_all()
+
+    def on_delivery_confirmation(self, frame):
+        confirmation = frame.method
+        is_ack = isinstance(confirmation, pika.spec.Basic.Ack)
+        with self.condition:
+            if confirmation.multiple:
+                delivery_tags = [delivery_tag for delivery_tag in self.unconfirmed if delivery_tag <= confirmation.delivery_tag]
+            else:
+                delivery_tags = [confirmation.delivery_tag]
+            retries = []
+            for delivery_tag in delivery_tags:
+                exchange, routing_key, body, properties, attempt = self.unconfirmed.pop(delivery_tag)
+                if is_ack:
+                    continue
+                PUBLISH_NACKS.inc()
+                if attempt < self.max_retries:
+                    retries.append((exchange, routing_key, body, properties, attempt + 1))
+                else:
+                    message = 'rmq_handler: giving up on a message to %s after %d nacks' % (routing_key, attempt + 1)
+                    self.logger.error(message)
+                    self.failed.append((exchange, routing_key, body, properties))
+            # the nacked messages go out again before the ones which were never published
+            self.pending.extendleft(reversed(retries))
+        self.publish_pending()
+
+    # can be called from any thread
+    def publish(self, exchange, routing_key, body, properties=None):
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.pending) < self.window)
+            self.pending.append((exchange, routing_key, body, properties, 0))
+        try:
+            self.connection.ioloop.add_callback_threadsafe(self.publish_pending)
+        except RECOVERABLE_ERRORS:
+            # the message waits in pending for the next connection
+            pass
+
+    def wait_for_confirms(self, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and not self.unconfirmed, timeout)
+
+    # returns False if timeout passed before every message was confirmed, and raises NackError with the bodies of
+    # the messages which were given up on since the last flush. they're reported once, to whichever thread flushes
+    def flush(self, timeout=None):
+        is_confirmed = self.wait_for_confirms(timeout)
+        with self.condition:
+            failed, self.failed = self.failed, []
+        if failed:
+            message = 'rmq_handler: %d messages were dropped after %d nacks - %s' % (
+                len(failed), self.max_retries + 1, ', '.join(sorted(set(routing_key for exchange, routing_key, body, properties in failed))))
+            self.logger.error(message)
+            raise pika.exceptions.NackError([body for exchange, routing_key, body, properties in failed])
+        return is_confirmed
+
+    def close(self):
+        self.wait_for_confirms()
+        self.closing = True
+        self.connection.ioloop.add_callback_threadsafe(self.connection.close)
+        self.join()
@@ -1,29 +1,252 @@
 import pika
 import os
 
+import time
+
+import functools
+
+from json import loads, dumps
+from bson.objectid import ObjectId
+
+# for rendering the reports in a pool of worker processes
+from multiprocessing import Pool
+
 # for easy read/write on mongodb
 from mongodb_handler import MongodbHandler
+# for writing the reports page by page
+from report_renderer import render_report, IncrementalReport
+# the exchange the controller fans the results out on
+from rabbitmq_handler import RESULTS_EXCHANGE, MESSAGES_CONSUMED, HANDLER_DURATION
+# with the heartbeats of the other services
+from rmq_connection import connection_parameters
+# the results of the run scoped apps' runs come through the runs exchange
+from runs import declare_runs_exchange, bind_all_results
+# for requests which fail, and the prefetch of the results
+from retry_queues import RetryQueues, prefetch_count as results_prefetch_count
+# the results may come inline
+from message_codec import is_encoded, decode
+# for timing the run's stages
+from tracing import tracer, configure_tracing
+# for the metrics endpoint
+from metrics import registry, start_metrics_server
+
+# how many reports are rendered at once, and how many requests this replica takes from the pdfs queue ahead
+report_workers = int(os.getenv('REPORT_WORKERS', '4'))
+prefetch_count = int(os.getenv('PREFETCH_COUNT', str(report_workers * 2)))
+reports_dir = os.getenv('REPORTS_DIR', '/reports')
+# seconds a report request waits for the rest of its results before the report is rendered from scratch
+incremental_timeout = float(os.getenv('INCREMENTAL_REPORT_TIMEOUT', '30'))
+# seconds after which a report nobody asked for is dropped (another replica answered its request)
+report_idle_timeout = float(os.getenv('REPORT_IDLE_TIMEOUT', '3600'))
+
+# every worker process opens its own client after the fork, the main process opens its own once the pool is up
+mdb_handler = None
+
+# only the fields the report shows, sorted so every suite's results are together
+RESULT_FIELDS = {'_id' : 0, 'setup_id' : 1, 'run_id' : 1, 'test' : 1, 'suite' : 1, 'result' : 1, 'duration' : 1}
+RESULT_ORDER = [('suite', 1), ('test', 1)]
 
-connection = pika.BlockingConnection(
-    pika.ConnectionParameters(os.getenv('RMQ_HOST')))
+# a request whose handling raised is retried later, and dead-lettered to pdfs.dead after the last retry
+pdfs_retry_queues = RetryQueues('pdfs')
 
-channel = connection.channel()
+REPORTS_ANSWERED = registry.counter('report_requests_answered_total', 'Report requests answered, by how', ['how'])
+REPORT_RENDER_DURATION = registry.histogram('report_render_duration_seconds', 'Time from a report request to its answer')
 
-channel.queue_declare(queue='pdfs')
+# run id -> the report which is built while the results of the run come in
+reports = {}
+# run id -> (channel, method, props, request, timer) of a request which came before all of its results, the timer
+# gives up waiting for them
+waiting_requests = {}
+# the runs whose report the pool is rendering, their late results are ignored until it's done, a report built from
+# them would write over the same .part file as the worker
+rendering = set()
 
-def on_request(ch, method, props, body):
-    response = 'I am link to pdf, cant you see?'
+# the run of a result or of a request, a setup may be run many times. the results and the requests of older
+# controllers have no run id, their run is the setup's
+def run_key(document):
+    return str(document.get('run_id') or document['setup_id'])
+
+def report_path(run_id):
+    return os.path.join(reports_dir, 'report-%s.pdf' % run_id)
+
+def report_title(setup_id):
+    return 'Test report of setup %s' % setup_id
+
+# runs in a worker process
+def render_run_report(request):
+    global mdb_handler
+    if mdb_handler is None:
+        mdb_handler = MongodbHandler()
+    field = 'run_id' if request.get('run_id') else 'setup_id'
+    results = mdb_handler.get_documents('Test Results', field, run_key(request), projection=RESULT_FIELDS, sort=RESULT_ORDER)
+    path = report_path(run_key(request))
+    summary = render_report(results, path, report_title(request['setup_id']))
+    print('report-generator: rendered %d results to %s' % (summary.total, path))
+    return path
+
+# runs in the connection's thread, the request is acked only after it was answered
+# so a replica which dies mid render gives its requests back to the queue for the other replicas
+def send_response(channel, method, props, response):
     print('report-generator: sending link - %s' % response)
-    ch.basic_publish(exchange='',
-                     routing_key=props.reply_to,
-                     properties=pika.BasicProperties(correlation_id = \
-                                                         props.correlation_id),
-                     body=response)
+    if props.headers and props.headers.get('sent_at'):
+        # from the request to its answer, whether it was finalized right away, waited for results or rendered by the pool
+        sent_at = props.headers['sent_at']
+        tracer.record('pdfs_answered', sent_at, time.time() - sent_at, props.headers)
+        REPORT_RENDER_DURATION.observe(time.time() - sent_at)
+    channel.basic_publish(exchange='',
+                          routing_key=props.reply_to,
+                          properties=pika.BasicProperties(correlation_id = \
+                                                              props.correlation_id),
+                          body=response)
+    channel.basic_ack(delivery_tag=method.delivery_tag)
+
+# the request goes to the retry queues like a request whose handling raised
+def send_failure(channel, method, props, request, error):
+    routing_key = pdfs_retry_queues.reject(channel, method, props, dumps(request).encode(), error)
+    print('report-generator: failed rendering, sent the request to %s - %s' % (routing_key, error))
+
+def render_in_pool(connection, pool, request, ch, method, props):
+    run_id = run_key(request)
+    report = reports.pop(run_id, None)
+    if report is not None:
+        report.discard()
+    REPORTS_ANSWERED.labels('rendered').inc()
+    rendering.add(run_id)
+    # the pool's result thread hands the answer back to the connection's thread
+    pool.apply_async(render_run_report, (request,),
+                     callback=lambda response: connection.add_callback_threadsafe(
+                         functools.partial(rendered, run_id, send_response, ch, method, props, response)),
+                     error_callback=lambda error: connection.add_callback_threadsafe(
+                         functools.partial(rendered, run_id, send_failure, ch, method, props, request, error)))
+
+# runs in the connection's thread once the pool rendered the report (or failed to)
+def rendered(run_id, answer, *args):
+    rendering.discard(run_id)
+    answer(*args)
+
+# answers the request from the incremental report once it has all of the results, returns False if it doesn't yet
+def finalize_report(run_id, ch, method, props, request):
+    report = reports.get(run_id)
+    if report is None or report.total < request['results']:
+        return False
+    del reports[run_id]
+    summary = report.finalize()
+    REPORTS_ANSWERED.labels('incremental').inc()
+    print('report-generator: finalized %d results to %s' % (summary.total, report.path))
+    send_response(ch, method, props, report.path)
+    return True
+
+# the results come in batches of ids, every batch is fetched with a single query and added to the reports of its runs
+# (or with the results themselves when the controller has a codec, then there's nothing to fetch)
+# a batch which fails is dropped, the report of its run then misses results and is rendered from the database instead
+def on_results(ch, method, props, body):
+    try:
+        with HANDLER_DURATION.labels('results').time(), tracer.span('results', props.headers):
+            if is_encoded(props.content_type):
+                add_results(decode(body, props.content_type, props.content_encoding))
+            else:
+                uids = [ObjectId(uid) for uid in loads(body)]
+                add_results(mdb_handler.get_documents_list('Test Results', '_id', {'$in' : uids}, projection=RESULT_FIELDS))
+        MESSAGES_CONSUMED.labels('results').inc()
+    except Exception as error:
+        print('report-generator: dropping a batch of results - %r' % error)
     ch.basic_ack(delivery_tag=method.delivery_tag)
 
-channel.basic_qos(prefetch_count=1)
-channel.basic_consume(queue='pdfs', on_message_callback=on_request)
+def add_results(results):
+    run_ids = set()
+    for result in results:
+        run_id = run_key(result)
+        if run_id in rendering:
+            continue
+        if run_id not in reports:
+            reports[run_id] = IncrementalReport(report_path(run_id), report_title(result['setup_id']))
+        reports[run_id].add(result)
+        run_ids.add(run_id)
+    for run_id in run_ids & set(waiting_requests):
+        if finalize_report(run_id, *waiting_requests[run_id][:4]):
+            del waiting_requests[run_id]
+
+# the timer of a request which was answered (or replaced) meanwhile finds another request, or none, and does nothing
+def give_up_waiting(connection, pool, run_id, waiting):
+    if waiting_requests.get(run_id) is waiting:
+        del waiting_requests[run_id]
+        print('report-generator: results of %s are missing, rendering from scratch' % run_id)
+        render_in_pool(connection, pool, waiting[3], *waiting[:3])
+
+def drop_idle_reports(connection):
+    for run_id, report in list(reports.items()):
+        if run_id not in waiting_requests and time.time() - report.last_update > report_idle_timeout:
+            reports.pop(run_id).discard()
+    connection.call_later(report_idle_timeout, functools.partial(drop_idle_reports, connection))
+
+# the request's body is {"run_id": ..., "setup_id": ..., "results": <number of results>}, the report was built while the results
+# came in so usually it only has to be finalized, otherwise it's rendered from scratch by the pool
+def on_request(connection, pool, ch, method, props, body):
+    try:
+        with HANDLER_DURATION.labels('pdfs').time(), tracer.span('pdfs', props.headers):
+            handle_request(connection, pool, ch, method, props, loads(body))
+    except Exception as error:
+        routing_key = pdfs_retry_queues.reject(ch, method, props, body, error)
+        print('report-generator: request failed, sent to %s - %r' % (routing_key, error))
+        return
+    MESSAGES_CONSUMED.labels('pdfs').inc()
+
+def handle_request(connection, pool, ch, method, props, request):
+    run_id = run_key(request)
+    report = reports.get(run_id)
+    if report is None or report.total > request['results']:
+        render_in_pool(connection, pool, request, ch, method, props)
+    elif not finalize_report(run_id, ch, method, props, request):
+        # the rest of the results may still be on their way
+        replaced = waiting_requests.get(run_id)
+        if replaced is not None:
+            # the run's report was requested again (by a resumed controller), the caller of the earlier request is gone
+            connection.remove_timeout(replaced[4])
+            replaced[0].basic_ack(delivery_tag=replaced[1].delivery_tag)
+            print('report-generator: the report of %s was requested again, dropping the earlier request' % run_id)
+        waiting = [ch, method, props, request, None]
+        waiting[4] = connection.call_later(incremental_timeout, functools.partial(give_up_waiting, connection, pool, run_id, waiting))
+        waiting_requests[run_id] = waiting
+
+def main():
+    global mdb_handler
+    os.makedirs(reports_dir, exist_ok=True)
+    pool = Pool(report_workers)
+    mdb_handler = MongodbHandler()
+    # once, in the main process and after the pool was forked, a worker binding the port again would fail its render
+    if os.getenv('METRICS_PORT'):
+        start_metrics_server(int(os.getenv('METRICS_PORT')))
+    # the results, pdfs and pdfs_answered spans are recorded by the main process, the workers record none
+    if os.getenv('TRACING') == '1':
+        configure_tracing('report-generator', mdb_handler)
+
+    connection = pika.BlockingConnection(connection_parameters())
+
+    channel = connection.channel()
+
+    channel.queue_declare(queue='pdfs')
+    pdfs_retry_queues.declare(channel)
+
+    # every replica gets all of the results on a queue of its own
+    channel.exchange_declare(exchange=RESULTS_EXCHANGE, exchange_type='fanout')
+    results_queue = channel.queue_declare(queue='', exclusive=True).method.queue
+    channel.queue_bind(queue=results_queue, exchange=RESULTS_EXCHANGE)
+    declare_runs_exchange(channel)
+    bind_all_results(channel, results_queue)
+    channel.basic_qos(prefetch_count=results_prefetch_count())
+    channel.basic_consume(queue=results_queue, on_message_callback=on_results)
+    connection.call_later(report_idle_timeout, functools.partial(drop_idle_reports, connection))
+
+    # several replicas can consume the same queue, the broker hands every request to one of them
+    channel.basic_qos(prefetch_count=prefetch_count)
+    channel.basic_consume(queue='pdfs', on_message_callback=functools.partial(on_request, connection, pool))
+
+    print('report: waiting for pdf request (%d workers, prefetch %d)' % (report_workers, prefetch_count))
+    try:
+        channel.start_consuming()
+    finally:
+        pool.terminate()
+    print('report: after consume')
 
-print('report: waiting for pdf request')
-channel.start_consuming()
-print('report: after consume')
\ No newline at end of file
+if __name__ == '__main__':
+    main()
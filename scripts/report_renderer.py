@@ -0,0 +1,144 @@
+# for the summary of every suite
+from collections import OrderedDict
+
+import time
+
+import os
+
+
+# writes a pdf one page at a time, only the offsets of the objects written so far are kept in memory.
+# the pages tree is written last, the pages refer to it by its reserved object number.
+class PdfReportWriter:
+    CATALOG = 1
+    PAGES = 2
+    FONT = 3
+
+    def __init__(self, path, lines_per_page=55):
+        self.path = path
+        self.lines_per_page = lines_per_page
+        self.file = open(path, 'wb')
+        self.offsets = {}
+        self.next_object = 4
+        self.page_objects = []
+        self.lines = []
+        self.file.write(b'%PDF-1.4\n')
+        self.write_object(self.FONT, b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>')
+
+    def write_object(self, number, content):
+        self.offsets[number] = self.file.tell()
+        self.file.write(b'%d 0 obj\n' % number + content + b'\nendobj\n')
+
+    def new_object_number(self):
+        number = self.next_object
+        self.next_object += 1
+        return number
+
+    @staticmethod
+    def escape(text):
+        return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)').encode('latin-1', 'replace')
+
+    def add_line(self, text=''):
+        self.lines.append(text)
+        if len(self.lines) == self.lines_per_page:
+            self.write_page()
+
+    def new_page(self):
+        if self.lines:
+            self.write_page()
+
+    def write_page(self):
+        stream = b'BT /F1 10 Tf 14 TL 40 800 Td\n' + b''.join(b'(' + self.escape(line) + b') Tj T*\n' for line in self.lines) + b'ET'
+        content_object = self.new_object_number()
+        self.write_object(content_object, b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+        page_object = self.new_object_number()
+        self.write_object(page_object, b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>' % (
+            self.PAGES, self.FONT, content_object))
+        self.page_objects.append(page_object)
+        self.lines = []
+
+    def close(self):
+        self.new_page()
+        kids = b' '.join(b'%d 0 R' % page_object for page_object in self.page_objects)
+        self.write_object(self.PAGES, b'<< /Type /Pages /Kids [' + kids + b'] /Count %d >>' % len(self.page_objects))
+        self.write_object(self.CATALOG, b'<< /Type /Catalog /Pages %d 0 R >>' % self.PAGES)
+        xref_offset = self.file.tell()
+        self.file.write(b'xref\n0 %d\n0000000000 65535 f \n' % self.next_object)
+        for number in range(1, self.next_object):
+            self.file.write(b'%010d 00000 n \n' % self.offsets[number])
+        self.file.write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (self.next_object, self.CATALOG, xref_offset))
+        self.file.close()
+
+
+# pass/fail counts of a run, per suite, the only thing which grows with the results is the number of suites
+class ResultsSummary:
+    def __init__(self):
+        self.suites = OrderedDict()
+        self.total = 0
+        self.duration = 0.0
+
+    def add(self, result):
+        counts = self.suites.setdefault(result.get('suite', ''), {'Pass' : 0, 'Fail' : 0, 'Other' : 0})
+        outcome = result.get('result')
+        counts[outcome if outcome in ('Pass', 'Fail') else 'Other'] += 1
+        self.total += 1
+        self.duration += result.get('duration') or 0.0
+
+    def lines(self):
+        yield 'Summary'
+        yield ''
+        yield '%-20s %8s %8s %8s' % ('suite', 'pass', 'fail', 'other')
+        for suite, counts in self.suites.items():
+            yield '%-20s %8d %8d %8d' % (suite, counts['Pass'], counts['Fail'], counts['Other'])
+        yield ''
+        yield '%d results, %.1f seconds of tests' % (self.total, self.duration)
+
+
+def result_line(result):
+    return '%-40s %-10s %8.2fs' % (result.get('test', result.get('name', ''))[:40], result.get('result', ''), result.get('duration') or 0.0)
+
+# a report which is written while the results of its run come in, adding a result renders it right away
+# and keeps the summary up to date, so finalizing only has to write the summary page and close the file.
+# until then the report is written next to path, so a half written report is never found there.
+class IncrementalReport:
+    def __init__(self, path, title, lines_per_page=55):
+        self.path = path
+        self.writer = PdfReportWriter(path + '.part', lines_per_page)
+        self.summary = ResultsSummary()
+        self.last_update = time.time()
+        self.writer.add_line(title)
+        self.writer.add_line('generated %s' % time.strftime('%d-%m-%Y %H:%M:%S'))
+        self.writer.add_line()
+
+    @property
+    def total(self):
+        return self.summary.total
+
+    def add(self, result):
+        self.summary.add(result)
+        self.writer.add_line(result_line(result))
+        self.last_update = time.time()
+
+    def finalize(self):
+        self.writer.new_page()
+        for line in self.summary.lines():
+            self.writer.add_line(line)
+        self.writer.close()
+        os.replace(self.writer.path, self.path)
+        return self.summary
+
+    # dropping a report which won't be finished, the file is removed
+    def discard(self):
+        self.writer.file.close()
+        try:
+            os.remove(self.writer.path)
+        except FileNotFoundError:
+            pass
+
+
+# renders the results as they are iterated (a mongo cursor sorted by suite and test), a page is written
+# to disk every lines_per_page results so memory stays flat no matter how many results the run has
+def render_report(results, path, title, lines_per_page=55):
+    report = IncrementalReport(path, title, lines_per_page)
+    for result in results:
+        report.add(result)
+    return report.finalize()
@@ -0,0 +1,66 @@
+# delayed retries and a dead letter queue for the messages whose callback failed
+import os
+
+import copy
+
+from metrics import registry
+
+# how many times the message was retried so far, and the error of its last attempt
+RETRIES_HEADER = 'x-retries'
+ERROR_HEADER = 'x-last-error'
+
+MESSAGES_RETRIED = registry.counter('rmq_messages_retried_total', 'Failed messages sent to a retry queue, by queue', ['queue'])
+MESSAGES_DEAD_LETTERED = registry.counter('rmq_messages_dead_lettered_total', 'Messages which failed every retry, by queue', ['queue'])
+
+# how many unacked messages a consumer holds at once, the rest wait in the broker instead of the consumer's memory
+def prefetch_count():
+    return int(os.getenv('RMQ_PREFETCH_COUNT', '10'))
+
+
+# a message whose callback failed is published to the retry queue of its attempt and acked. the retry queue holds it
+# for initial_delay * 2 ** attempt seconds and dead-letters it back to the queue. after max_retries retries it goes to
+# <queue>.dead, where it stays until somebody looks at it. the delay is a part of the retry queues' names, so a
+# different delay declares new queues instead of clashing with the arguments of the old ones.
+class RetryQueues:
+    def __init__(self, queue, max_retries=None, initial_delay=None):
+        self.queue = queue
+        self.max_retries = int(os.getenv('RMQ_MAX_RETRIES', '3')) if max_retries is None else max_retries
+        if initial_delay is None:
+            initial_delay = float(os.getenv('RMQ_RETRY_DELAY', '1'))
+        # (name, milliseconds a message waits in it) of every retry
+        self.retry_queues = []
+        for attempt in range(self.max_retries):
+            ttl = int(initial_delay * 1000 * 2 ** attempt)
+            self.retry_queues.append(('%s.retry.%dms' % (queue, ttl), ttl))
+        self.dead_letter_queue = '%s.dead' % queue
+
+    def arguments(self, ttl):
+        return {'x-message-ttl' : ttl, 'x-dead-letter-exchange' : '', 'x-dead-letter-routing-key' : self.queue}
+
+    # on a blocking channel, the asyncio handler declares the same queues with arguments()
+    def declare(self, channel):
+        for name, ttl in self.retry_queues:
+            channel.queue_declare(queue=name, arguments=self.arguments(ttl))
+        channel.queue_declare(queue=self.dead_letter_queue)
+
+    # the queue a failed message goes to next, and its headers on the way there
+    def route(self, headers, error):
+        headers = dict(headers or {})
+        retries = headers.get(RETRIES_HEADER, 0)
+        headers[ERROR_HEADER] = repr(error)[:500]
+        if retries < self.max_retries:
+            headers[RETRIES_HEADER] = retries + 1
+            MESSAGES_RETRIED.labels(self.queue).inc()
+            return self.retry_queues[retries][0], headers
+        MESSAGES_DEAD_LETTERED.labels(self.queue).inc()
+        return self.dead_letter_queue, headers
+
+    # runs in the consuming thread. the message is published before it's acked, so a crash in between
+    # delivers it twice rather than never. returns the queue it went to
+    def reject(self, channel, method, properties, body, error):
+        routing_key, headers = self.route(properties.headers, error)
+        properties = copy.copy(properties)
+        properties.headers = headers
+        channel.basic_publish(exchange='', routing_key=routing_key, body=body, properties=properties)
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        return routing_key
@@ -0,0 +1,221 @@
+# for rabbitmq use
+import pika
+
+import os
+
+import time
+
+import random
+
+import logging
+
+import queue
+
+# for handing out the pooled connections to one thread at a time
+import threading
+
+from contextlib import contextmanager
+
+from metrics import registry
+
+# the errors of a connection (or of a channel on it) which went away, as opposed to errors of the request itself
+RECOVERABLE_ERRORS = (pika.exceptions.AMQPConnectionError,
+                      pika.exceptions.ConnectionWrongStateError,
+                      pika.exceptions.ChannelWrongStateError,
+                      ConnectionError)
+
+RECONNECTS = registry.counter('rmq_reconnects_total', 'Connections which were opened again after they were lost')
+RECOVERY_TIME = registry.histogram('rmq_recovery_duration_seconds', 'Time from a lost connection to a working channel again')
+
+
+# heartbeats detect a dead broker (or a dead network in between) within about two heartbeat intervals,
+# instead of waiting for the operating system's tcp timeout
+def connection_parameters(host=None):
+    return pika.ConnectionParameters(host or os.getenv('RMQ_HOST'),
+                                     port=int(os.getenv('RMQ_PORT', '5672')),
+                                     heartbeat=int(os.getenv('RMQ_HEARTBEAT', '30')),
+                                     blocked_connection_timeout=float(os.getenv('RMQ_BLOCKED_CONNECTION_TIMEOUT', '300')))
+
+# exponentially growing delays between reconnect attempts, with jitter so the services don't reconnect in lockstep
+def backoff_delays(initial_backoff=None, max_backoff=None):
+    delay = initial_backoff or float(os.getenv('RMQ_INITIAL_BACKOFF', '0.5'))
+    max_backoff = max_backoff or float(os.getenv('RMQ_MAX_BACKOFF', '5'))
+    while True:
+        yield random.uniform(delay / 2, delay)
+        delay = min(delay * 2, max_backoff)
+
+
+# a blocking connection with a single channel which is opened again when the broker goes away.
+# on_channel(channel) is called on every new channel, for declaring queues and consumers again. max_attempts
+# (None to keep trying) is the number of connection attempts before the last error is raised.
+class ConnectionManager:
+    def __init__(self, parameters, on_channel=None, logger=None, max_attempts=None):
+        self.parameters = parameters
+        self.on_channel = on_channel
+        self.logger = logger or logging.getLogger('rmq')
+        self.max_attempts = max_attempts
+        self.connection = None
+        self.channel = None
+        self.stopping = False
+        self.connect()
+
+    def connect(self):
+        for attempt, delay in enumerate(backoff_delays(), 1):
+            try:
+                self.connection = pika.BlockingConnection(self.parameters)
+                self.channel = self.connection.channel()
+                if self.on_channel is not None:
+                    self.on_channel(self.channel)
+                return
+            except RECOVERABLE_ERRORS as error:
+                if self.max_attempts is not None and attempt >= self.max_attempts:
+                    raise
+                message = 'rmq_handler: connecting to %s failed (attempt %d) - %r, retrying in %.1f seconds' % (
+                    self.parameters.host, attempt, error, delay)
+                self.logger.warning(message)
+                self.close_connection()
+                time.sleep(delay)
+
+    def reconnect(self, error):
+        lost_at = time.time()
+        message = 'rmq_handler: lost the connection to %s - %r' % (self.parameters.host, error)
+        self.logger.warning(message)
+        self.close_connection()
+        self.connect()
+        RECONNECTS.inc()
+        RECOVERY_TIME.observe(time.time() - lost_at)
+        message = 'rmq_handler: reconnected to %s after %.2f seconds' % (self.parameters.host, time.time() - lost_at)
+        self.logger.info(message)
+
+    # serves the heartbeats of a connection which sat idle, and opens it again if the broker dropped it meanwhile
+    def refresh(self):
+        try:
+            if self.connection is None or not self.connection.is_open:
+                raise pika.exceptions.ConnectionWrongStateError('the connection is closed')
+            self.connection.process_data_events(time_limit=0)
+        except RECOVERABLE_ERRORS as error:
+            self.reconnect(error)
+
+    def close_connection(self):
+        try:
+            if self.connection is not None and self.connection.is_open:
+                self.connection.close()
+        except RECOVERABLE_ERRORS:
+            pass
+
+    # operation(channel) is run again on a new channel if the connection was lost, so it must be safe to repeat
+    def run(self, operation):
+        try:
+            return operation(self.channel)
+        except RECOVERABLE_ERRORS as error:
+            self.reconnect(error)
+            return operation(self.channel)
+
+    # consumes until stop_consuming(), the consumers of on_channel come back with the connection
+    def consume(self):
+        while not self.stopping:
+            try:
+                self.channel.start_consuming()
+                return
+            except RECOVERABLE_ERRORS as error:
+                if self.stopping:
+                    return
+                self.reconnect(error)
+
+    # can be called from any thread
+    def stop_consuming(self):
+        self.stopping = True
+        try:
+            self.connection.add_callback_threadsafe(self.channel.stop_consuming)
+        except RECOVERABLE_ERRORS:
+            # the connection is gone, the consuming thread sees stopping once it reconnected
+            pass
+
+    # runs callback in the connection's thread, from any thread. returns False if the connection is gone
+    def add_callback_threadsafe(self, callback):
+        try:
+            self.connection.add_callback_threadsafe(callback)
+            return True
+        except RECOVERABLE_ERRORS:
+            return False
+
+    def close(self):
+        self.stopping = True
+        self.close_connection()
+
+
+# blocking connections can't be shared between threads, so concurrent publishers take a connection of the pool
+# each (up to size connections are opened, on demand) and give it back when they're done. nothing reads from an idle
+# connection, so a background thread serves their heartbeats every half heartbeat interval, otherwise the broker
+# drops them and the next publish waits for a new connection. a connection which was dropped anyway is opened again
+# when it's taken.
+class ChannelPool:
+    def __init__(self, parameters, size, on_channel=None, logger=None):
+        self.parameters = parameters
+        self.size = size
+        self.on_channel = on_channel
+        self.logger = logger
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+        self.keeper = None
+        self.closed = False
+
+    @contextmanager
+    def connection(self):
+        manager = self.acquire()
+        try:
+            yield manager
+        finally:
+            self.idle.put(manager)
+
+    def acquire(self):
+        try:
+            return self.checked(self.idle.get_nowait())
+        except queue.Empty:
+            pass
+        with self.lock:
+            is_new = self.opened < self.size
+            if is_new:
+                self.opened += 1
+            if self.keeper is None and self.parameters.heartbeat:
+                self.keeper = threading.Thread(target=self.keep_alive, name='rmq-pool-heartbeats', daemon=True)
+                self.keeper.start()
+        if not is_new:
+            return self.checked(self.idle.get())
+        try:
+            return ConnectionManager(self.parameters, self.on_channel, self.logger)
+        except Exception:
+            with self.lock:
+                self.opened -= 1
+            raise
+
+    def checked(self, manager):
+        manager.refresh()
+        return manager
+
+    def keep_alive(self):
+        while not self.closed:
+            time.sleep(self.parameters.heartbeat / 2.0)
+            managers = []
+            while True:
+                try:
+                    managers.append(self.idle.get_nowait())
+                except queue.Empty:
+                    break
+            for manager in managers:
+                if not self.closed:
+                    manager.refresh()
+                self.idle.put(manager)
+
+    def run(self, operation):
+        with self.connection() as manager:
+            return manager.run(operation)
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
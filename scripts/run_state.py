@@ -0,0 +1,37 @@
+# for waking up waiters without polling
+import threading
+
+import time
+
+
+# holds the state of a single run (the flags which used to live in a Manager dict),
+# rabbitmq callbacks fire transitions on it directly and waiters block until the flags they need are set
+class RunState:
+    def __init__(self, **flags):
+        self.flags = dict(flags)
+        self.condition = threading.Condition()
+        # time of the last transition, for measuring how long it takes the flow to resume
+        self.last_transition_time = None
+
+    def get(self, flag):
+        with self.condition:
+            return self.flags[flag]
+
+    def set(self, flag, value=True):
+        self.update(**{flag : value})
+
+    # changing several flags at once, waiters are woken up only once
+    def update(self, **flags):
+        with self.condition:
+            self.flags.update(flags)
+            self.last_transition_time = time.time()
+            self.condition.notify_all()
+
+    def snapshot(self):
+        with self.condition:
+            return dict(self.flags)
+
+    # blocks until all the given flags are truthy, returns False if timeout passed before that
+    def wait_for(self, *flags, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: all(self.flags[flag] for flag in flags), timeout)
@@ -0,0 +1,134 @@
+# messages of many runs at once: every message of a run is published to the runs topic exchange with the run's id
+# in its routing key (<event>.<run id>) and in its run_id header, so every app consumes the messages of its own run only
+import copy
+
+import time
+
+import threading
+
+# the runs are driven concurrently, up to the limit of active runs
+from concurrent.futures import ThreadPoolExecutor
+
+from collections import OrderedDict
+
+RUNS_EXCHANGE = 'runs'
+RUN_ID_HEADER = 'run_id'
+
+# the events which start a run. the setups of the default exchange are consumed by the standalone controllers from
+# the shared queue of the same name, the setups of the run scoped apps by the 'multi' mode controllers from a queue
+# of their own, so a standalone controller never takes the run of a run scoped app
+SETUP_READY = 'setup_ready'
+RUN_SETUP_READY = 'run_setup_ready'
+
+
+def run_routing_key(event, run_id):
+    return '%s.%s' % (event, run_id)
+
+# the event of a run's message, setup_ready of setup_ready.<run id>
+def event_of(routing_key):
+    return routing_key.split('.', 1)[0]
+
+def run_of(properties):
+    return (properties.headers or {}).get(RUN_ID_HEADER)
+
+# a copy of properties with the run's id added
+def run_properties(run_id, properties=None):
+    # loaded by the rabbitmq handler by then, not when the runs are imported
+    import pika
+    properties = copy.copy(properties) if properties is not None else pika.BasicProperties()
+    properties.headers = dict(properties.headers or {}, **{RUN_ID_HEADER : run_id})
+    return properties
+
+def declare_runs_exchange(channel):
+    channel.exchange_declare(exchange=RUNS_EXCHANGE, exchange_type='topic')
+
+# the setups of every run reach the run_setup_ready queue of the 'multi' mode controllers
+def declare_run_setup_ready(channel):
+    declare_runs_exchange(channel)
+    channel.queue_declare(queue=RUN_SETUP_READY)
+    channel.queue_bind(queue=RUN_SETUP_READY, exchange=RUNS_EXCHANGE, routing_key=run_routing_key(SETUP_READY, '*'))
+
+# the controllers bound the setups of the runs to the shared setup_ready queue before, a broker which still has that
+# binding would hand them to the standalone controllers too
+def unbind_shared_setup_ready(channel):
+    channel.queue_unbind(queue=SETUP_READY, exchange=RUNS_EXCHANGE, routing_key=run_routing_key(SETUP_READY, '*'))
+
+# the results of every run reach a report generator's queue as well as the queue of their own run
+def bind_all_results(channel, queue):
+    channel.queue_bind(queue=queue, exchange=RUNS_EXCHANGE, routing_key=run_routing_key('results', '*'))
+
+# the queue of a single run, with the given events of that run only. it's exclusive, it goes away with its consumer
+def declare_run_queue(channel, queue, run_id, events):
+    channel.queue_declare(queue=queue, exclusive=True)
+    for event in events:
+        channel.queue_bind(queue=queue, exchange=RUNS_EXCHANGE, routing_key=run_routing_key(event, run_id))
+
+
+# a run which was started by its setup_ready message
+class Run:
+    def __init__(self, run_id, setup_id, setup=None, headers=None):
+        self.run_id = run_id
+        self.setup_id = setup_id
+        self.setup = setup
+        # of the setup_ready message, the run's trace goes on from there
+        self.headers = headers
+        self.checkpoint = None
+        self.results_count = 0
+        self.pdf_link = None
+        self.started_at = time.time()
+
+
+# the active runs of a controller by their id. drive(run) runs each of them in a thread of its own, up to
+# max_active_runs at once, the runs which are started beyond that wait for one of them to end. a run id which is
+# active or ended lately is started once only, so a setup_ready message which is delivered again is ignored.
+class RunRegistry:
+    def __init__(self, drive, max_active_runs, logger, remembered_runs=1000):
+        self.drive = drive
+        self.logger = logger
+        self.pool = ThreadPoolExecutor(max_workers=max_active_runs, thread_name_prefix='run')
+        self.runs = {}
+        self.ended = OrderedDict()
+        self.remembered_runs = remembered_runs
+        self.completed = 0
+        self.failed = 0
+        self.condition = threading.Condition()
+
+    # returns False if the run was started before
+    def start(self, run):
+        with self.condition:
+            if run.run_id in self.runs or run.run_id in self.ended:
+                return False
+            self.runs[run.run_id] = run
+        self.pool.submit(self.run, run)
+        return True
+
+    def run(self, run):
+        try:
+            self.drive(run)
+            is_completed = True
+        except Exception as error:
+            message = 'ctrl: run %s failed - %r' % (run.run_id, error)
+            self.logger.error(message)
+            is_completed = False
+        with self.condition:
+            del self.runs[run.run_id]
+            self.ended[run.run_id] = is_completed
+            if len(self.ended) > self.remembered_runs:
+                self.ended.popitem(last=False)
+            if is_completed:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.condition.notify_all()
+
+    def active(self):
+        with self.condition:
+            return len(self.runs)
+
+    # blocks until no run is active, returns False if timeout passed before that
+    def wait_idle(self, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.runs, timeout)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,101 @@
+# plans the order of the tests and spreads them between the devices, so that the devices finish about together
+import os
+
+# for the device which is free first
+import heapq
+
+import queue
+
+from contextlib import contextmanager
+
+from mongodb_handler import mongo_operation
+
+RESULTS_COLLECTION = 'Test Results'
+
+# seconds a test without any history is expected to take, when no test of the run has history either
+DEFAULT_DURATION = float(os.getenv('DEFAULT_TEST_DURATION', '60'))
+# how many tests a device runs at once, unless the setup's DeviceLimits says otherwise
+MAX_TESTS_PER_DEVICE = int(os.getenv('MAX_TESTS_PER_DEVICE', '1'))
+
+
+# the average duration of every test which ran before, a single aggregation over the results of all the past runs
+def load_durations(mdb_handler, tests):
+    pipeline = [
+        {'$match' : {'test' : {'$in' : list(tests)}, 'duration' : {'$exists' : True}}},
+        {'$group' : {'_id' : '$test', 'duration' : {'$avg' : '$duration'}}},
+    ]
+    with mongo_operation('aggregate', RESULTS_COLLECTION):
+        return {document['_id'] : document['duration'] for document in mdb_handler.db[RESULTS_COLLECTION].aggregate(pipeline)}
+
+# the expected duration of every test: its own history, else the average of its suite's tests which have one,
+# else the average of every test which has one, else default_duration
+def estimate_durations(tests, durations, default_duration=DEFAULT_DURATION):
+    suites = {}
+    for test, duration in durations.items():
+        suites.setdefault(test.split('/')[0], []).append(duration)
+    fallback = sum(durations.values()) / len(durations) if durations else default_duration
+    estimates = {}
+    for test in tests:
+        if test in durations:
+            estimates[test] = durations[test]
+        elif test.split('/')[0] in suites:
+            suite_durations = suites[test.split('/')[0]]
+            estimates[test] = sum(suite_durations) / len(suite_durations)
+        else:
+            estimates[test] = fallback
+    return estimates
+
+# the devices of a setup, SelectedDevices or the single SelectedDevice of older setups
+def setup_devices(setup):
+    return setup.get('SelectedDevices') or [setup.get('SelectedDevice')]
+
+def device_limits(setup, devices, default_limit=MAX_TESTS_PER_DEVICE):
+    limits = setup.get('DeviceLimits') or {}
+    return {device : int(limits.get(device, default_limit)) for device in devices}
+
+
+# hands out the devices to the tests, every device to up to its limit of tests at once. the tests take whichever
+# device is free, so a test which runs longer than expected holds back only its own device's next test
+class DevicePool:
+    def __init__(self, limits):
+        self.free = queue.Queue()
+        for device, limit in limits.items():
+            for slot in range(limit):
+                self.free.put(device)
+
+    @contextmanager
+    def take(self):
+        device = self.free.get()
+        try:
+            yield device
+        finally:
+            self.free.put(device)
+
+
+# the order to start the tests in, and the end of the run it's expected to have
+class Plan:
+    def __init__(self, order, limits, makespan):
+        self.order = order
+        self.limits = limits
+        self.makespan = makespan
+
+    def workers(self):
+        return sum(self.limits.values())
+
+
+# longest processing time first: the tests start from the longest to the shortest, every test on the device which
+# is free first. the short tests at the end fill the gaps the long ones left, with the estimated durations the run
+# takes at most 4/3 of the best plan's time. planning n tests takes o(n log n).
+def build_plan(tests, estimates, limits):
+    order = sorted(tests, key=lambda test: estimates[test], reverse=True)
+    return Plan(order, limits, simulate(order, estimates, limits))
+
+# the end of the run if the tests take durations and start in order, each one on the device which is free first
+def simulate(order, durations, limits):
+    slots = [0.0] * sum(limits.values())
+    makespan = 0.0
+    for test in order:
+        free_at = heapq.heappop(slots) + durations[test]
+        heapq.heappush(slots, free_at)
+        makespan = max(makespan, free_at)
+    return makespan
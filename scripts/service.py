@@ -0,0 +1,117 @@
+# the connections of a service (the app, the controller), opened on first use and not at import time, so
+# importing the service (or forking it) doesn't connect anywhere and main() decides what to connect first
+import os
+
+import logging
+
+# for opening the connections of a service concurrently
+import threading
+
+# for timing the run's stages
+from tracing import tracer, configure_tracing
+# for the metrics endpoint
+from metrics import start_metrics_server
+
+
+# a property which is computed once, on its first use. a thread which uses it while it's being computed
+# waits for it, and after that it's a plain attribute of the instance
+class lazy:
+    def __init__(self, function):
+        self.function = function
+        self.name = function.__name__
+        self.lock = threading.Lock()
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        with self.lock:
+            if self.name not in instance.__dict__:
+                instance.__dict__[self.name] = self.function(instance)
+        return instance.__dict__[self.name]
+
+
+class Service:
+    def __init__(self, name, logging_level, logging_file=None):
+        self.name = name
+        self.logging_level = logging_level
+        self.logging_file = logging_file
+        self.logger = logging.getLogger(name)
+
+    @lazy
+    def rmq_handler(self):
+        from rabbitmq_handler import RabbitmqHandler
+        return RabbitmqHandler(self.logging_level, self.logging_file)
+
+    # the listeners can consume as asyncio tasks over one connection instead of a blocking connection per listener
+    @lazy
+    def listening_handler(self):
+        if os.getenv('RMQ_CONSUMERS') == 'async':
+            from async_rabbitmq_handler import AsyncRabbitmqHandler
+            return AsyncRabbitmqHandler(self.logging_level, self.logging_file)
+        return self.rmq_handler
+
+    @lazy
+    def mdb_handler(self):
+        from mongodb_handler import MongodbHandler
+        return MongodbHandler()
+
+    # the async client of the process, on a loop of its own, see AsyncMongodbHandler
+    @lazy
+    def async_mdb_handler(self):
+        from async_mongodb_handler import AsyncMongodbHandler
+        return AsyncMongodbHandler()
+
+    # the spans of the consumed messages are written to the 'Trace Spans' collection
+    @lazy
+    def trace_writer(self):
+        if os.getenv('TRACING') != '1':
+            return None
+        return configure_tracing(self.name, self.mdb_handler)
+
+    # opens the given connections in the background, the first use of any of them waits for it to be open
+    def warm_up(self, *names):
+        threads = [threading.Thread(target=self.open, args=(name,), daemon=True) for name in names]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def open(self, name):
+        try:
+            getattr(self, name)
+        except Exception as error:
+            # it's opened (and the error raised) again on its first use
+            message = '%s: opening %s in the background failed - %s' % (self.name, name, error)
+            self.logger.warning(message)
+
+    # the tracer is configured before the flow sends anything, so the first messages carry the trace's headers too.
+    # only the writer of the spans is opened in the background, a span which ends before that waits for it
+    def start(self, *names):
+        if os.getenv('METRICS_PORT'):
+            start_metrics_server(int(os.getenv('METRICS_PORT')))
+        if os.getenv('TRACING') == '1':
+            tracer.configure(self.name, self.write_span)
+        return self.warm_up('trace_writer', *names)
+
+    # tracing is turned off if the writer can't be opened, it doesn't fail the message being handled
+    def write_span(self, span):
+        try:
+            writer = self.trace_writer
+        except Exception as error:
+            tracer.configure(self.name, None)
+            message = '%s: tracing is off, the trace writer could not be opened - %s' % (self.name, error)
+            self.logger.warning(message)
+            return
+        writer.add(span)
+
+    # only what was opened is flushed
+    def stop(self):
+        if 'rmq_handler' in self.__dict__:
+            # waiting for the confirms of whatever is still in flight before exiting, the messages the broker
+            # nacked for good were logged by the publisher
+            try:
+                self.rmq_handler.flush_publishes()
+            except Exception as error:
+                message = '%s: exiting with unconfirmed messages - %r' % (self.name, error)
+                self.logger.error(message)
+        if self.__dict__.get('trace_writer') is not None:
+            self.trace_writer.flush()
@@ -0,0 +1,178 @@
+# for rabbitmq use
+import pika
+
+from json import dumps, loads
+
+import logging
+import functools
+
+# for running a shard while the connection keeps serving heartbeats
+import threading
+
+# the connections are opened again when the broker goes away
+from rmq_connection import ConnectionManager, RECOVERABLE_ERRORS
+
+# the work items, every shard is claimed by one of the worker controllers
+SHARDS_QUEUE = 'test_shards'
+# a message for every finished shard on a queue of the run's own (shards_done.<run id>), collected by the
+# controller which owns the run. a queue per run, so a coordinator never takes the done messages of another's run
+SHARDS_DONE_QUEUE = 'shards_done'
+
+# persistent messages on durable queues, so a broker restart doesn't lose the run's progress
+PERSISTENT = pika.BasicProperties(delivery_mode=2)
+
+def declare_shard_queues(channel):
+    channel.queue_declare(queue=SHARDS_QUEUE, durable=True)
+
+def done_queue(run_id):
+    return '%s.%s' % (SHARDS_DONE_QUEUE, run_id)
+
+# splits the tests of a setup into work items of the run of up to shard_size tests, the tests of a suite stay together
+def split_into_shards(setup, run_id, shard_size):
+    suites = {}
+    for test in setup['SuitesToRun']:
+        suites.setdefault(test.split('/')[0], []).append(test)
+    chunks = []
+    for tests in suites.values():
+        chunks.extend(tests[index:index + shard_size] for index in range(0, len(tests), shard_size))
+    return [{'setup_id' : str(setup['_id']), 'run_id' : run_id, 'shard' : index, 'shards' : len(chunks), 'tests' : tests,
+             'done_queue' : done_queue(run_id)}
+            for index, tests in enumerate(chunks)]
+
+def publish_shards(rmq_handler, shards):
+    for shard in shards:
+        rmq_handler.send('', SHARDS_QUEUE, dumps(shard), PERSISTENT)
+    rmq_handler.flush_publishes()
+
+
+# claims shards one at a time (prefetch) and acks each only after its results and its done message were published,
+# so the shard of a worker which crashed is redelivered to another one. run_shard(shard, headers) returns the number
+# of results, headers are the headers of the shard's message. the connection is opened again when the broker goes
+# away, the shards which weren't acked on the lost channel are redelivered, and a shard which comes again while it's
+# still running here is acked once that run is done instead of being run twice at once.
+class ShardWorker:
+    def __init__(self, connection_parameters, run_shard, prefetch_count=1):
+        self.run_shard = run_shard
+        self.prefetch_count = prefetch_count
+        self.logger = logging.getLogger('ctrl')
+        # (run id, shard) -> (channel, method) of the latest delivery of every shard which is running
+        self.deliveries = {}
+        self.lock = threading.Lock()
+        self.connection_manager = ConnectionManager(connection_parameters, self.on_channel, self.logger)
+
+    def on_channel(self, channel):
+        declare_shard_queues(channel)
+        channel.basic_qos(prefetch_count=self.prefetch_count)
+        channel.basic_consume(queue=SHARDS_QUEUE, on_message_callback=self.on_shard)
+
+    def on_shard(self, ch, method, props, body):
+        shard = loads(body)
+        key = (shard.get('run_id', shard['setup_id']), shard['shard'])
+        with self.lock:
+            is_running = key in self.deliveries
+            self.deliveries[key] = (ch, method)
+        if is_running:
+            message = 'ctrl: shard %d/%d of %s came again while it runs here' % (shard['shard'] + 1, shard['shards'], key[0])
+            self.logger.info(message)
+            return
+        message = 'ctrl: claimed shard %d/%d of %s (%d tests)%s' % (
+            shard['shard'] + 1, shard['shards'], shard['setup_id'], len(shard['tests']), ' again' if method.redelivered else '')
+        self.logger.info(message)
+        threading.Thread(target=self.run, args=(key, props, shard), daemon=True).start()
+
+    # runs in a thread of its own, the connection's thread keeps the heartbeats going meanwhile
+    def run(self, key, props, shard):
+        try:
+            num_of_results = self.run_shard(shard, props.headers)
+            finish = functools.partial(self.finish, shard, num_of_results)
+        except Exception as error:
+            message = 'ctrl: shard %d of %s failed - %s' % (shard['shard'], shard['setup_id'], error)
+            self.logger.error(message)
+            finish = self.fail
+        with self.lock:
+            ch, method = self.deliveries.pop(key)
+        # a lost connection gives the shard back to the queue by itself
+        self.connection_manager.add_callback_threadsafe(functools.partial(finish, ch, method))
+
+    def finish(self, shard, num_of_results, ch, method):
+        if not ch.is_open:
+            return
+        done = {'run_id' : shard.get('run_id', shard['setup_id']), 'shard' : shard['shard'], 'shards' : shard['shards'], 'results' : num_of_results}
+        ch.basic_publish(exchange='', routing_key=shard['done_queue'], body=dumps(done), properties=PERSISTENT)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def fail(self, ch, method):
+        if ch.is_open:
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+    def start_consuming(self):
+        self.connection_manager.consume()
+
+    def stop(self):
+        self.connection_manager.stop_consuming()
+
+
+# counts the done messages of the expected runs, on_complete(run_id, num_of_results) is called once every shard
+# of a run reported in. a shard which was run twice (redelivered after a crash) is counted once. the done queue of
+# a run is durable, a coordinator which is restarted mid run (or whose connection was opened again) gets the done
+# messages which came meanwhile, and it's deleted once the run is complete.
+class ShardAggregator(threading.Thread):
+    def __init__(self, connection_parameters, on_complete):
+        super().__init__(daemon=True)
+        self.on_complete = on_complete
+        self.logger = logging.getLogger('ctrl')
+        # run id -> shard -> number of results
+        self.runs = {}
+        self.lock = threading.Lock()
+        self.connection_manager = ConnectionManager(connection_parameters, self.on_channel, self.logger)
+
+    # the done queues of the runs which aren't complete yet, on every new channel
+    def on_channel(self, channel):
+        with self.lock:
+            run_ids = list(self.runs)
+        for run_id in run_ids:
+            self.consume_run(channel, run_id)
+
+    def consume_run(self, channel, run_id):
+        channel.queue_declare(queue=done_queue(run_id), durable=True)
+        channel.basic_consume(queue=done_queue(run_id), on_message_callback=self.on_shard_done)
+
+    # to be called before the run's shards are published, and before the aggregator is started
+    def expect(self, run_id):
+        with self.lock:
+            self.runs[run_id] = {}
+        try:
+            self.consume_run(self.connection_manager.channel, run_id)
+        except RECOVERABLE_ERRORS as error:
+            # the new channel consumes the run's queue, see on_channel
+            self.connection_manager.reconnect(error)
+
+    def on_shard_done(self, ch, method, props, body):
+        done = loads(body)
+        with self.lock:
+            shards = self.runs.get(done['run_id'])
+            if shards is None:
+                # a shard which was run again after its run was complete
+                message = 'ctrl: ignoring a done shard of %s, the run is complete' % done['run_id']
+                self.logger.info(message)
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
+            shards[done['shard']] = done['results']
+            is_complete = len(shards) == done['shards']
+            if is_complete:
+                del self.runs[done['run_id']]
+        message = 'ctrl: shard %d/%d of %s is done' % (done['shard'] + 1, done['shards'], done['run_id'])
+        self.logger.info(message)
+        if is_complete:
+            self.on_complete(done['run_id'], sum(shards.values()))
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        if is_complete:
+            ch.queue_delete(queue=method.routing_key)
+
+    def run(self):
+        self.connection_manager.consume()
+
+    def stop(self):
+        self.connection_manager.stop_consuming()
+        self.join()
+        self.connection_manager.close()
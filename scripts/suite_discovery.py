@@ -0,0 +1,144 @@
+# the test suites list of a tree of .tdf files (a directory of every suite: dlep/, snmp/...), from an index of the
+# files which were parsed before. the index is keyed by the file's path and checked against its mtime and size, only
+# the new files and the files whose mtime or size changed are parsed again (and count as changed if their hash did).
+import os
+
+import re
+
+import json
+
+import hashlib
+
+import logging
+
+from mongodb_handler import mongo_operation
+
+# for parsing the files in parallel. threads and not processes, the controller forks while its connections are open
+# otherwise. reading the files and hashing them (the most of a parse) release the gil
+from concurrent.futures import ThreadPoolExecutor
+
+CONFIGURATION_COLLECTION = 'Configuration'
+INDEX_VERSION = 1
+TEST_EXTENSION = '.tdf'
+CHUNK_SIZE = 64
+
+# a test's name is its 'Name:' (or 'Title:') line, or its file name without one
+NAME_PATTERN = re.compile(r'^\s*(?:name|title)\s*[:=]\s*(.+?)\s*$', re.IGNORECASE | re.MULTILINE)
+
+
+# runs in a worker thread, None for a file which can't be read as a test
+def parse_test_file(root, path):
+    try:
+        with open(os.path.join(root, path), 'rb') as file:
+            content = file.read()
+        text = content.decode('utf-8')
+    except (OSError, UnicodeDecodeError):
+        return None
+    match = NAME_PATTERN.search(text)
+    return {'hash' : hashlib.sha1(content).hexdigest(),
+            'name' : match.group(1) if match else os.path.splitext(os.path.basename(path))[0]}
+
+def parse_test_files(root, paths):
+    return [parse_test_file(root, path) for path in paths]
+
+# the (path, mtime, size) of every test file, the path is relative to root with '/' separators
+def scan_tree(root):
+    files = []
+    directories = [root]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.name.endswith(TEST_EXTENSION):
+                    stat = entry.stat()
+                    path = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                    files.append((path, stat.st_mtime_ns, stat.st_size))
+    return files
+
+
+# the id of the latest test suites list of the tree, None if it was never discovered. a single indexed query,
+# whatever the size of the tree
+def find_test_suites(mdb_handler, root):
+    with mongo_operation('find_one', CONFIGURATION_COLLECTION):
+        document = mdb_handler.db[CONFIGURATION_COLLECTION].find_one(
+            {'ConfigType' : 'AvailableTestSuites', 'Root' : os.path.abspath(root)}, {'_id' : 1}, sort=[('_id', -1)])
+    return document['_id'] if document is not None else None
+
+
+class SuiteDiscovery:
+    def __init__(self, root, index_path=None, workers=16):
+        self.root = root
+        self.index_path = index_path or os.path.join(root, '.suites-index.json')
+        self.workers = workers
+        self.logger = logging.getLogger('ctrl')
+        # path -> {'mtime', 'size', 'hash', 'name'}
+        self.files = {}
+
+    # the index of the last discovery, False if there's none (or it can't be read)
+    def load_index(self):
+        try:
+            with open(self.index_path) as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if index.get('version') != INDEX_VERSION or index.get('root') != os.path.abspath(self.root):
+            return False
+        self.files = index['files']
+        return True
+
+    # written aside and renamed over the index, so a crash mid write leaves the old index
+    def save_index(self):
+        temporary_path = '%s.%d' % (self.index_path, os.getpid())
+        try:
+            with open(temporary_path, 'w') as file:
+                json.dump({'version' : INDEX_VERSION, 'root' : os.path.abspath(self.root), 'files' : self.files}, file)
+            os.replace(temporary_path, self.index_path)
+        except OSError as error:
+            message = 'ctrl: could not save the suites index to %s - %s' % (self.index_path, error)
+            self.logger.warning(message)
+
+    # walks the tree and parses the new and the changed files in parallel, returns the number of files which changed
+    def refresh(self):
+        scanned = scan_tree(self.root)
+        changed = [(path, mtime, size) for path, mtime, size in scanned
+                   if path not in self.files or (self.files[path]['mtime'], self.files[path]['size']) != (mtime, size)]
+        removed = set(self.files) - set(path for path, mtime, size in scanned)
+        if changed:
+            paths = [path for path, mtime, size in changed]
+            # in chunks, a task per file costs about as much as parsing a small file
+            chunks = [paths[index:index + CHUNK_SIZE] for index in range(0, len(paths), CHUNK_SIZE)]
+            with ThreadPoolExecutor(self.workers) as pool:
+                parsed = [test for tests in pool.map(parse_test_files, [self.root] * len(chunks), chunks) for test in tests]
+            updates = list(zip(changed, parsed))
+        else:
+            updates = []
+        num_of_changes = len(removed)
+        for path in removed:
+            del self.files[path]
+        for (path, mtime, size), test in updates:
+            if test is None:
+                message = 'ctrl: skipping %s, it is not a test file' % path
+                self.logger.warning(message)
+                num_of_changes += self.files.pop(path, None) is not None
+                continue
+            previous = self.files.get(path)
+            num_of_changes += previous is None or previous['hash'] != test['hash']
+            test.update({'mtime' : mtime, 'size' : size})
+            self.files[path] = test
+        if updates or removed:
+            self.save_index()
+        return num_of_changes
+
+    # the AvailableTestSuites configuration of the indexed files, the suites and their tests sorted by name
+    def test_suites(self):
+        suites = {}
+        for path in sorted(self.files):
+            suites.setdefault(path.split('/')[0], []).append(path)
+        return {
+            'ConfigType' : 'AvailableTestSuites',
+            'Root' : os.path.abspath(self.root),
+            'TestSuites' : [{'Name' : suite,
+                             'Tests' : tests,
+                             'TestNames' : [self.files[path]['name'] for path in tests]} for suite, tests in sorted(suites.items())],
+        }
@@ -0,0 +1,92 @@
+# .tdf test definitions compiled once into a compact form and kept in an lru cache, so a test which runs again
+# (in the next run of a controller in the 'multi' or 'worker' mode, or in another shard) isn't read and parsed again
+import os
+
+import re
+
+import sys
+
+import threading
+
+from collections import OrderedDict
+
+from metrics import CacheStats
+
+# 'step 3: send Peer_Offer within 500 ms' -> ('send', ('Peer_Offer',), 500)
+STEP_PATTERN = re.compile(r'^\s*step\s+\d+\s*:\s*(.*?)\s*$', re.IGNORECASE)
+HEADER_PATTERN = re.compile(r'^\s*([A-Za-z][\w ]*?)\s*[:=]\s*(.*?)\s*$')
+TIMEOUT_PATTERN = re.compile(r'\s+within\s+(\d+)\s*ms$', re.IGNORECASE)
+
+
+# a compiled test: its headers (Name, Title...) and its steps as (verb, arguments, timeout in ms or None) tuples,
+# the verbs and the arguments are interned, so the same words of many tests are stored once
+class TestDefinition:
+    __slots__ = ('path', 'name', 'headers', 'steps')
+
+    def __init__(self, path, name, headers, steps):
+        self.path = path
+        self.name = name
+        self.headers = headers
+        self.steps = steps
+
+
+def compile_test(path, text):
+    headers = {}
+    steps = []
+    for line in text.splitlines():
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        step = STEP_PATTERN.match(line)
+        if step is not None:
+            action = step.group(1)
+            timeout = TIMEOUT_PATTERN.search(action)
+            if timeout is not None:
+                action = action[:timeout.start()]
+            words = [sys.intern(word) for word in action.split()]
+            steps.append((words[0] if words else '', tuple(words[1:]), int(timeout.group(1)) if timeout else None))
+            continue
+        header = HEADER_PATTERN.match(line)
+        if header is not None:
+            headers[sys.intern(header.group(1).lower())] = header.group(2)
+    name = headers.get('name') or headers.get('title') or os.path.splitext(os.path.basename(path))[0]
+    return TestDefinition(path, name, headers, tuple(steps))
+
+def load_test(root, path):
+    with open(os.path.join(root, path), encoding='utf-8') as file:
+        return compile_test(path, file.read())
+
+
+# the compiled definitions of the tests under root by their path, the least recently used first. a cached definition
+# is used as long as the file's mtime and size didn't change, checking them costs a stat and not a read and a parse.
+# the compiling is done outside of the lock, two threads which miss the same test at once compile it twice.
+class DefinitionCache:
+    def __init__(self, root, max_size):
+        self.root = root
+        self.max_size = max_size
+        # path -> (mtime, size, definition)
+        self.definitions = OrderedDict()
+        self.lock = threading.Lock()
+        self.cache_stats = CacheStats('test_definition_cache', 'test definition cache', lambda: len(self.definitions))
+
+    def get(self, path):
+        stat = os.stat(os.path.join(self.root, path))
+        with self.lock:
+            cached = self.definitions.get(path)
+            if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                self.definitions.move_to_end(path)
+                self.cache_stats.inc('hits')
+                return cached[2]
+            self.cache_stats.inc('misses')
+        definition = load_test(self.root, path)
+        with self.lock:
+            self.definitions[path] = (stat.st_mtime_ns, stat.st_size, definition)
+            self.definitions.move_to_end(path)
+            while len(self.definitions) > self.max_size:
+                self.definitions.popitem(last=False)
+        return definition
+
+    def stats(self):
+        return self.cache_stats.stats()
+
+    def export_metrics(self):
+        self.cache_stats.export()
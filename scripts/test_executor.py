@@ -0,0 +1,102 @@
+# for running the tests concurrently
+from concurrent.futures import ThreadPoolExecutor
+
+from collections import OrderedDict, deque, Counter
+
+# for collecting the finished tests in the dispatching thread
+import queue
+
+import logging
+
+import time
+
+
+# runs independent tests concurrently up to max_workers at a time and up to max_per_group (a device or a suite) per group.
+# the results are published from the calling thread as each test finishes (so a non thread safe publisher is fine),
+# and no more tests are started while get_backlog() - the depth of the results queue - is above max_backlog.
+# a publisher which buffers gets flush() called from the same thread whenever no test finished for idle_interval seconds.
+class TestExecutor:
+    def __init__(self, run_test, publish, max_workers, max_per_group=None, get_backlog=None, max_backlog=None, backlog_check_interval=10,
+                 flush=None, idle_interval=None):
+        self.run_test = run_test
+        self.publish = publish
+        self.flush = flush
+        self.idle_interval = idle_interval
+        self.max_workers = max_workers
+        self.max_per_group = max_per_group or max_workers
+        self.get_backlog = get_backlog
+        self.max_backlog = max_backlog
+        self.backlog_check_interval = backlog_check_interval
+        self.logger = logging.getLogger('ctrl')
+
+    # the tests runs in the worker threads, the test's result is passed on to the dispatching thread
+    def run_one(self, test, finished):
+        start = time.time()
+        try:
+            finished.put((test, self.run_test(test), None, time.time() - start))
+        except Exception as error:
+            finished.put((test, None, error, time.time() - start))
+
+    # blocks the dispatching of new tests while the consumers of the results are behind
+    def wait_for_backlog(self):
+        delay = 0.05
+        backlog = self.get_backlog()
+        while backlog > self.max_backlog:
+            message = 'ctrl: results backlog is %d, holding new tests' % backlog
+            self.logger.debug(message)
+            time.sleep(delay)
+            delay = min(delay * 2, 1)
+            backlog = self.get_backlog()
+
+    # returns the (test, result) pairs in the order the tests finished and the (test, error) pairs of the tests which raised
+    def run(self, tests, group_of=lambda test: None):
+        pending = OrderedDict()
+        for test in tests:
+            pending.setdefault(group_of(test), deque()).append(test)
+        running = Counter()
+        finished = queue.Queue()
+        results = []
+        errors = []
+        in_flight = 0
+        published = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or in_flight:
+                # starting as many tests as the limits allow, taking one test of every group in turn
+                started = True
+                while started and in_flight < self.max_workers:
+                    started = False
+                    for group in list(pending):
+                        if in_flight == self.max_workers:
+                            break
+                        if running[group] == self.max_per_group:
+                            continue
+                        test = pending[group].popleft()
+                        if not pending[group]:
+                            del pending[group]
+                        running[group] += 1
+                        in_flight += 1
+                        started = True
+                        pool.submit(self.run_one, test, finished)
+
+                try:
+                    test, result, error, duration = finished.get(timeout=self.idle_interval)
+                except queue.Empty:
+                    self.flush()
+                    continue
+                in_flight -= 1
+                running[group_of(test)] -= 1
+                if error is not None:
+                    message = 'ctrl: test %s failed to run - %s' % (test, error)
+                    self.logger.error(message)
+                    errors.append((test, error))
+                    continue
+                message = 'ctrl: test %s done in %.3f seconds' % (test, duration)
+                self.logger.debug(message)
+                self.publish(test, result)
+                results.append((test, result))
+                published += 1
+                if self.get_backlog is not None and published % self.backlog_check_interval == 0:
+                    self.wait_for_backlog()
+
+        return results, errors
@@ -0,0 +1,59 @@
+# the timeline of a traced run (TRACING=1 on the app, the controller and the report generator), rebuilt from
+# the 'Trace Spans' collection: every handled message with the time it waited in its queue, the time its handler
+# took and how much of that was mongo, then the totals of every stage with the slowest hop first.
+#
+# usage: MONGO_HOST=localhost python trace-timeline.py [trace id, the latest run by default]
+
+import sys
+
+from pymongo import DESCENDING
+
+from mongodb_handler import MongodbHandler
+
+COLLECTION = 'Trace Spans'
+
+
+def milliseconds(seconds):
+    return '%10.1f' % (seconds * 1000) if seconds is not None else '%10s' % '-'
+
+def latest_trace_id(mdb_handler):
+    span = mdb_handler.get_collection(COLLECTION).find_one({}, {'trace_id' : 1}, sort=[('started_at', DESCENDING)])
+    return span['trace_id'] if span is not None else None
+
+def print_timeline(spans):
+    start = spans[0]['started_at']
+    print('%10s  %-18s %-16s %-16s %10s %10s %10s' % ('at (ms)', 'stage', 'service', 'sent by', 'queue (ms)', 'handler', 'mongo'))
+    for span in spans:
+        print('%10.1f  %-18s %-16s %-16s %s %s %s' % (
+            (span['started_at'] - start) * 1000, span['stage'], span['service'], span.get('sent_by') or '-',
+            milliseconds(span['queue_wait']), milliseconds(span['handler_time']), milliseconds(span['mongo_time'])))
+    end = max(span['started_at'] + (span['handler_time'] or 0) for span in spans)
+    print('the run took %.1f ms' % ((end - start) * 1000))
+
+# the results stage is a span per batch, so the stages are compared by their totals
+def print_stages(spans):
+    stages = {}
+    for span in spans:
+        stage = stages.setdefault(span['stage'], {'count' : 0, 'queue_wait' : 0.0, 'handler_time' : 0.0, 'mongo_time' : 0.0})
+        stage['count'] += 1
+        for field in ['queue_wait', 'handler_time', 'mongo_time']:
+            stage[field] += span[field] or 0.0
+    print()
+    print('%-18s %6s %12s %12s %12s' % ('stage', 'spans', 'queue (ms)', 'handler', 'mongo'))
+    for name, stage in sorted(stages.items(), key=lambda item: item[1]['queue_wait'] + item[1]['handler_time'], reverse=True):
+        print('%-18s %6d %s   %s   %s' % (name, stage['count'], milliseconds(stage['queue_wait']),
+                                        milliseconds(stage['handler_time']), milliseconds(stage['mongo_time'])))
+
+def main():
+    mdb_handler = MongodbHandler(ensure_indexes=False)
+    trace_id = sys.argv[1] if len(sys.argv) > 1 else latest_trace_id(mdb_handler)
+    spans = list(mdb_handler.get_documents(COLLECTION, 'trace_id', trace_id, projection={'_id' : 0}, sort=[('started_at', 1)]))
+    if not spans:
+        print('no spans of trace %s' % trace_id)
+        return
+    print('trace %s, %d spans' % (trace_id, len(spans)))
+    print_timeline(spans)
+    print_stages(spans)
+
+if __name__ == '__main__':
+    main()
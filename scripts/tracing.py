@@ -0,0 +1,128 @@
+# for timing the stages of a run across the services
+import time
+
+import uuid
+
+# every thread handles one message at a time, so its current span is kept per thread
+import threading
+
+from runs import RUN_ID_HEADER
+
+from contextlib import contextmanager
+
+
+# stamps outgoing messages with the run's trace id and the time they were sent, and records a span for every
+# handled message: how long it waited in the queue, how long its handler took and how much of that was mongo.
+# the spans go to sink (a callable taking a span document) and are dropped while there's no sink.
+# a thread carries on the trace of the message it handles, the threads which handle no message carry on the trace
+# of the run their messages belong to (by the run id header), or else the trace the process opened with new_trace.
+class Tracer:
+    def __init__(self):
+        self.service = None
+        self.sink = None
+        self.trace_id = None
+        self.local = threading.local()
+        # run id -> trace id, while a span of the run is open
+        self.run_traces = {}
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.sink is not None
+
+    def configure(self, service, sink):
+        self.service = service
+        self.sink = sink
+
+    # the service which starts a run opens its trace, the others adopt it from the messages they handle
+    def new_trace(self):
+        self.trace_id = str(uuid.uuid4())
+        return self.trace_id
+
+    # the messages sent while handling a message carry on the trace of the handled message
+    def headers(self, routing_key, headers=None):
+        headers = dict(headers or {})
+        headers.update({'trace_id' : self.current_trace_id(headers), 'sent_at' : time.time(), 'sent_by' : self.service, 'stage' : routing_key})
+        return headers
+
+    def current_span(self):
+        return getattr(self.local, 'span', None)
+
+    # of the calling thread, headers are of the message it handles or sends
+    def current_trace_id(self, headers=None):
+        span = self.current_span()
+        if span is not None:
+            return span['trace_id']
+        run_id = (headers or {}).get(RUN_ID_HEADER)
+        with self.lock:
+            return self.run_traces.get(run_id, self.trace_id)
+
+    # a span around the handling of a message with the given headers (or around any other piece of work without them)
+    @contextmanager
+    def span(self, stage, headers=None):
+        if not self.enabled:
+            yield None
+            return
+        headers = headers or {}
+        trace_id = headers.get('trace_id') or self.current_trace_id(headers)
+        span = {'trace_id' : trace_id, 'service' : self.service, 'stage' : stage, 'started_at' : time.time(),
+                'queue_wait' : None, 'handler_time' : None, 'mongo_time' : 0.0, 'sent_by' : headers.get('sent_by')}
+        if headers.get('sent_at'):
+            span['queue_wait'] = span['started_at'] - headers['sent_at']
+        # the run's trace is kept by the outermost span of the run
+        run_id = headers.get(RUN_ID_HEADER)
+        with self.lock:
+            keeps_run_trace = run_id is not None and trace_id is not None and run_id not in self.run_traces
+            if keeps_run_trace:
+                self.run_traces[run_id] = trace_id
+        parent = self.current_span()
+        self.local.span = span
+        try:
+            yield span
+        finally:
+            self.local.span = parent
+            if keeps_run_trace:
+                with self.lock:
+                    del self.run_traces[run_id]
+            span['handler_time'] = time.time() - span['started_at']
+            self.sink(span)
+
+    # a span of work which was timed elsewhere, like an rpc round trip
+    def record(self, stage, started_at, handler_time, headers=None, mongo_time=0.0):
+        if not self.enabled:
+            return
+        headers = headers or {}
+        span = {'trace_id' : headers.get('trace_id') or self.current_trace_id(headers), 'service' : self.service, 'stage' : stage, 'started_at' : started_at,
+                'queue_wait' : started_at - headers['sent_at'] if headers.get('sent_at') else None,
+                'handler_time' : handler_time, 'mongo_time' : mongo_time, 'sent_by' : headers.get('sent_by')}
+        self.sink(span)
+
+    # adds the time of a mongo call to the span of the calling thread
+    @contextmanager
+    def mongo_time(self):
+        span = self.current_span()
+        if span is None:
+            yield
+            return
+        start = time.time()
+        try:
+            yield
+        finally:
+            span['mongo_time'] += time.time() - start
+
+    # for calls which were timed by the caller
+    def add_mongo_time(self, seconds):
+        span = self.current_span()
+        if span is not None:
+            span['mongo_time'] += seconds
+
+
+# the tracer of the process, handlers and services share it
+tracer = Tracer()
+
+# the spans are written to mongo in batches, so tracing costs a round trip per batch and not per message
+def configure_tracing(service, mdb_handler, batch_size=100, flush_interval=1.0):
+    writer = mdb_handler.buffered_writer('Trace Spans', batch_size, flush_interval)
+    writer.start_flushing()
+    tracer.configure(service, writer.add)
+    return writer